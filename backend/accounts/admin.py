@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from api.admin import ScheduledDeletionAdminMixin
 from .models import User, Profile
 
 class ProfileInline(admin.StackedInline):
@@ -7,7 +8,7 @@ class ProfileInline(admin.StackedInline):
     can_delete = False
     verbose_name_plural = 'Profile'
 
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(ScheduledDeletionAdminMixin, UserAdmin):
     inlines = (ProfileInline,)
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'email_verified')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'email_verified')
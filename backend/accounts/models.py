@@ -8,6 +8,8 @@ from django.dispatch import receiver
 class User(AbstractUser):
     email = models.EmailField(_('email address'), unique=True)
     email_verified = models.BooleanField(default=False)
+    # Set when the account is scheduled for deletion, see api/deletion.py
+    deleted_at = models.DateTimeField(null=True, blank=True)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -1,3 +1,129 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from .deletion import schedule_deletion
+from .models import DeletionJob
 
-# Register your models here.
+def estimated_count(queryset):
+    """
+    The approximate number of rows in the table of ``queryset``, from
+    statistics the database keeps anyway, or None where there are none.
+    """
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # The rowid only grows, so this counts deleted rows too
+            cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+            return cursor.fetchone()[0] or 0
+    return None
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for change lists of large tables. An unfiltered list is
+    counted from table statistics; filtered ones exactly, but only up to
+    ADMIN_COUNT_LIMIT rows, so further pages need narrower filters. The
+    default manager's own conditions (hiding soft-deleted rows) don't count
+    as filters.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where == queryset.model._default_manager.all().query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > settings.ADMIN_COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
+
+class LargeTableAdminMixin:
+    """
+    Change lists that stay usable on tables of tens of millions of rows:
+
+    - page counts from EstimatedCountPaginator, and no second COUNT(*) of
+      the whole table or filter facets;
+    - search by exact value of the indexed columns in
+      ``indexed_search_fields``, which may be one relation away, e.g.
+      ``video__slug``. Those become ``video_id IN (SELECT id ... WHERE slug
+      = %s)``, so each condition is an index lookup where the default
+      ``icontains`` search joins and scans everything.
+
+    Admins using it list their related columns in ``list_select_related``,
+    use ``raw_id_fields`` for foreign keys, sort by an indexed column and
+    leave out ``date_hierarchy``, whose distinct-date query covers the whole
+    table.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    indexed_search_fields = ()
+
+    def get_search_fields(self, request):
+        return self.indexed_search_fields
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = Q(pk__in=[])
+        for path in self.indexed_search_fields:
+            relation, _, name = path.rpartition('__')
+            model = self.model._meta.get_field(relation).related_model if relation else self.model
+            field = model._meta.get_field(name)
+            try:
+                value = field.clean(term, None)
+            except ValidationError:
+                continue  # Not a valid value of this column, e.g. a UUID
+            if relation:
+                condition |= Q(**{f'{relation}__in': model._base_manager.filter(**{name: value}).values('pk')})
+            else:
+                condition |= Q(**{name: value})
+        return queryset.filter(condition), False
+
+def in_batches(queryset, batch_size=None):
+    """
+    The primary keys of ``queryset`` in lists of ADMIN_ACTION_BATCH_SIZE,
+    each read from where the previous one ended, for actions on any number
+    of selected rows.
+    """
+    batch_size = batch_size or settings.ADMIN_ACTION_BATCH_SIZE
+    keys = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        batch = list((keys if last is None else keys.filter(pk__gt=last))[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+class ScheduledDeletionAdminMixin:
+    """
+    Deletes through a DeletionJob (see api/deletion.py) instead of
+    cascading through every dependent in the request.
+    """
+    def delete_model(self, request, obj):
+        schedule_deletion(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            schedule_deletion(obj)
+
+    def get_deleted_objects(self, objs, request):
+        # Listing every dependent is exactly the work being deferred
+        perms_needed = set() if self.has_delete_permission(request) else {self.opts.verbose_name}
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, perms_needed, []
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_id', 'status', 'progress', 'created_at', 'updated_at', 'finished_at')
+    list_filter = ('status', 'model')
+    search_fields = ('object_id',)
+    readonly_fields = ('model', 'object_id', 'progress', 'error', 'created_at', 'updated_at', 'finished_at')
@@ -0,0 +1,152 @@
+"""
+Async implementations of the hottest read endpoints, used under ASGI.
+
+Authentication, permissions and throttling still run through DRF (in a
+worker thread), but the queries are issued with the async ORM and lists are
+serialized on the event loop from plain rows, so a slow query or a slow
+client does not hold on to a worker thread. Detail views serialize model
+instances, which may load related rows, in a thread. Every other method on the same URLs (and
+anything these views don't implement) falls through to the regular viewset.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from rest_framework import generics
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.response import Response
+
+from videos.models import Video, Category
+from notifications.models import Notification
+from .conditional import conditional, video_validators, notification_validators
+from .fast_serializers import video_plan, notification_plan
+from .pagination import AsyncPageNumberPagination
+from .permissions import IsOwnerOrReadOnly
+from .sparse import SparseFieldsViewMixin, video_listing, notification_listing
+from .serializers import VideoSerializer, NotificationSerializer
+from .views import VideoViewSet
+
+
+class AsyncReadAPIView(SparseFieldsViewMixin, generics.GenericAPIView):
+    """
+    Base class for async GET views with a sync fallback for other methods.
+    """
+    pagination_class = AsyncPageNumberPagination
+    fallback = None  # Sync DRF view serving every other method
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await sync_to_async(self.fallback)(request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Authentication may hit the database, so it runs in a thread
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await self.get(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self, queryset):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def serialize(self, obj):
+        return self.get_serializer(obj).data
+
+    async def alist(self, queryset, plan):
+        context = self.get_serializer_context()
+        plan = plan.select(context.get('selection'))
+        rows = plan.values(queryset)
+        page = await self.paginator.apaginate_queryset(rows, self.request, view=self)
+        if page is not None:
+            return self.get_paginated_response(plan.serialize(page, context))
+
+        return Response(plan.serialize([row async for row in rows], context))
+
+
+class VideoListView(AsyncReadAPIView):
+    serializer_class = VideoSerializer
+    permission_classes = [IsOwnerOrReadOnly]
+    filter_backends = VideoViewSet.filter_backends
+    filterset_fields = VideoViewSet.filterset_fields
+    search_fields = VideoViewSet.search_fields
+    ordering_fields = VideoViewSet.ordering_fields
+
+    def get_queryset(self):
+        return video_listing(Video.objects.visible_to(self.request.user), self.get_selection())
+
+    async def get(self, request, *args, **kwargs):
+        # Filter validation may look up related rows
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        return await self.alist(queryset, video_plan)
+
+
+class VideoDetailView(AsyncReadAPIView):
+    serializer_class = VideoSerializer
+    permission_classes = [IsOwnerOrReadOnly]
+    lookup_field = 'slug'
+
+    def get_queryset(self):
+        return video_listing(Video.objects.visible_to(self.request.user), self.get_selection())
+
+    @conditional(video_validators)
+    async def get(self, request, *args, **kwargs):
+        video = await self.aget_object(self.get_queryset())
+        return Response(await sync_to_async(self.serialize)(video))
+
+
+class FeaturedVideosView(AsyncReadAPIView):
+    serializer_class = VideoSerializer
+    permission_classes = [AllowAny]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.alist(Video.objects.featured(), video_plan)
+
+
+class CategoryVideosView(AsyncReadAPIView):
+    serializer_class = VideoSerializer
+    permission_classes = [AllowAny]
+    lookup_field = 'slug'
+
+    async def get(self, request, *args, **kwargs):
+        category = await self.aget_object(Category.objects.all())
+        videos = Video.objects.filter(
+            category=category,
+            privacy='public'
+        ).for_listing().order_by('-created_at')
+        return await self.alist(videos, video_plan)
+
+
+class NotificationListView(AsyncReadAPIView):
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return notification_listing(
+            Notification.objects.filter(recipient=self.request.user), self.get_selection()
+        )
+
+    @conditional(notification_validators)
+    async def get(self, request, *args, **kwargs):
+        return await self.alist(self.get_queryset(), notification_plan)
+
+
+class NotificationDetailView(NotificationListView):
+    lookup_field = 'pk'
+
+    @conditional(notification_validators)
+    async def get(self, request, *args, **kwargs):
+        notification = await self.aget_object(self.get_queryset())
+        return Response(await sync_to_async(self.serialize)(notification))
@@ -0,0 +1,148 @@
+"""
+Conditional GET for read endpoints.
+
+``@conditional(validators)`` computes the validators of a response before
+the view method runs, answers ``If-None-Match``/``If-Modified-Since`` with a
+304 without querying or serializing anything else, and otherwise adds
+``ETag`` and ``Last-Modified`` to the response. The validators come from the
+object's ``updated_at``, the denormalized counters and the version stamps in
+api/models.py, each a single indexed lookup.
+
+Responses are sent with ``Cache-Control: no-cache`` so browsers keep them
+but revalidate on every use, which turns repeat fetches of the same video,
+category list or notifications into an empty 304.
+"""
+
+import hashlib
+import inspect
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from mytube.metrics import record_cache
+from videos.models import Video
+from videos.signing import expires_at
+from .models import CollectionVersion
+
+
+def conditional(validators):
+    """
+    Decorate a GET view method (sync or async) with conditional handling.
+
+    ``validators(view, request, *args, **kwargs)`` returns ``(version,
+    last_modified)``, where ``version`` is anything with a stable ``repr()``
+    that changes whenever the response would. It returns ``(None, None)``
+    when there is nothing to validate (e.g. the object does not exist), in
+    which case the view runs as usual.
+    """
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @wraps(method)
+            async def wrapper(view, request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await method(view, request, *args, **kwargs)
+                etag, last_modified = await sync_to_async(_validate)(validators, view, request, args, kwargs)
+                response = _not_modified(request, etag, last_modified)
+                if response is None:
+                    response = await method(view, request, *args, **kwargs)
+                return _add_validators(request, response, etag, last_modified)
+        else:
+            @wraps(method)
+            def wrapper(view, request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return method(view, request, *args, **kwargs)
+                etag, last_modified = _validate(validators, view, request, args, kwargs)
+                response = _not_modified(request, etag, last_modified)
+                if response is None:
+                    response = method(view, request, *args, **kwargs)
+                return _add_validators(request, response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def _validate(validators, view, request, args, kwargs):
+    version, last_modified = validators(view, request, *args, **kwargs)
+    if version is None:
+        return None, None
+
+    if settings.MEDIA_SIGNED_URLS:
+        # Media URLs in the response are signed anew every MEDIA_URL_LIFETIME
+        expires = expires_at()
+        version = (version, expires)
+        renewed = datetime.fromtimestamp(expires - 2 * settings.MEDIA_URL_LIFETIME, tz=timezone.utc)
+        last_modified = last_modified and max(last_modified, renewed)
+
+    # The same data renders differently per URL (pagination, sparse
+    # fieldsets) and per format (JSON or the browsable API)
+    renderer = getattr(request, 'accepted_renderer', None)
+    key = repr((version, request.get_full_path(), getattr(renderer, 'format', None)))
+    etag = 'W/"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+    return etag, last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    if etag is None:
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    record_cache('conditional_get', response is not None)
+    return response
+
+
+def _add_validators(request, response, etag, last_modified):
+    if etag is None or response.status_code not in (200, 304):
+        return response
+    response.headers.setdefault('ETag', etag)
+    if last_modified is not None:
+        response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _latest(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+# Validators
+
+def category_validators(view, request, *args, **kwargs):
+    (stamp,) = CollectionVersion.stamps('categories')
+    return stamp, stamp[1]
+
+
+def video_validators(view, request, *args, **kwargs):
+    """
+    The video's own columns, counters included. View counts are updated
+    without touching ``updated_at``, so only an ETag is sent.
+    """
+    video = Video.objects.visible_to(request.user).filter(slug=kwargs.get('slug')).values_list(
+        'updated_at', 'views', 'likes_count', 'dislikes_count', 'comments_count'
+    ).first()
+    if video is None:
+        return None, None
+    return (video, CollectionVersion.stamps('users', 'categories')), None
+
+
+def comment_validators(view, request, *args, **kwargs):
+    video_id = Video.objects.visible_to(request.user).filter(slug=kwargs.get('slug')).values_list(
+        'id', flat=True
+    ).first()
+    if video_id is None:
+        return None, None
+    stamps = CollectionVersion.stamps(f'comments:{video_id}', 'users', 'deletions')
+    return stamps, _latest(*(updated_at for _, updated_at in stamps))
+
+
+def notification_validators(view, request, *args, **kwargs):
+    if not request.user.is_authenticated:
+        return None, None
+    stamps = CollectionVersion.stamps(f'notifications:{request.user.pk}', 'users', 'deletions')
+    return stamps, _latest(*(updated_at for _, updated_at in stamps))
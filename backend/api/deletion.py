@@ -0,0 +1,235 @@
+"""
+Chunked background deletion of videos and users.
+
+Deleting a popular video or an active user used to cascade through every
+view, like, comment and notification in the request's transaction. Now
+``schedule_deletion()`` only marks the object (``deleted_at``), which hides
+it and everything attached to it through the default managers, and records
+a ``DeletionJob``. ``manage.py process_deletions`` then removes the
+dependents in batches of DELETION_BATCH_SIZE rows, one transaction per
+batch, and finally the object itself; the media files of a video go with
+its row, i.e. last.
+
+Each step simply deletes whatever is still left, so a job interrupted by a
+crash carries on where it stopped when the command runs again. Workers
+claim a job by switching its status with a compare-and-set on
+``updated_at``, which every batch refreshes: several workers never run the
+same job, and a running job nobody touched for DELETION_STALE_SECONDS
+(its worker died) is taken over.
+"""
+
+import logging
+import traceback
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from accounts.models import User
+from videos.models import (
+    Video, CaptionCue, Comment, Fingerprint, Like, NearDuplicate, Playlist, PlaylistItem, SimilarVideo, Storyboard,
+    VideoView, batch_deleting,
+)
+from videos.suggestions import remove_videos
+from notifications.models import Notification
+from .models import CollectionVersion, DeletionJob
+
+logger = logging.getLogger(__name__)
+
+
+class Step:
+    """
+    Rows of ``model`` matching ``condition``, deleted children first.
+
+    ``after_batch(rows)`` gets the ``(pk, *columns)`` of each deleted batch
+    to update counters and version stamps once per batch.
+    """
+
+    def __init__(self, name, model, condition, columns=(), after_batch=None):
+        self.name = name
+        self.model = model
+        self.condition = condition
+        self.columns = columns
+        self.after_batch = after_batch
+
+    def next_batch(self, batch_size):
+        # Replies have higher ids than the comments they answer
+        queryset = self.model._base_manager.filter(self.condition).order_by('-pk')
+        return list(queryset.values_list('pk', *self.columns)[:batch_size])
+
+
+def schedule_deletion(obj):
+    """
+    Hide ``obj`` (a Video or User) right away and queue its deletion.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if isinstance(obj, Video):
+            Video.all_objects.filter(pk=obj.pk).update(deleted_at=now)
+            hidden = partial(remove_videos, [obj.pk])
+        elif isinstance(obj, User):
+            User.objects.filter(pk=obj.pk).update(deleted_at=now, is_active=False)
+            videos = Video.all_objects.filter(uploader=obj, deleted_at__isnull=True)
+            hidden = partial(remove_videos, list(videos.values_list('pk', flat=True)), obj.username)
+            videos.update(deleted_at=now)
+        else:
+            raise TypeError(f'Cannot schedule the deletion of {type(obj).__name__} objects')
+        target = {'model': obj._meta.label_lower, 'object_id': str(obj.pk)}
+        job = DeletionJob.objects.filter(status__in=['pending', 'running'], **target).first()
+        if job is None:
+            job = DeletionJob.objects.create(**target)
+        # Comments and notifications disappear from other people's lists
+        CollectionVersion.bump('deletions')
+        # No post_save signal for the update()
+        transaction.on_commit(hidden)
+    return job
+
+
+def _bump_notifications(rows):
+    CollectionVersion.bump(*{f'notifications:{recipient_id}' for _, recipient_id in rows})
+
+
+def _uncount_likes(rows):
+    removed = Counter((video_id, like_type) for _, video_id, like_type in rows)
+    for (video_id, like_type), count in removed.items():
+        Video.all_objects.filter(pk=video_id).add_to_counters(**{Like.COUNTERS[like_type]: -count})
+
+
+def _uncount_playlist_items(rows):
+    removed = Counter(playlist_id for _, playlist_id in rows)
+    for playlist_id, count in removed.items():
+        Playlist.objects.filter(pk=playlist_id).update(items_count=Greatest(F('items_count') - count, 0))
+
+
+def _refresh_videos(rows):
+    # Recounted: the replies of other users went along with the comments
+    video_ids = {video_id for _, video_id in rows}
+    Video.all_objects.filter(pk__in=video_ids).refresh_counters()
+    CollectionVersion.bump(*(f'comments:{video_id}' for video_id in video_ids))
+
+
+def video_steps(**videos):
+    """
+    Steps deleting the videos matching ``videos`` (lookups on Video) and
+    everything depending on them.
+    """
+    def on(path):
+        return Q(**{f'{path}__{lookup}': value for lookup, value in videos.items()})
+
+    on_videos = on('video')
+    return [
+        Step('video notifications', Notification, on_videos | on('comment__video'), ['recipient_id'], _bump_notifications),
+        Step('video likes', Like, on_videos),
+        Step('video views', VideoView, on_videos),
+        Step('video comments', Comment, on_videos),
+        Step('video captions', CaptionCue, on('track__video')),
+        Step('video playlist items', PlaylistItem, on_videos, ['playlist_id'], _uncount_playlist_items),
+        Step('similar videos', SimilarVideo, on_videos | on('similar')),
+        Step('near duplicates', NearDuplicate, on_videos | on('original')),
+        Step('video fingerprints', Fingerprint, on_videos),
+        Step('video storyboards', Storyboard, on_videos),
+        Step('videos', Video, Q(**videos)),
+    ]
+
+
+def user_steps(user_id):
+    """
+    Steps deleting the user's videos, then the user's own activity on other
+    videos and playlists. The user row goes last, after the steps.
+    """
+    return video_steps(uploader_id=user_id) + [
+        Step(
+            'notifications', Notification,
+            Q(recipient_id=user_id) | Q(sender_id=user_id) | Q(comment__user_id=user_id)
+            | Q(comment__parent__user_id=user_id),
+            ['recipient_id'], _bump_notifications
+        ),
+        Step('likes', Like, Q(user_id=user_id), ['video_id', 'like_type'], _uncount_likes),
+        Step('views', VideoView, Q(user_id=user_id)),
+        Step('comments', Comment, Q(user_id=user_id), ['video_id'], _refresh_videos),
+        Step('playlist items', PlaylistItem, Q(playlist__owner_id=user_id)),
+        Step('playlists', Playlist, Q(owner_id=user_id)),
+    ]
+
+
+def run_job(job, batch_size=None, log=logger.info):
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    if job.model == 'videos.video':
+        steps, target = video_steps(pk=job.object_id), None
+    elif job.model == 'accounts.user':
+        steps, target = user_steps(job.object_id), User._base_manager.filter(pk=job.object_id)
+    else:
+        raise ValueError(f'Unknown deletion target {job.model}')
+
+    job.status = 'running'
+    job.save(update_fields=['status', 'updated_at'])
+    token = batch_deleting.set(True)
+    try:
+        for step in steps:
+            while rows := step.next_batch(batch_size):
+                with transaction.atomic():
+                    deleted, _ = step.model._base_manager.filter(pk__in=[row[0] for row in rows]).delete()
+                    if step.after_batch is not None:
+                        step.after_batch(rows)
+                    job.progress[step.name] = job.progress.get(step.name, 0) + deleted
+                    job.save(update_fields=['progress', 'updated_at'])
+                log(f'{job}: {step.name} {job.progress[step.name]} deleted')
+        if target is not None:
+            target.delete()
+    except Exception:
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+    finally:
+        batch_deleting.reset(token)
+
+    job.status = 'done'
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    log(f'{job}: finished')
+
+
+def claim(job):
+    """
+    Mark ``job`` running, unless another worker changed it since it was
+    read. Returns whether this worker got it.
+    """
+    now = timezone.now()
+    claimed = DeletionJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+        status='running', updated_at=now
+    )
+    job.status, job.updated_at = 'running', now
+    return bool(claimed)
+
+
+def claimable_jobs(retry_failed=False):
+    """
+    Queued jobs, running ones whose worker stopped updating them, and with
+    ``retry_failed`` failed ones.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.DELETION_STALE_SECONDS)
+    statuses = ['pending'] + (['failed'] if retry_failed else [])
+    return DeletionJob.objects.filter(Q(status__in=statuses) | Q(status='running', updated_at__lt=stale))
+
+
+def run_pending_jobs(batch_size=None, retry_failed=False, log=logger.info):
+    """
+    Run the claimable jobs, oldest first, that no other worker claims first.
+    """
+    count = 0
+    for job in claimable_jobs(retry_failed):
+        if not claim(job):
+            continue
+        try:
+            run_job(job, batch_size, log)
+        except Exception:
+            logger.exception('Deletion job %s failed', job.pk)
+        count += 1
+    return count
@@ -0,0 +1,147 @@
+"""
+Streaming exports of a channel's data.
+
+``GET /api/exports/<kind>.<csv|jsonl>[.gz]`` (``ExportView``) and ``manage.py
+export_channel`` write one of:
+
+``videos``
+    the channel's videos with their counters;
+``views``
+    views per video and day;
+``comments``
+    the comments on the channel's videos.
+
+Rows are read with ``iterator(chunk_size=EXPORT_CHUNK_SIZE)``, from a
+server-side cursor on PostgreSQL (unless DB_PGBOUNCER turns those off), and
+encoded and, with ``.gz``, compressed as they come, in blocks of about
+64 KiB. Nothing holds more than a chunk of rows, so memory use does not
+depend on the size of the export.
+"""
+
+import csv
+import zlib
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from videos.models import Comment, Video, VideoView
+
+EXPORT_KINDS = ('videos', 'views', 'comments')
+ENCODINGS = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+BLOCK_SIZE = 64 * 1024
+
+
+def export_rows(kind, user):
+    """
+    The column names and a queryset of value tuples of export ``kind`` for
+    the channel of ``user``.
+    """
+    if kind == 'videos':
+        columns = (
+            'id', 'slug', 'title', 'privacy', 'category', 'duration', 'views',
+            'likes', 'dislikes', 'comments', 'created_at', 'updated_at',
+        )
+        rows = Video.objects.filter(uploader=user).order_by('created_at').values_list(
+            'id', 'slug', 'title', 'privacy', 'category__name', 'duration', 'views',
+            'likes_count', 'dislikes_count', 'comments_count', 'created_at', 'updated_at',
+        )
+    elif kind == 'views':
+        columns = ('day', 'video', 'views')
+        rows = VideoView.objects.filter(
+            video__uploader=user, video__deleted_at__isnull=True
+        ).annotate(day=TruncDate('viewed_at')).values_list('day', 'video__slug').annotate(
+            views=Count('id')
+        ).order_by('day', 'video__slug')
+    elif kind == 'comments':
+        columns = ('id', 'video', 'parent', 'user', 'text', 'created_at', 'updated_at')
+        rows = Comment.objects.filter(video__uploader=user, video__deleted_at__isnull=True).order_by('pk').values_list(
+            'id', 'video__slug', 'parent_id', 'user__username', 'text', 'created_at', 'updated_at',
+        )
+    else:
+        raise ValueError(f'Unknown export "{kind}"')
+    return columns, rows
+
+
+class _Line:
+    """
+    File-like target of ``csv.writer`` returning what is written.
+    """
+
+    def write(self, value):
+        return value
+
+
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _cell(value):
+    """
+    ``value`` as written to a CSV cell. Text a spreadsheet would evaluate
+    as a formula is quoted.
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def encode_csv(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns).encode()
+    for row in rows:
+        yield writer.writerow(_cell(value) for value in row).encode()
+
+
+def encode_jsonl(columns, rows):
+    for row in rows:
+        yield orjson.dumps(dict(zip(columns, row)), option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _blocks(chunks):
+    """
+    ``chunks`` joined into blocks of about BLOCK_SIZE bytes.
+    """
+    block, size = [], 0
+    for chunk in chunks:
+        block.append(chunk)
+        size += len(chunk)
+        if size >= BLOCK_SIZE:
+            yield b''.join(block)
+            block, size = [], 0
+    if block:
+        yield b''.join(block)
+
+
+def _gzip(blocks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(kind, user, encoding='csv', compress=False, chunk_size=None):
+    """
+    The export as an iterator of byte blocks.
+    """
+    columns, rows = export_rows(kind, user)
+    rows = rows.iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+    encode = encode_jsonl if encoding == 'jsonl' else encode_csv
+    blocks = _blocks(encode(columns, rows))
+    return _gzip(blocks) if compress else blocks
+
+
+async def aiter_blocks(blocks):
+    """
+    ``blocks`` for an ASGI response. Every block is read in the thread
+    holding the database connection, so the cursor is kept across them.
+    """
+    read = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    while (block := await read(blocks, done)) is not done:
+        yield block
@@ -0,0 +1,238 @@
+"""
+Read-only fast path for serializing lists of videos, comments and
+notifications.
+
+A ``FieldPlan`` walks a DRF serializer's fields once and compiles them into
+the list of columns to fetch with ``values()`` and a flat recipe for turning
+each row into the same dict the serializer would produce. Serializing a row
+is then a handful of dict lookups instead of a nested serializer instance
+and the field machinery per attribute, and the rendered JSON is
+byte-for-byte the same.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from videos.models import Comment
+from .serializers import VideoSerializer, CommentSerializer, NotificationSerializer, PlaylistItemSerializer
+
+# Fields whose representation of a database value is the value itself
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+# Upper bound on the compiled variants kept per plan for sparse fieldsets
+MAX_VARIANTS = 64
+
+
+class FieldPlan:
+    """
+    Compiled serialization recipe for one serializer class.
+
+    ``method_fields`` maps each SerializerMethodField to the queryset
+    annotation holding its value, or to None for fields that the plan fills
+    in itself after building the rows. Sparse fieldsets (see api/sparse.py)
+    get their own variant of the plan through ``select()``.
+    """
+
+    def __init__(self, serializer_class, method_fields=None, selection=None, base=None):
+        self.serializer_class = serializer_class
+        self.method_fields = method_fields or {}
+        self.base = base or self
+        self.variants = {}
+        self.columns = []
+        self.entries = self._compile(serializer_class(context={'selection': selection}), '')
+        self.columns = list(dict.fromkeys(self.columns))
+        self.keys = {entry[0] for entry in self.entries}
+
+    def _compile(self, serializer, prefix):
+        entries = []
+        model = serializer.Meta.model
+        for key, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = prefix + '__'.join(field.source_attrs)
+
+            if isinstance(field, serializers.SerializerMethodField):
+                if key not in self.method_fields:
+                    raise ImproperlyConfigured(
+                        f'{type(serializer).__name__}.{key} has no source for the fast path.'
+                    )
+                source = self.method_fields[key]
+                if source is not None:
+                    self.columns.append(source)
+                entries.append((key, source, None, None))
+            elif isinstance(field, serializers.Serializer):
+                related = model._meta.get_field(field.source).related_model
+                null_column = f'{column}__{related._meta.pk.name}'
+                self.columns.append(null_column)
+                entries.append((key, null_column, None, self._compile(field, column + '__')))
+            elif isinstance(field, serializers.FileField):
+                self.columns.append(column)
+                storage_url = model._meta.get_field(field.source).storage.url
+                storage = storage_url.__self__
+                if isinstance(storage, FileSystemStorage) and not getattr(storage, 'signs_urls', False):
+                    # Local URLs only depend on the name, so repeated pages
+                    # skip the comparatively slow urljoin(). Signed URLs
+                    # change over time and are cached by the storage.
+                    storage_url = lru_cache(maxsize=10000)(storage_url)
+                entries.append((key, column, ('file', storage_url), None))
+            elif isinstance(field, serializers.DateTimeField) and is_iso_datetime(field):
+                self.columns.append(column)
+                entries.append((key, column, ('datetime', field), None))
+            elif isinstance(field, serializers.RelatedField):
+                # values() already returns the related primary key
+                self.columns.append(column)
+                entries.append((key, column, None, None))
+            else:
+                self.columns.append(column)
+                convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+                entries.append((key, column, convert, None))
+        return entries
+
+    def select(self, selection):
+        """
+        The plan serializing only what ``selection`` asks for.
+        """
+        if selection is None:
+            return self
+        plan = self.variants.get(selection.key)
+        if plan is None:
+            if len(self.variants) >= MAX_VARIANTS:
+                self.variants.clear()
+            plan = type(self)(self.serializer_class, self.method_fields, selection, base=self)
+            self.variants[selection.key] = plan
+        return plan
+
+    def bind(self, entries, context):
+        """
+        Resolve the converters that depend on the request.
+        """
+        request = context.get('request')
+        bound = []
+        for key, column, convert, children in entries:
+            if children is not None:
+                children = self.bind(children, context)
+            elif isinstance(convert, tuple) and convert[0] == 'file':
+                convert = file_url(convert[1], request)
+            elif isinstance(convert, tuple) and convert[0] == 'datetime':
+                convert = iso_datetime(convert[1])
+            bound.append((key, column, convert, children))
+        return bound
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    def serialize(self, rows, context=None):
+        entries = self.bind(self.entries, context or {})
+        return [build(entries, row) for row in rows]
+
+
+class CommentFieldPlan(FieldPlan):
+    """
+    Comments with their nested replies, fetched one level per query rather
+    than one query per comment. The reply queries are synchronous.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Replies are matched to their parent by id, selected or not
+        if 'replies' in self.keys and 'id' not in self.columns:
+            self.columns.append('id')
+
+    def serialize(self, rows, context=None):
+        rows = list(rows)
+        comments = super().serialize(rows, context)
+        if 'replies' not in self.keys:
+            return comments
+
+        # Replies always use the full representation, like get_replies()
+        full = self.base
+        level = [(row['id'], comment) for row, comment in zip(rows, comments)]
+        while level:
+            by_id = dict(level)
+            for _, comment in level:
+                comment['replies'] = []
+            replies = Comment.objects.filter(parent__in=list(by_id)).order_by('-created_at')
+            reply_rows = list(full.values(replies))
+            level = []
+            for row, reply in zip(reply_rows, FieldPlan.serialize(full, reply_rows)):
+                by_id[row['parent']]['replies'].append(reply)
+                level.append((row['id'], reply))
+        return comments
+
+
+def file_url(storage_url, request):
+    def convert(name):
+        if not name:
+            return None
+        url = storage_url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    return convert
+
+
+def is_iso_datetime(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    return settings.USE_TZ and output_format is not None and output_format.lower() == ISO_8601
+
+
+def iso_datetime(field):
+    """
+    DateTimeField.to_representation for aware database values, with the
+    field timezone looked up once instead of once per value.
+    """
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def build(entries, row):
+    data = {}
+    for key, column, convert, children in entries:
+        if column is None:
+            data[key] = None
+            continue
+        value = row[column]
+        if value is None:
+            data[key] = None
+        elif children is not None:
+            data[key] = build(children, row)
+        elif convert is not None:
+            data[key] = convert(value)
+        else:
+            data[key] = value
+    return data
+
+
+video_plan = FieldPlan(VideoSerializer)
+comment_plan = CommentFieldPlan(CommentSerializer, method_fields={'replies': None})
+notification_plan = FieldPlan(NotificationSerializer)
+playlist_item_plan = FieldPlan(PlaylistItemSerializer)
+
+
+def fast_list(view, queryset, plan, context=None):
+    """
+    Paginated list response for ``queryset`` serialized through ``plan``.
+    """
+    if context is None:
+        context = view.get_serializer_context()
+    plan = plan.select(context.get('selection'))
+    rows = plan.values(queryset)
+    page = view.paginate_queryset(rows)
+    if page is not None:
+        return view.get_paginated_response(plan.serialize(page, context))
+    return Response(plan.serialize(rows, context))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from videos.captions import write_snapshot
+
+class Command(BaseCommand):
+    help = 'Writes the snapshot the transcript search index is loaded from'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.CAPTION_INDEX_PATH,
+            help='Snapshot file (default: CAPTION_INDEX_PATH)'
+        )
+
+    def handle(self, *args, **options):
+        cues, terms = write_snapshot(options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {cues} cues and {terms} terms into {options["output"]}'))
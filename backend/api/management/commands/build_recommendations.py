@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from videos.recommender import build_recommendations
+
+class Command(BaseCommand):
+    help = 'Rebuilds the similar videos and trending ranks behind the home feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every video, not only those with new interactions')
+        parser.add_argument('--top-k', type=int, help='Neighbours stored per video (default: RECOMMENDER_TOP_K)')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        build = build_recommendations(full=options['full'], top_k=options['top_k'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated the neighbours of {build.videos_updated} videos in {time.monotonic() - start:.1f}s'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from videos.storyboard import build_pending
+
+class Command(BaseCommand):
+    help = 'Builds the seek preview sprite sheets of videos that have none yet (needs ffmpeg)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Videos per run')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry videos that failed before')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new videos')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            built, failed = build_pending(options['limit'], options['retry_failed'], log=self.stdout.write)
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Built {built} storyboards, {failed} failed'))
+                return
+            if not built and not failed:
+                time.sleep(options['interval'])
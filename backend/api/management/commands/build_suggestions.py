@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from videos.suggestions import write_snapshot
+
+class Command(BaseCommand):
+    help = 'Writes the snapshot the search suggestion index is loaded from at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.SUGGEST_SNAPSHOT_PATH,
+            help='Snapshot file (default: SUGGEST_SNAPSHOT_PATH)'
+        )
+
+    def handle(self, *args, **options):
+        count = write_snapshot(options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} suggestions to {options["output"]}'))
@@ -0,0 +1,35 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import ENCODINGS, EXPORT_KINDS, stream_export
+
+class Command(BaseCommand):
+    help = "Streams a channel's videos, daily views or comments as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the channel')
+        parser.add_argument('kind', choices=EXPORT_KINDS)
+        parser.add_argument('--format', choices=sorted(ENCODINGS), default='csv', dest='encoding')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per query (default: EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'No user named {options["username"]}')
+        
+        blocks = stream_export(
+            options['kind'], user, options['encoding'], options['gzip'], options['chunk_size']
+        )
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in blocks:
+                output.write(block)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from videos.fingerprint import HashIndex, fingerprint_pending
+
+class Command(BaseCommand):
+    help = 'Hashes frames of videos that have no fingerprint yet and records near duplicates (needs ffmpeg)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Videos per run')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry videos that failed before')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new videos')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = HashIndex.load()
+        self.stdout.write(f'Loaded {len(index)} hashes of {len(index.owners_by_video)} videos in {time.monotonic() - started:.1f}s')
+        
+        while True:
+            done, failed, duplicates = fingerprint_pending(
+                index, options['limit'], options['retry_failed'], log=self.stdout.write
+            )
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Fingerprinted {done} videos, {duplicates} near duplicates, {failed} failed'
+                ))
+                return
+            if not done and not failed:
+                time.sleep(options['interval'])
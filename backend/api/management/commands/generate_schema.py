@@ -0,0 +1,33 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mytube.schema import generate_schema
+
+class Command(BaseCommand):
+    help = 'Writes the OpenAPI schema served at /api/docs/ (run at build or deploy time)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            default=settings.API_SCHEMA_DIR,
+            help='Directory to write schema.json and schema.yaml to (default: API_SCHEMA_DIR)'
+        )
+        parser.add_argument(
+            '--url',
+            default='',
+            help='Absolute base URL of the API, if the schema should name its host'
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        
+        for format, content in generate_schema(options['url']).items():
+            path = os.path.join(output_dir, f'schema{format}')
+            # Write then rename, so running servers never read half a file
+            with open(f'{path}.tmp', 'wb') as schema_file:
+                schema_file.write(content)
+            os.replace(f'{path}.tmp', path)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {path} ({len(content)} bytes)'))
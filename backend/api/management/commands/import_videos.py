@@ -0,0 +1,56 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from videos.importer import import_videos, items_from_directory, items_from_manifest
+
+class Command(BaseCommand):
+    help = 'Imports videos from a directory tree or a CSV/JSONL manifest, see videos/importer.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory of video files, or a .csv/.jsonl manifest')
+        parser.add_argument('--uploader', default='', help='Username or email of the uploader of rows without one')
+        parser.add_argument(
+            '--uploader-map',
+            help='CSV of "source uploader,username" pairs mapping manifest uploaders to users'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording finished items, skipped when run again (default: <source>.imported)'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+        parser.add_argument('--batch-size', type=int, default=200, help='Videos created per transaction')
+
+    def handle(self, *args, **options):
+        source = options['source'].rstrip(os.sep)
+        invalid = []
+        if os.path.isdir(source):
+            items = items_from_directory(source, invalid)
+        elif os.path.isfile(source):
+            items = items_from_manifest(source, invalid)
+        else:
+            raise CommandError(f'{source} does not exist')
+        
+        uploader_map = {}
+        if options['uploader_map']:
+            with open(options['uploader_map'], newline='', encoding='utf-8') as mapping:
+                uploader_map = dict(row[:2] for row in csv.reader(mapping) if len(row) >= 2)
+        
+        self.stdout.write(f'{len(items)} videos found in {source}, {len(invalid)} invalid')
+        result = import_videos(
+            items,
+            checkpoint_path=options['checkpoint'] or f'{source}.imported',
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            default_uploader=options['uploader'],
+            uploader_map=uploader_map,
+            log=self.stdout.write,
+        )
+        result.failed[:0] = invalid
+        
+        for key, error in result.failed:
+            self.stdout.write(self.style.ERROR(f'{key}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.imported} imported, {result.skipped} already imported, {len(result.failed)} failed'
+        ))
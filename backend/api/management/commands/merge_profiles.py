@@ -0,0 +1,73 @@
+import io
+import pstats
+import statistics
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mytube.profiling import EXTENSIONS, hot_functions, list_profiles, merge_collapsed
+
+class Command(BaseCommand):
+    help = 'Merges the request profiles in PROFILING_DIR and summarizes where the time goes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Profile directory (default: PROFILING_DIR)')
+        parser.add_argument('--tag', help='Only views/actions containing this, e.g. "video-related"')
+        parser.add_argument('--since', type=float, help='Only profiles of the last N minutes')
+        parser.add_argument(
+            '--mode',
+            choices=sorted(EXTENSIONS),
+            default=settings.PROFILING_MODE,
+            help='Kind of profiles to merge (default: PROFILING_MODE)'
+        )
+        parser.add_argument('--limit', type=int, default=20, help='Functions listed')
+        parser.add_argument(
+            '--output',
+            help='Write the merged profile here: collapsed stacks for flamegraph.pl/speedscope, or pstats'
+        )
+
+    def handle(self, *args, **options):
+        since = time.time() - options['since'] * 60 if options['since'] else None
+        profiles = [
+            profile for profile in list_profiles(options['dir'], options['tag'], since)
+            if profile.mode == options['mode']
+        ]
+        if not profiles:
+            raise CommandError('No matching profiles')
+        
+        durations = defaultdict(list)
+        for profile in profiles:
+            durations[profile.tag].append(profile.elapsed_ms)
+        self.stdout.write(f'{"requests":>8} {"mean ms":>8} {"p95 ms":>8} {"max ms":>8}  view.action')
+        for tag, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            values.sort()
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            self.stdout.write(
+                f'{len(values):>8} {statistics.fmean(values):>8.1f} {p95:>8} {values[-1]:>8}  {tag}'
+            )
+        self.stdout.write('')
+        
+        if options['mode'] == 'cprofile':
+            report = io.StringIO()
+            stats = pstats.Stats(*(profile.path for profile in profiles), stream=report)
+            stats.sort_stats('cumulative').print_stats(options['limit'])
+            self.stdout.write(report.getvalue(), ending='')
+            if options['output']:
+                stats.dump_stats(options['output'])
+        else:
+            stacks = merge_collapsed(profiles)
+            own, total = hot_functions(stacks)
+            samples = sum(stacks.values())
+            self.stdout.write(f'{samples} samples')
+            for title, counter in (('Self', own), ('Total', total)):
+                self.stdout.write(f'\n{title}:')
+                for function, count in counter.most_common(options['limit']):
+                    self.stdout.write(f'{count:>8} {count / samples:>6.1%}  {function}')
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8') as output:
+                    output.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+        
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Merged {len(profiles)} profiles into {options["output"]}'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.deletion import run_pending_jobs
+
+class Command(BaseCommand):
+    help = 'Deletes scheduled videos and users, and everything depending on them, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows per transaction (default: DELETION_BATCH_SIZE)')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry jobs that failed')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new jobs')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs(
+                options['batch_size'], options['retry_failed'], log=self.stdout.write
+            )
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Processed {count} deletion jobs'))
+                return
+            if not count:
+                time.sleep(options['interval'])
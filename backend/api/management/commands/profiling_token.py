@@ -0,0 +1,17 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mytube.profiling import make_token
+
+class Command(BaseCommand):
+    help = 'Prints a token that gets requests sent with it in "X-Profile" profiled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('login', help='Email address (or whatever USERNAME_FIELD is) of a staff user')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.filter(**{User.USERNAME_FIELD: options['login']}).first()
+        if user is None or not user.is_staff or not user.is_active:
+            raise CommandError(f'{options["login"]} is not an active staff user')
+        self.stdout.write(make_token(user))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from videos.playlists import rebalance_pending
+
+class Command(BaseCommand):
+    help = 'Rewrites the rank keys of playlists flagged for having grown long ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Playlists per run')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for flagged playlists')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            playlists, items = rebalance_pending(options['limit'], log=self.stdout.write)
+            if not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Rebalanced {playlists} playlists, {items} items'))
+                return
+            if not playlists:
+                time.sleep(options['interval'])
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from videos.integrity import scan_media
+
+class Command(BaseCommand):
+    help = 'Checks media files against the database: missing, orphaned and corrupt files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--manifest',
+            default=settings.MEDIA_MANIFEST_PATH,
+            help='Manifest of verified files (default: MEDIA_MANIFEST_PATH)'
+        )
+        parser.add_argument('--workers', type=int, default=16, help='Threads listing and hashing files')
+        parser.add_argument('--full', action='store_true', help='Re-hash files the manifest already has')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per query')
+        parser.add_argument(
+            '--delete-orphans',
+            action='store_true',
+            help='Delete orphaned blobs without a MediaBlob, older than MEDIA_ORPHAN_GRACE_SECONDS'
+        )
+
+    def handle(self, *args, **options):
+        result = scan_media(
+            options['manifest'],
+            workers=options['workers'],
+            full=options['full'],
+            chunk_size=options['chunk_size'],
+            delete_orphans=options['delete_orphans'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        
+        for label in result.skipped_storages:
+            self.stdout.write(self.style.WARNING(f'Skipped {label}: not stored on the local filesystem'))
+        for title, names in (
+            ('Missing', result.missing), ('Orphaned', result.orphaned), ('Corrupt', result.corrupt),
+            ('Deleted orphaned blobs', result.deleted),
+        ):
+            if names:
+                self.stdout.write(f'{title} ({len(names)}):')
+                for name in names:
+                    self.stdout.write(f'  {name}')
+        
+        self.stdout.write(
+            f'{result.files} files, {result.hashed} hashed ({result.hashed_bytes} bytes), '
+            f'{len(result.missing)} missing, {len(result.orphaned)} orphaned, {len(result.corrupt)} corrupt, {len(result.deleted)} deleted'
+        )
+        if result.missing or result.corrupt:
+            raise CommandError('Media integrity problems found')
+        self.stdout.write(self.style.SUCCESS('Media files OK'))
@@ -1,3 +1,102 @@
 from django.db import models
+from django.db.models import F
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
-# Create your models here.
+from videos.models import Category, Comment, batch_deleting
+from notifications.models import Notification
+
+class CollectionVersion(models.Model):
+    """
+    Version stamp bumped whenever anything in a collection changes, used to
+    build the ETag and Last-Modified validators in api/conditional.py
+    without touching the collection itself.
+
+    Names are 'categories', 'users', 'comments:<video id>' and
+    'notifications:<user id>', plus 'deletions', bumped whenever something
+    is scheduled for deletion and disappears from other collections.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+    @classmethod
+    def bump(cls, *names):
+        now = timezone.now()
+        for name in names:
+            updated = cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+            if updated:
+                continue
+            _, created = cls.objects.get_or_create(name=name, defaults={'version': 1, 'updated_at': now})
+            if not created:
+                # Created concurrently in the meantime
+                cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+
+    @classmethod
+    def stamps(cls, *names):
+        """
+        ``(version, updated_at)`` for each name, in one query. Collections
+        that never changed are ``(0, None)``.
+        """
+        found = dict(
+            (name, (version, updated_at))
+            for name, version, updated_at in cls.objects.filter(name__in=names).values_list(
+                'name', 'version', 'updated_at'
+            )
+        )
+        return [found.get(name, (0, None)) for name in names]
+
+class DeletionJob(models.Model):
+    """
+    Background deletion of a video or user and everything depending on it,
+    see api/deletion.py. ``progress`` counts the rows deleted per step.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    model = models.CharField(max_length=100)  # e.g. 'videos.video'
+    object_id = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    progress = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'Delete {self.model} {self.object_id} ({self.status})'
+
+@receiver([post_save, post_delete], sender=Category)
+def bump_categories(sender, instance, **kwargs):
+    CollectionVersion.bump('categories')
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def bump_users(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which the API never returns
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    CollectionVersion.bump('users')
+
+@receiver([post_save, post_delete], sender=Comment)
+def bump_comments(sender, instance, **kwargs):
+    if batch_deleting.get():
+        return
+    CollectionVersion.bump(f'comments:{instance.video_id}')
+
+@receiver([post_save, post_delete], sender=Notification)
+def bump_notifications(sender, instance, **kwargs):
+    if batch_deleting.get():
+        return
+    CollectionVersion.bump(f'notifications:{instance.recipient_id}')
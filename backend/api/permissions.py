@@ -19,6 +19,22 @@ class IsVideoOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         return obj.uploader == request.user
 
+class IsVideoOwnerOrStaff(permissions.BasePermission):
+    """
+    Only the owner of a video and staff may see it.
+    """
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or obj.uploader == request.user
+
+class IsPlaylistOwnerOrReadOnly(permissions.BasePermission):
+    """
+    Only the owner of a playlist may change it or its items.
+    """
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj.owner == request.user
+
 class IsCommentOwner(permissions.BasePermission):
     """
     Custom permission to only allow owners of a comment to edit it.
@@ -1,9 +1,12 @@
+from django.conf import settings
 from rest_framework import serializers
 from accounts.models import User, Profile
-from videos.models import Video, Category, Comment, Like
+from videos.captions import LANGUAGE
+from videos.models import Video, Category, Comment, Like, Playlist, PlaylistItem, CaptionTrack
 from notifications.models import Notification
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from .sparse import SparseFieldsMixin
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -64,7 +67,7 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'description', 'created_at']
         read_only_fields = ['slug', 'created_at']
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
     
@@ -72,6 +75,7 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
         fields = ['id', 'video', 'user', 'parent', 'text', 'created_at', 'updated_at', 'replies']
         read_only_fields = ['created_at', 'updated_at']
+        expandable_fields = ['user']
     
     def get_replies(self, obj):
         if obj.replies.exists():
@@ -86,7 +90,7 @@ class LikeSerializer(serializers.ModelSerializer):
         fields = ['id', 'video', 'user', 'like_type', 'created_at']
         read_only_fields = ['created_at']
 
-class VideoSerializer(serializers.ModelSerializer):
+class VideoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     uploader = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
@@ -95,9 +99,6 @@ class VideoSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
-    likes_count = serializers.SerializerMethodField()
-    dislikes_count = serializers.SerializerMethodField()
-    comments_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Video
@@ -107,18 +108,13 @@ class VideoSerializer(serializers.ModelSerializer):
             'views', 'slug', 'duration', 'created_at', 'updated_at',
             'tags', 'likes_count', 'dislikes_count', 'comments_count'
         ]
-        read_only_fields = ['views', 'slug', 'created_at', 'updated_at']
-    
-    def get_likes_count(self, obj):
-        return obj.likes.filter(like_type='like').count()
-    
-    def get_dislikes_count(self, obj):
-        return obj.likes.filter(like_type='dislike').count()
-    
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+        read_only_fields = [
+            'views', 'slug', 'created_at', 'updated_at',
+            'likes_count', 'dislikes_count', 'comments_count'
+        ]
+        expandable_fields = ['uploader', 'category']
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     recipient = UserSerializer(read_only=True)
     
@@ -129,3 +125,40 @@ class NotificationSerializer(serializers.ModelSerializer):
             'video', 'comment', 'text', 'is_read', 'created_at'
         ]
         read_only_fields = ['created_at']
+        expandable_fields = ['recipient', 'sender']
+
+class PlaylistSerializer(serializers.ModelSerializer):
+    owner = UserSerializer(read_only=True)
+    
+    class Meta:
+        model = Playlist
+        fields = ['id', 'title', 'description', 'privacy', 'owner', 'items_count', 'created_at', 'updated_at']
+        read_only_fields = ['items_count', 'created_at', 'updated_at']
+
+class PlaylistItemSerializer(serializers.ModelSerializer):
+    video = VideoSerializer(read_only=True)
+    
+    class Meta:
+        model = PlaylistItem
+        fields = ['id', 'rank', 'video', 'added_at']
+        read_only_fields = ['rank', 'added_at']
+
+class CaptionTrackSerializer(serializers.ModelSerializer):
+    """
+    A caption track; ``file`` is uploaded as WebVTT or SRT and served as
+    WebVTT.
+    """
+    class Meta:
+        model = CaptionTrack
+        fields = ['id', 'language', 'label', 'file', 'cues_count', 'created_at', 'updated_at']
+        read_only_fields = ['cues_count', 'created_at', 'updated_at']
+    
+    def validate_language(self, value):
+        if not LANGUAGE.match(value):
+            raise serializers.ValidationError('Must be a language tag such as "en" or "pt-BR".')
+        return value
+    
+    def validate_file(self, value):
+        if value.size > settings.CAPTION_MAX_SIZE:
+            raise serializers.ValidationError(f'Caption files are limited to {settings.CAPTION_MAX_SIZE} bytes.')
+        return value
@@ -1,3 +1,556 @@
-from django.test import TestCase
+import csv
+import gzip
+import importlib
+import io
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import URLPattern
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from notifications.models import Notification
+from videos.admin import VideoAdmin
+from videos.models import Category, Comment, Like, Playlist, PlaylistItem, Video, VideoView
+from . import urls
+from .admin import EstimatedCountPaginator, estimated_count
+from .async_views import VideoDetailView, VideoListView
+from .deletion import claim, claimable_jobs, run_job, run_pending_jobs, schedule_deletion
+from .exports import encode_csv, stream_export
+from .fast_serializers import comment_plan, video_plan
+from .models import DeletionJob
+from .renderers import ORJSONRenderer
+from .serializers import CommentSerializer, VideoSerializer
+from .sparse import FieldSelection
+from .views import _apply_like
+
+
+class AsyncReadViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+        cls.public = Video.objects.create(title='Public', file='videos/a.mp4', uploader=cls.user)
+        cls.private = Video.objects.create(title='Private', file='videos/b.mp4', uploader=cls.user, privacy='private')
+
+    def call(self, view, request, **kwargs):
+        response = async_to_sync(view)(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_detail(self):
+        view = VideoDetailView.as_view(fallback=None)
+        response = self.call(view, RequestFactory().get('/api/videos/'), slug=self.public.slug)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['slug'], self.public.slug)
+        response = self.call(view, RequestFactory().get('/api/videos/'), slug=self.private.slug)
+        self.assertEqual(response.status_code, 404)
+
+    def test_list(self):
+        response = self.call(VideoListView.as_view(fallback=None), RequestFactory().get('/api/videos/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([video['slug'] for video in response.data['results']], [self.public.slug])
+
+    def test_other_methods_fall_back(self):
+        def fallback(request, *args, **kwargs):
+            return HttpResponse(status=202)
+
+        view = VideoDetailView.as_view(fallback=fallback)
+        response = self.call(view, RequestFactory().delete('/api/videos/'), slug=self.public.slug)
+        self.assertEqual(response.status_code, 202)
+
+
+class AsyncRouteTests(SimpleTestCase):
+
+    def test_async_routes_keep_the_router_names(self):
+        self.addCleanup(importlib.reload, urls)
+        with override_settings(ASYNC_READ_VIEWS=True):
+            patterns = importlib.reload(urls).urlpatterns
+        names = [pattern.name for pattern in patterns if isinstance(pattern, URLPattern)]
+        self.assertTrue(all(names))
+        for name in ('video-list', 'video-featured', 'video-detail', 'category-videos', 'notification-list'):
+            self.assertIn(name, names)
+
+
+class FastSerializerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+        music = Category.objects.create(name='Music')
+        cls.videos = [
+            Video.objects.create(title='Song', file='videos/a.mp4', thumbnail='thumbnails/a.jpg', uploader=user, category=music),
+            Video.objects.create(title='Vlog', file='videos/b.mp4', uploader=user, tags='daily'),
+        ]
+        comment = Comment.objects.create(video=cls.videos[0], user=user, text='First')
+        reply = Comment.objects.create(video=cls.videos[0], user=user, parent=comment, text='Reply')
+        Comment.objects.create(video=cls.videos[0], user=user, parent=reply, text='Nested')
+
+    def assertRenderedEqual(self, fast, slow):
+        renderer = ORJSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(slow))
+
+    def test_videos_render_like_the_serializer(self):
+        request = Request(APIRequestFactory().get('/api/videos/'))
+        for selection in (
+            None,
+            FieldSelection(['title', 'uploader', 'slug']),
+            FieldSelection(['title', 'uploader'], expand=['uploader']),
+            FieldSelection(omit=['description', 'category']),
+        ):
+            context = {'request': request, 'selection': selection}
+            videos = Video.objects.for_listing().order_by('created_at')
+            plan = video_plan.select(selection)
+            self.assertRenderedEqual(
+                plan.serialize(plan.values(videos), context),
+                VideoSerializer(videos, many=True, context=context).data,
+            )
+
+    def test_comments_render_with_nested_replies(self):
+        context = {'request': Request(APIRequestFactory().get('/api/comments/')), 'selection': None}
+        comments = Comment.objects.filter(parent=None)
+        fast = comment_plan.serialize(comment_plan.values(comments), context)
+        self.assertEqual(fast[0]['replies'][0]['replies'][0]['text'], 'Nested')
+        self.assertRenderedEqual(fast, CommentSerializer(comments, many=True, context=context).data)
+
+
+class SparseFieldsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+        cls.video = Video.objects.create(title='Song', file='videos/a.mp4', uploader=cls.user)
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fields(self):
+        videos = self.get('/api/videos/', fields='title,uploader')['results']
+        self.assertEqual(videos, [{'title': 'Song', 'uploader': self.user.pk}])
+
+    def test_expand(self):
+        video = self.get(f'/api/videos/{self.video.slug}/', fields='title,uploader', expand='uploader')
+        self.assertEqual(set(video), {'title', 'uploader'})
+        self.assertEqual(video['uploader']['username'], 'up')
+
+    def test_omit(self):
+        video = self.get(f'/api/videos/{self.video.slug}/', omit='description,tags')
+        self.assertNotIn('description', video)
+        self.assertNotIn('tags', video)
+        self.assertEqual(video['uploader']['username'], 'up')
+
+    def test_default_representation(self):
+        video = self.get(f'/api/videos/{self.video.slug}/')
+        self.assertIn('description', video)
+        self.assertIsInstance(video['uploader'], dict)
+
+    def test_selection_from_request(self):
+        request = Request(APIRequestFactory().get('/', {'fields': 'title, uploader,', 'expand': 'uploader'}))
+        selection = FieldSelection.from_request(request)
+        self.assertEqual(selection.fields, {'title', 'uploader'})
+        self.assertTrue(selection.expands('uploader'))
+        self.assertFalse(selection.includes('views'))
+        self.assertIsNone(FieldSelection.from_request(Request(APIRequestFactory().get('/', {'fields': ''}))))
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.video = Video.objects.create(title='Song', file='videos/a.mp4', uploader=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def first_get(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        return response
+
+    def assertNotModified(self, path, response):
+        again = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def assertModified(self, path, response):
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_video(self):
+        path = f'/api/videos/{self.video.slug}/'
+        response = self.first_get(path)
+        self.assertNotModified(path, response)
+        # Another URL of the same video renders differently
+        self.assertModified(f'{path}?fields=title', response)
+        Like.objects.create(video=self.video, user=self.viewer, like_type='like')
+        self.assertModified(path, response)
+
+    def test_missing_video_has_no_validators(self):
+        response = self.client.get('/api/videos/missing/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_categories(self):
+        Category.objects.create(name='News')
+        response = self.first_get('/api/categories/')
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified('/api/categories/', response)
+        again = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(again.status_code, 304)
+        Category.objects.create(name='Music')
+        self.assertModified('/api/categories/', response)
+
+    def test_comments(self):
+        path = f'/api/videos/{self.video.slug}/comments/'
+        response = self.first_get(path)
+        self.assertNotModified(path, response)
+        Comment.objects.create(video=self.video, user=self.viewer, text='Nice')
+        self.assertModified(path, response)
+
+    def test_notifications_are_private(self):
+        self.client.force_authenticate(self.user)
+        response = self.first_get('/api/notifications/')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotModified('/api/notifications/', response)
+        Notification.objects.create(recipient=self.user, sender=self.viewer, notification_type='like', text='Liked')
+        self.assertModified('/api/notifications/', response)
+
+
+class VideoCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.video = Video.objects.create(title='Song', file='videos/a.mp4', uploader=cls.user)
+
+    def counters(self):
+        return Video.objects.values_list('likes_count', 'dislikes_count', 'comments_count').get(pk=self.video.pk)
+
+    def assertCountersMatchRecount(self, expected):
+        self.assertEqual(self.counters(), expected)
+        Video.objects.filter(pk=self.video.pk).refresh_counters()
+        self.assertEqual(self.counters(), expected)
+
+    def test_likes(self):
+        like = Like.objects.create(video=self.video, user=self.viewer, like_type='like')
+        Like.objects.create(video=self.video, user=self.user, like_type='like')
+        self.assertCountersMatchRecount((2, 0, 0))
+        like.like_type = 'dislike'
+        like.save()
+        self.assertCountersMatchRecount((1, 1, 0))
+        like.delete()
+        self.assertCountersMatchRecount((1, 0, 0))
+
+    def test_comments(self):
+        comment = Comment.objects.create(video=self.video, user=self.viewer, text='First')
+        Comment.objects.create(video=self.video, user=self.user, parent=comment, text='Reply')
+        self.assertCountersMatchRecount((0, 0, 2))
+        comment.text = 'Edited'
+        comment.save()
+        self.assertCountersMatchRecount((0, 0, 2))
+        # The reply goes with it
+        comment.delete()
+        self.assertCountersMatchRecount((0, 0, 0))
+
+    def test_counters_never_go_negative(self):
+        Video.objects.filter(pk=self.video.pk).add_to_counters(likes_count=-3, comments_count=2)
+        self.assertEqual(self.counters(), (0, 0, 2))
+
+
+class ApplyLikeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.uploader = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.video = Video.objects.create(title='Clip', file='videos/clip.mp4', uploader=cls.uploader)
+
+    def counters(self):
+        return Video.objects.values_list('likes_count', 'dislikes_count').get(pk=self.video.pk)
+
+    def test_like_and_remove(self):
+        like, created = _apply_like(self.video, self.viewer, 'like')
+        self.assertTrue(created)
+        self.assertEqual(like.like_type, 'like')
+        self.assertEqual(self.counters(), (1, 0))
+        self.assertEqual(Notification.objects.filter(recipient=self.uploader, notification_type='like').count(), 1)
+
+        like, created = _apply_like(self.video, self.viewer, 'like')
+        self.assertIsNone(like)
+        self.assertFalse(created)
+        self.assertEqual(self.counters(), (0, 0))
+        self.assertFalse(Like.objects.exists())
+
+    def test_switch_like_to_dislike(self):
+        first, _ = _apply_like(self.video, self.viewer, 'like')
+        like, created = _apply_like(self.video, self.viewer, 'dislike')
+        self.assertFalse(created)
+        self.assertEqual((like.pk, like.created_at), (first.pk, first.created_at))
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertEqual(Like.objects.get().like_type, 'dislike')
+
+    def test_own_video_is_not_notified(self):
+        _apply_like(self.video, self.uploader, 'dislike')
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertFalse(Notification.objects.exists())
+
+    def test_counters_match_a_recount(self):
+        _apply_like(self.video, self.viewer, 'like')
+        _apply_like(self.video, self.uploader, 'dislike')
+        _apply_like(self.video, self.viewer, 'dislike')
+        counted = self.counters()
+        Video.objects.filter(pk=self.video.pk).refresh_counters()
+        self.assertEqual(self.counters(), counted)
+
+
+class BatchLookupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.videos = [
+            Video.objects.create(title=f'Video {number}', file=f'videos/{number}.mp4', uploader=cls.user)
+            for number in range(3)
+        ]
+        cls.private = Video.objects.create(title='Private', file='videos/p.mp4', uploader=cls.user, privacy='private')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_batch_in_requested_order(self):
+        first, second, third = self.videos
+        response = self.client.get('/api/videos/batch/', {
+            'ids': f'{third.pk},{self.private.pk},{first.pk}',
+            'slugs': f'{first.slug},{second.slug},unknown',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([video['slug'] for video in response.json()], [third.slug, first.slug, second.slug])
+
+    def test_batch_rejects_bad_requests(self):
+        self.assertEqual(self.client.get('/api/videos/batch/').status_code, 400)
+        self.assertEqual(self.client.get('/api/videos/batch/', {'ids': 'nope'}).status_code, 400)
+        too_many = ','.join(f'slug-{number}' for number in range(101))
+        self.assertEqual(self.client.get('/api/videos/batch/', {'slugs': too_many}).status_code, 400)
+
+    def test_state(self):
+        first, second, _ = self.videos
+        Like.objects.create(video=first, user=self.viewer, like_type='dislike')
+        VideoView.objects.create(video=second, user=self.viewer, ip_address='127.0.0.1')
+        self.assertEqual(self.client.get('/api/videos/state/', {'ids': str(first.pk)}).status_code, 401)
+        self.client.force_authenticate(self.viewer)
+        state = self.client.get('/api/videos/state/', {'ids': f'{first.pk},{second.pk}'}).json()
+        self.assertEqual(state[str(first.pk)], {'like_type': 'dislike', 'watched': False, 'last_watched_at': None})
+        self.assertIsNone(state[str(second.pk)]['like_type'])
+        self.assertTrue(state[str(second.pk)]['watched'])
+
+
+class DeletionJobTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.video = Video.objects.create(title='Song', file='videos/a.mp4', uploader=cls.user)
+        cls.other = Video.objects.create(title='Other', file='videos/b.mp4', uploader=cls.viewer)
+
+    def test_scheduled_video_is_hidden_until_deleted(self):
+        comment = Comment.objects.create(video=self.video, user=self.viewer, text='Nice')
+        Like.objects.create(video=self.video, user=self.viewer, like_type='like')
+        VideoView.objects.create(video=self.video, user=self.viewer, ip_address='127.0.0.1')
+        playlist = Playlist.objects.create(owner=self.viewer, title='Mix', items_count=2)
+        PlaylistItem.objects.create(playlist=playlist, video=self.video, rank='i')
+        PlaylistItem.objects.create(playlist=playlist, video=self.other, rank='r')
+
+        job = schedule_deletion(self.video)
+        self.assertEqual(schedule_deletion(self.video), job)
+        self.assertFalse(Video.objects.filter(pk=self.video.pk).exists())
+        self.assertFalse(Comment.objects.filter(pk=comment.pk).exists())
+
+        run_job(job, batch_size=1, log=lambda message: None)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.progress['videos'], 1)
+        self.assertFalse(Video.all_objects.filter(pk=self.video.pk).exists())
+        self.assertFalse(Comment._base_manager.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(VideoView.objects.exists())
+        self.assertEqual(list(playlist.items.values_list('video_id', flat=True)), [self.other.pk])
+        playlist.refresh_from_db()
+        self.assertEqual(playlist.items_count, 1)
+
+    def test_user_deletion_keeps_other_counters_right(self):
+        comment = Comment.objects.create(video=self.other, user=self.user, text='Hi')
+        Comment.objects.create(video=self.other, user=self.viewer, parent=comment, text='Hello')
+        Like.objects.create(video=self.other, user=self.user, like_type='dislike')
+        playlist = Playlist.objects.create(owner=self.user, title='Mine', items_count=1)
+        PlaylistItem.objects.create(playlist=playlist, video=self.other, rank='i')
+
+        job = schedule_deletion(self.user)
+        self.assertFalse(Video.objects.filter(uploader=self.user).exists())
+        run_job(job, batch_size=10, log=lambda message: None)
+        self.assertFalse(get_user_model()._base_manager.filter(pk=self.user.pk).exists())
+        self.assertFalse(Video.all_objects.filter(pk=self.video.pk).exists())
+        self.assertFalse(Playlist.objects.filter(owner_id=self.user.pk).exists())
+        self.assertEqual(
+            Video.objects.values_list('likes_count', 'dislikes_count', 'comments_count').get(pk=self.other.pk),
+            (0, 0, 0)
+        )
+
+    def test_unknown_objects_are_refused(self):
+        with self.assertRaises(TypeError):
+            schedule_deletion(Category.objects.create(name='Music'))
+
+    def test_only_one_worker_claims_a_job(self):
+        job = DeletionJob.objects.create(model='videos.video', object_id=str(self.video.pk))
+        first, second = DeletionJob.objects.get(pk=job.pk), DeletionJob.objects.get(pk=job.pk)
+        self.assertTrue(claim(first))
+        self.assertFalse(claim(second))
+        self.assertEqual(DeletionJob.objects.get(pk=job.pk).status, 'running')
+
+    @override_settings(DELETION_STALE_SECONDS=60)
+    def test_stale_running_jobs_are_taken_over(self):
+        running = DeletionJob.objects.create(model='videos.video', object_id=str(self.video.pk), status='running')
+        failed = DeletionJob.objects.create(model='videos.video', object_id=str(self.other.pk), status='failed')
+        self.assertEqual(list(claimable_jobs()), [])
+        DeletionJob.objects.filter(pk=running.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(list(claimable_jobs()), [running])
+        self.assertEqual(list(claimable_jobs(retry_failed=True)), [running, failed])
+        self.assertEqual(run_pending_jobs(log=lambda message: None), 1)
+        self.assertFalse(Video.all_objects.filter(pk=self.video.pk).exists())
+        self.assertEqual(DeletionJob.objects.get(pk=running.pk).status, 'done')
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='up@example.com', username='up', password='x')
+        cls.viewer = User.objects.create_user(email='viewer@example.com', username='viewer', password='x')
+        cls.video = Video.objects.create(title='=HYPERLINK("http://evil")', file='videos/a.mp4', uploader=cls.user)
+        cls.comment = Comment.objects.create(video=cls.video, user=cls.viewer, text='@SUM(1+1)')
+        VideoView.objects.create(video=cls.video, user=cls.viewer, ip_address='127.0.0.1')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_formulas_are_quoted(self):
+        cells = ['=1+2', '+1', '-1', '@cmd', '\tx', '\r=x', 'plain', 'a=b', 5, -3, None]
+        text = b''.join(encode_csv(['column'] * len(cells), [cells])).decode()
+        self.assertEqual(list(csv.reader(io.StringIO(text)))[1], [
+            "'=1+2", "'+1", "'-1", "'@cmd", "'\tx", "'\r=x", 'plain', 'a=b', '5', '-3', '',
+        ])
+
+    def test_csv_and_jsonl(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/exports/comments.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('up-comments.csv', response['Content-Disposition'])
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'video', 'parent', 'user', 'text', 'created_at', 'updated_at'])
+        self.assertEqual(rows[1][1:5], [self.video.slug, '', 'viewer', "'@SUM(1+1)"])
+
+        response = self.client.get('/api/exports/videos.jsonl')
+        video = json.loads(b''.join(response.streaming_content))
+        # JSON is not evaluated by spreadsheets
+        self.assertEqual((video['title'], video['views']), ('=HYPERLINK("http://evil")', self.video.views))
+
+    def test_compressed(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/exports/views.csv.gz')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(lines[1].split(',')[1:], [self.video.slug, '1'])
+
+    def test_chunks_cover_every_row(self):
+        for number in range(5):
+            Comment.objects.create(video=self.video, user=self.user, text=f'Comment {number}')
+        lines = b''.join(stream_export('comments', self.user, chunk_size=2)).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+
+    def test_other_channels(self):
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.client.get('/api/exports/videos.csv', {'channel': 'up'}).status_code, 403)
+        self.assertEqual(self.client.get('/api/exports/videos.csv').status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/exports/videos.csv').status_code, 401)
+
+
+class AdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.alice = User.objects.create_user(email='alice@example.com', username='alice', password='x')
+        cls.bob = User.objects.create_user(email='bob@example.com', username='bob', password='x')
+        cls.videos = [
+            Video.objects.create(title=f'Video {number}', file=f'videos/{number}.mp4', uploader=uploader)
+            for number, uploader in enumerate([cls.alice, cls.alice, cls.bob])
+        ]
+
+    def test_estimated_count(self):
+        self.assertGreaterEqual(estimated_count(Video.objects.all()), 3)
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_paginator_estimates_unfiltered_lists(self):
+        # The manager hiding deleted videos is not a filter
+        unfiltered = EstimatedCountPaginator(Video.objects.order_by('-created_at'), 10)
+        self.assertEqual(unfiltered.count, estimated_count(Video.objects.all()))
+        filtered = EstimatedCountPaginator(Video.objects.filter(uploader=self.alice).order_by('-created_at'), 10)
+        self.assertEqual(filtered.count, 2)
+
+    @override_settings(ADMIN_COUNT_LIMIT=100)
+    def test_paginator_counts_small_tables_exactly(self):
+        Video.objects.filter(pk=self.videos[0].pk).update(deleted_at=timezone.now())
+        self.assertEqual(EstimatedCountPaginator(Video.objects.order_by('-created_at'), 10).count, 2)
+
+    def search(self, term):
+        model_admin = VideoAdmin(Video, admin.site)
+        request = RequestFactory().get('/admin/videos/video/', {'q': term})
+        queryset, may_have_duplicates = model_admin.get_search_results(request, Video.objects.all(), term)
+        self.assertFalse(may_have_duplicates)
+        return set(queryset)
+
+    def test_search_by_indexed_columns(self):
+        first, second, third = self.videos
+        self.assertEqual(self.search(first.slug), {first})
+        self.assertEqual(self.search(str(third.pk)), {third})
+        self.assertEqual(self.search(' alice '), {first, second})
+        self.assertEqual(self.search('bob@example.com'), {third})
+
+    def test_search_without_match(self):
+        self.assertEqual(self.search('Video'), set())
+        self.assertEqual(self.search(''), set(self.videos))
+
+    def test_change_lists_and_deletion(self):
+        admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com', username='admin', password='x'
+        )
+        VideoView.objects.create(video=self.videos[0], user=self.bob, ip_address='127.0.0.1')
+        Notification.objects.create(recipient=self.alice, sender=self.bob, notification_type='like', text='Liked')
+        self.client.force_login(admin_user)
+        for path in ('/admin/videos/video/', '/admin/videos/videoview/', '/admin/notifications/notification/'):
+            self.assertEqual(self.client.get(path).status_code, 200)
+        # Deleting from the admin schedules a job
+        response = self.client.post(f'/admin/videos/video/{self.videos[2].pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Video.objects.filter(pk=self.videos[2].pk).exists())
+        self.assertTrue(DeletionJob.objects.filter(object_id=str(self.videos[2].pk), status='pending').exists())
@@ -1,17 +1,19 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView
 )
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'videos', views.VideoViewSet, basename='video')
 router.register(r'categories', views.CategoryViewSet, basename='category')
 router.register(r'comments', views.CommentViewSet, basename='comment')
 router.register(r'notifications', views.NotificationViewSet, basename='notification')
+router.register(r'playlists', views.PlaylistViewSet, basename='playlist')
 
 urlpatterns = [
     # Authentication endpoints
@@ -24,7 +26,52 @@ urlpatterns = [
     # Video interactions
     path('like/', views.LikeView.as_view(), name='like'),
     path('search/', views.SearchView.as_view(), name='search'),
+    path('search/suggest/', views.SuggestionsView.as_view(), name='search-suggest'),
+    path('search/captions/', views.CaptionSearchView.as_view(), name='search-captions'),
+    
+    # Channel exports, e.g. exports/comments.csv.gz
+    re_path(
+        r'^exports/(?P<kind>videos|views|comments)\.(?P<encoding>csv|jsonl)(?P<compressed>\.gz)?$',
+        views.ExportView.as_view(),
+        name='export',
+    ),
     
     # Include all router-generated URLs
     path('', include(router.urls)),
 ]
+
+# Under ASGI the hottest read endpoints are served by async views, which
+# hand every other method back to the regular viewsets. They carry the
+# router's route names, so reverse() and the metrics labels don't change.
+if settings.ASYNC_READ_VIEWS:
+    video_list = views.VideoViewSet.as_view({'get': 'list', 'post': 'create'})
+    video_detail = views.VideoViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+    })
+    notification_detail = views.NotificationViewSet.as_view({'get': 'retrieve'})
+    # Left to the router, like any slug-less action
+    video_list_actions = '|'.join(
+        action.url_path for action in views.VideoViewSet.get_extra_actions() if not action.detail
+    )
+
+    urlpatterns = [
+        path('videos/', async_views.VideoListView.as_view(fallback=video_list), name='video-list'),
+        path('videos/featured/', async_views.FeaturedVideosView.as_view(
+            fallback=views.VideoViewSet.as_view({'get': 'featured'})
+        ), name='video-featured'),
+        re_path(
+            rf'^videos/(?!(?:{video_list_actions})/$)(?P<slug>[^/.]+)/$',
+            async_views.VideoDetailView.as_view(fallback=video_detail),
+            name='video-detail',
+        ),
+        re_path(r'^categories/(?P<slug>[^/.]+)/videos/$', async_views.CategoryVideosView.as_view(
+            fallback=views.CategoryViewSet.as_view({'get': 'videos'})
+        ), name='category-videos'),
+        path('notifications/', async_views.NotificationListView.as_view(
+            fallback=views.NotificationViewSet.as_view({'get': 'list'})
+        ), name='notification-list'),
+        # Integer only, so the mark_all_as_read action still reaches the router
+        path('notifications/<int:pk>/', async_views.NotificationDetailView.as_view(
+            fallback=notification_detail
+        ), name='notification-detail'),
+    ] + urlpatterns
@@ -1,23 +1,53 @@
+import uuid
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Count
-from rest_framework import viewsets, generics, status, filters
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.db.models import Q, Count, F, Max
+from rest_framework import viewsets, generics, status, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser, AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 
 from accounts.models import User, Profile
-from videos.models import Video, Category, Comment, Like, VideoView
+from videos.models import (
+    Video, Category, Comment, Like, VideoView, Storyboard, Fingerprint, NearDuplicate, Playlist, PlaylistItem,
+    CaptionTrack,
+)
+from videos.captions import caption_hits, get_index as get_caption_index, import_track, search_captions
+from videos.playlists import append_videos, move_item, remove_item, visible_items
+from videos.recommender import home_feed
+from videos.storyboard import signed_vtt
+from videos.suggestions import MAX_LIMIT as MAX_SUGGESTIONS, get_index as get_suggestion_index
+from videos.writer import run_write
 from notifications.models import Notification
 from .serializers import (
     UserSerializer, ProfileSerializer, UserRegisterSerializer,
     VideoSerializer, CategorySerializer, CommentSerializer,
-    LikeSerializer, NotificationSerializer
+    LikeSerializer, NotificationSerializer, PlaylistSerializer, CaptionTrackSerializer
+)
+from .conditional import (
+    conditional, category_validators, video_validators, comment_validators,
+    notification_validators
+)
+from .fast_serializers import fast_list, video_plan, comment_plan, notification_plan, playlist_item_plan
+from .sparse import SparseFieldsViewMixin, video_listing, notification_listing
+from .deletion import schedule_deletion
+from .exports import ENCODINGS, aiter_blocks, stream_export
+from .models import CollectionVersion
+from .pagination import PlaylistItemPagination
+from .permissions import (
+    IsOwnerOrReadOnly, IsVideoOwner, IsVideoOwnerOrStaff, IsPlaylistOwnerOrReadOnly, IsCommentOwner, IsProfileOwner,
 )
-from .permissions import IsOwnerOrReadOnly, IsVideoOwner, IsCommentOwner, IsProfileOwner
 
 # Authentication Views
 class RegisterView(generics.CreateAPIView):
@@ -34,7 +64,7 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         return self.request.user.profile
 
 # Video Views
-class VideoViewSet(viewsets.ModelViewSet):
+class VideoViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = VideoSerializer
     permission_classes = [IsOwnerOrReadOnly]  # Remove IsAuthenticated to allow public access
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -42,6 +72,7 @@ class VideoViewSet(viewsets.ModelViewSet):
     search_fields = ['title', 'description', 'tags']
     ordering_fields = ['created_at', 'views', 'title']
     lookup_field = 'slug'
+    batch_limit = 100  # Videos per batch/state request
 
     # def get_queryset(self):
     #     """
@@ -65,72 +96,242 @@ class VideoViewSet(viewsets.ModelViewSet):
         Returns a list of featured videos.
         Featured videos are determined by view count and like count.
         """
-        featured_videos = Video.objects.filter(
-            privacy='public'
-        ).annotate(
-            num_likes=Count('likes', filter=Q(likes__like_type='like'))
-        ).order_by('-views', '-num_likes')[:10]
-
-        page = self.paginate_queryset(featured_videos)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = self.get_serializer(featured_videos, many=True)
-        return Response(serializer.data)
+        return fast_list(self, Video.objects.featured(), video_plan)
+    
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def batch(self, request):
+        """
+        Up to ``batch_limit`` videos by ``?ids=`` and/or ``?slugs=`` in one
+        query, in the order requested. Unknown or hidden videos are left out.
+        """
+        ids = _split_param(request, 'ids')
+        slugs = _split_param(request, 'slugs')
+        if not ids and not slugs:
+            return Response({'error': 'ids or slugs are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) + len(slugs) > self.batch_limit:
+            return Response(
+                {'error': f'At most {self.batch_limit} ids and slugs per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = _valid_uuids(ids)
+        if ids is None:
+            return Response({'error': 'ids must be video UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        context = self.get_serializer_context()
+        plan = video_plan.select(context.get('selection'))
+        # id and slug are always fetched to put the videos in the requested order
+        columns = dict.fromkeys(['id', 'slug', *plan.columns])
+        rows = list(self.get_queryset().filter(Q(id__in=ids) | Q(slug__in=slugs)).values(*columns))
+        videos = dict(zip((row['id'] for row in rows), plan.serialize(rows, context)))
+        slug_ids = {row['slug']: row['id'] for row in rows}
+        
+        # A video asked for by both id and slug is only returned once
+        order = dict.fromkeys([*ids, *(slug_ids.get(slug) for slug in slugs)])
+        return Response([videos[video_id] for video_id in order if video_id in videos])
+    
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny])
+    def feed(self, request):
+        """
+        The home feed: videos similar to what the user recently watched and
+        liked, then trending videos, which is all anonymous users get.
+        ``?limit=`` defaults to 20, at most ``batch_limit``.
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), self.batch_limit)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Some of the stored ids may have gone private or been deleted since
+        ids = home_feed(request.user, limit * 2)
+        queryset = self.get_queryset().filter(id__in=ids, privacy='public')
+        if request.user.is_authenticated:
+            queryset = queryset.exclude(uploader=request.user)
+        
+        context = self.get_serializer_context()
+        plan = video_plan.select(context.get('selection'))
+        rows = list(queryset.values(*dict.fromkeys(['id', *plan.columns])))
+        videos = dict(zip((row['id'] for row in rows), plan.serialize(rows, context)))
+        return Response([videos[video_id] for video_id in ids if video_id in videos][:limit])
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def state(self, request):
+        """
+        The current user's like/dislike and watch history for up to
+        ``batch_limit`` videos given by ``?ids=``, keyed by video id.
+        """
+        ids = _split_param(request, 'ids')
+        if not ids:
+            return Response({'error': 'ids are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.batch_limit:
+            return Response(
+                {'error': f'At most {self.batch_limit} ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = _valid_uuids(ids)
+        if ids is None:
+            return Response({'error': 'ids must be video UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        likes = dict(
+            Like.objects.filter(user=request.user, video_id__in=ids).values_list('video_id', 'like_type')
+        )
+        watched = dict(
+            VideoView.objects.filter(user=request.user, video_id__in=ids).order_by().values('video_id')
+            .annotate(last=Max('viewed_at')).values_list('video_id', 'last')
+        )
+        timestamp = serializers.DateTimeField()
+        return Response({
+            str(video_id): {
+                'like_type': likes.get(video_id),
+                'watched': video_id in watched,
+                'last_watched_at': timestamp.to_representation(watched[video_id]) if video_id in watched else None,
+            }
+            for video_id in ids
+        })
+    
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return fast_list(self, queryset, video_plan)
+    
+    @conditional(video_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     def get_queryset(self):
         # Return only public videos or user's own videos
-        if self.request.user.is_authenticated:
-            return Video.objects.filter(
-                Q(privacy='public') | 
-                Q(privacy='unlisted') | 
-                Q(uploader=self.request.user)
-            )
-        return Video.objects.filter(privacy='public')
+        return video_listing(Video.objects.visible_to(self.request.user), self.get_selection())
     
     def perform_create(self, serializer):
         serializer.save(uploader=self.request.user)
     
+    def perform_destroy(self, instance):
+        # Hidden right away, deleted by the process_deletions worker
+        schedule_deletion(instance)
+    
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def view(self, request, slug=None):
         video = self.get_object()
         
-        # Record the view
-        if request.user.is_authenticated:
-            VideoView.objects.create(
-                video=video,
-                user=request.user,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
-        else:
-            VideoView.objects.create(
-                video=video,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
-        
-        # Increment view count
-        video.views += 1
-        video.save()
+        # Record the view through the serialized writer (if enabled) without
+        # waiting for it to be committed
+        run_write(
+            _record_view,
+            video.id,
+            request.user.id if request.user.is_authenticated else None,
+            request.META.get('REMOTE_ADDR'),
+            request.META.get('HTTP_USER_AGENT', ''),
+            wait=False,
+        )
         
         return Response({'status': 'view recorded'})
     
     @action(detail=True, methods=['get'])
+    @conditional(comment_validators)
     def comments(self, request, slug=None):
         """
         Get all top-level comments for a video
         """
         video = self.get_object()
         comments = Comment.objects.filter(video=video, parent=None).order_by('-created_at')
-        page = self.paginate_queryset(comments)
-        if page is not None:
-            serializer = CommentSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = CommentSerializer(comments, many=True, context={'request': request})
-        return Response(serializer.data)
+        return fast_list(self, comments, comment_plan)
+    
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    def storyboard(self, request, slug=None):
+        """
+        Seek preview sprites: the WebVTT thumbnail track and the sheets it
+        points to, with their layout. 404 until the storyboard is built.
+        """
+        video = self.get_object()
+        storyboard = Storyboard.objects.filter(video=video).exclude(vtt='').first()
+        if storyboard is None:
+            return Response({'error': 'No storyboard for this video yet'}, status=status.HTTP_404_NOT_FOUND)
+        
+        storage = storyboard.vtt.storage
+        vtt_url = storyboard.vtt.url
+        if getattr(storage, 'signs_urls', False):
+            # The stored VTT lists the sheets relative to itself
+            vtt_url = reverse('video-storyboard-vtt', kwargs={'slug': video.slug})
+        return Response({
+            'vtt': request.build_absolute_uri(vtt_url),
+            'sprites': [request.build_absolute_uri(storage.url(name)) for name in storyboard.sprites],
+            'interval': storyboard.interval,
+            'frames': storyboard.frames,
+            'tile_width': storyboard.tile_width,
+            'tile_height': storyboard.tile_height,
+            'columns': storyboard.columns,
+            'rows': storyboard.rows,
+        })
+    
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny], url_path='storyboard/vtt')
+    def storyboard_vtt(self, request, slug=None):
+        """
+        The storyboard's WebVTT track with signed URLs of its sheets, each
+        valid for that sheet only, when media URLs are signed.
+        """
+        video = self.get_object()
+        storyboard = get_object_or_404(Storyboard.objects.exclude(vtt=''), video=video)
+        response = HttpResponse(
+            signed_vtt(storyboard, request.build_absolute_uri), content_type='text/vtt; charset=utf-8'
+        )
+        # As long as the signatures of the sheets stay valid
+        patch_cache_control(response, private=True, max_age=settings.MEDIA_URL_LIFETIME)
+        return response
+    
+    @action(detail=True, methods=['get', 'post', 'delete'])
+    def captions(self, request, slug=None):
+        """
+        The caption tracks of a video. Its owner uploads a WebVTT or SRT
+        ``file`` with a ``language`` (and a ``label``), replacing the track
+        in that language, and deletes one with ``?language=``.
+        """
+        video = self.get_object()
+        context = self.get_serializer_context()
+        if request.method == 'POST':
+            serializer = CaptionTrackSerializer(data=request.data, context=context)
+            serializer.is_valid(raise_exception=True)
+            data = serializer.validated_data
+            try:
+                track = import_track(video, data['file'], data['language'], data.get('label', ''))
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(CaptionTrackSerializer(track, context=context).data, status=status.HTTP_201_CREATED)
+        
+        if request.method == 'DELETE':
+            deleted, _ = CaptionTrack.objects.filter(video=video, language=request.query_params.get('language')).delete()
+            if not deleted:
+                return Response({'error': 'No captions in this language'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        tracks = CaptionTrack.objects.filter(video=video)
+        return Response(CaptionTrackSerializer(tracks, many=True, context=context).data)
+    
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated, IsVideoOwnerOrStaff])
+    def duplicates(self, request, slug=None):
+        """
+        Whether the video looks like a re-upload of earlier videos, by
+        perceptual hashes of its frames (videos/fingerprint.py). ``checked``
+        is false until "manage.py fingerprint_videos" got to it. Owners are
+        only shown originals they can see; staff see all of them.
+        """
+        video = self.get_object()
+        fingerprint = Fingerprint.objects.filter(video=video).exclude(hashes=[]).first()
+        duplicates = NearDuplicate.objects.filter(video=video).select_related('original')
+        if not request.user.is_staff:
+            duplicates = duplicates.filter(Q(original__privacy='public') | Q(original__uploader=request.user))
+        return Response({
+            'checked': fingerprint is not None,
+            'possible_duplicate': NearDuplicate.objects.filter(video=video).exists(),
+            'originals': [
+                {
+                    'id': duplicate.original.id,
+                    'slug': duplicate.original.slug,
+                    'title': duplicate.original.title,
+                    'matched': duplicate.matched,
+                    'hashes': duplicate.hashes,
+                    'distance': round(duplicate.distance, 2),
+                }
+                for duplicate in duplicates
+            ],
+        })
     
     @action(detail=True, methods=['get'])
     def related(self, request, slug=None):
@@ -141,13 +342,12 @@ class VideoViewSet(viewsets.ModelViewSet):
             Q(category=category) | Q(tags__icontains=video.tags),
             ~Q(id=video.id),
             privacy='public'
-        ).distinct()[:10]
+        ).distinct().for_listing()[:10]
         
-        serializer = VideoSerializer(related_videos, many=True)
-        return Response(serializer.data)
+        return Response(video_plan.serialize(video_plan.values(related_videos)))
 
 # Category Views
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing categories and their associated videos.
     Publicly accessible to all users.
@@ -162,11 +362,16 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         """
         return Category.objects.all().order_by('name')
     
+    @conditional(category_validators)
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
+    @conditional(category_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
     @action(detail=True, methods=['get'], permission_classes=[AllowAny])
     def videos(self, request, slug=None):
         """
@@ -177,19 +382,12 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
         videos = Video.objects.filter(
             category=category, 
             privacy='public'
-        ).order_by('-created_at')
+        ).for_listing().order_by('-created_at')
         
-        # Apply pagination
-        page = self.paginate_queryset(videos)
-        if page is not None:
-            serializer = VideoSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = VideoSerializer(videos, many=True, context={'request': request})
-        return Response(serializer.data)
+        return fast_list(self, videos, video_plan)
 
 # Comment Views
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated, IsCommentOwner]
     
@@ -203,11 +401,15 @@ class CommentViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(video__slug=video_slug)
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return fast_list(self, queryset, comment_plan)
+    
     def get_serializer_context(self):
         """
         Add request to serializer context for URL building
         """
-        return {'request': self.request}
+        return {'request': self.request, 'selection': self.get_selection()}
     
     def perform_create(self, serializer):
         """
@@ -227,6 +429,78 @@ class CommentViewSet(viewsets.ModelViewSet):
                 text=f'{comment.user.username} commented on your video "{video.title}"'
             )
 
+def _split_param(request, name):
+    return list(dict.fromkeys(
+        part.strip() for part in request.query_params.get(name, '').split(',') if part.strip()
+    ))
+
+def _valid_uuids(values):
+    """
+    ``values`` as UUIDs, or None if any of them is not one.
+    """
+    try:
+        return [uuid.UUID(value) for value in values]
+    except ValueError:
+        return None
+
+def _record_view(video_id, user_id, ip_address, user_agent):
+    VideoView.objects.create(
+        video_id=video_id,
+        user_id=user_id,
+        ip_address=ip_address,
+        user_agent=user_agent
+    )
+    # Increment view count in the database to avoid lost updates
+    Video.objects.filter(id=video_id).update(views=F('views') + 1)
+
+def _apply_like(video, user, like_type):
+    """
+    Toggle the user's like/dislike on a video and notify the uploader.
+    Returns ``(like, created)``, with ``like`` set to None when it was removed.
+    
+    Runs in a transaction (``run_write``): the video row is locked first, so
+    that concurrent toggles on the same video (a first like has no row to
+    lock yet) take turns, then the user's current like is read and removed
+    or upserted in one statement and the counters adjusted by the
+    difference in another.
+    """
+    Video.all_objects.select_for_update().filter(pk=video.pk).values_list('pk').first()
+    current = (
+        Like.objects.select_for_update().filter(video=video, user=user)
+        .values_list('pk', 'like_type', 'created_at').first()
+    )
+    # Same type again: remove the like/dislike, the post_delete signal
+    # adjusts the counters
+    if current is not None and current[1] == like_type:
+        Like(pk=current[0], video_id=video.pk, user=user, like_type=like_type).delete()
+        return None, False
+    
+    # Change like to dislike or vice versa, otherwise insert it
+    like = Like(video=video, user=user, like_type=like_type)
+    Like.objects.bulk_create(
+        [like],
+        update_conflicts=True,
+        unique_fields=['video', 'user'],
+        update_fields=['like_type'],
+    )
+    deltas = {Like.COUNTERS[like_type]: 1}
+    if current is not None:
+        like.pk, like.created_at = current[0], current[2]
+        deltas[Like.COUNTERS[current[1]]] = -1
+    # bulk_create() skips the signals maintaining the counters
+    Video.all_objects.filter(pk=video.pk).add_to_counters(**deltas)
+    
+    # Create notification for video owner if liker is not the video owner
+    if user.pk != video.uploader_id:
+        Notification.objects.create(
+            recipient_id=video.uploader_id,
+            sender=user,
+            notification_type='like',
+            video=video,
+            text=f'{user.username} {like_type}d your video "{video.title}"'
+        )
+    return like, current is None
+
 # Like Views
 class LikeView(generics.CreateAPIView):
     serializer_class = LikeSerializer
@@ -238,47 +512,39 @@ class LikeView(generics.CreateAPIView):
         
         if not video_id or not like_type:
             return Response({'error': 'Video ID and like type are required'}, status=status.HTTP_400_BAD_REQUEST)
+        if like_type not in dict(Like.LIKE_CHOICES):
+            return Response({'error': 'Like type must be like or dislike'}, status=status.HTTP_400_BAD_REQUEST)
         
-        video = get_object_or_404(Video, id=video_id)
-        
-        # Check if user already liked/disliked this video
-        like, created = Like.objects.get_or_create(
-            video=video,
-            user=request.user,
-            defaults={'like_type': like_type}
-        )
+        video = get_object_or_404(Video.objects.only('id', 'title', 'uploader_id'), id=video_id)
         
-        if not created:
-            # User already liked/disliked, update the type
-            if like.like_type == like_type:
-                # If same type, remove the like/dislike
-                like.delete()
-                return Response({'status': f'{like_type} removed'}, status=status.HTTP_200_OK)
-            else:
-                # Change like to dislike or vice versa
-                like.like_type = like_type
-                like.save()
-        
-        # Create notification for video owner if liker is not the video owner
-        if request.user != video.uploader:
-            Notification.objects.create(
-                recipient=video.uploader,
-                sender=request.user,
-                notification_type='like',
-                video=video,
-                text=f'{request.user.username} {like_type}d your video "{video.title}"'
-            )
+        like, created = run_write(_apply_like, video, request.user, like_type)
+        if like is None:
+            return Response({'status': f'{like_type} removed'}, status=status.HTTP_200_OK)
         
         serializer = self.get_serializer(like)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 # Notification Views
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+class NotificationViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user)
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation has no user
+            return Notification.objects.none()
+        return notification_listing(
+            Notification.objects.filter(recipient=self.request.user), self.get_selection()
+        )
+    
+    @conditional(notification_validators)
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return fast_list(self, queryset, notification_plan)
+    
+    @conditional(notification_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -291,25 +557,222 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     def mark_all_as_read(self, request):
         notifications = self.get_queryset()
         notifications.update(is_read=True)
+        # update() sends no signals
+        CollectionVersion.bump(f'notifications:{request.user.pk}')
         return Response({'status': 'all marked as read'})
 
+# Playlist Views
+class PlaylistViewSet(viewsets.ModelViewSet):
+    serializer_class = PlaylistSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly, IsPlaylistOwnerOrReadOnly]
+    
+    def get_queryset(self):
+        """
+        Playlists the user can see. The list holds the user's own playlists,
+        or the public ones of the user ``?owner=``.
+        """
+        user = self.request.user
+        playlists = Playlist.objects.select_related('owner')
+        if self.action == 'list':
+            owner = self.request.query_params.get('owner', '')
+            if owner.isdigit():
+                playlists = playlists.filter(owner_id=owner)
+                return playlists if user.pk == int(owner) else playlists.filter(privacy='public')
+            return playlists.filter(owner=user) if user.is_authenticated else playlists.none()
+        
+        visible = Q(privacy__in=('public', 'unlisted'))
+        if user.is_authenticated:
+            visible |= Q(owner=user)
+        return playlists.filter(visible)
+    
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+    
+    @action(detail=True, methods=['get', 'post'])
+    def items(self, request, pk=None):
+        """
+        GET: the videos of the playlist in order, cursor-paginated.
+        POST ``{"videos": [id, ...]}``: append up to PLAYLIST_APPEND_LIMIT
+        videos at once. Videos already in the playlist are skipped.
+        """
+        playlist = self.get_object()
+        if request.method == 'POST':
+            video_ids = request.data.get('videos')
+            if not isinstance(video_ids, list) or not video_ids:
+                return Response({'error': 'videos must be a list of video ids'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(video_ids) > settings.PLAYLIST_APPEND_LIMIT:
+                return Response(
+                    {'error': f'At most {settings.PLAYLIST_APPEND_LIMIT} videos per request'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            video_ids = _valid_uuids([str(video_id) for video_id in video_ids])
+            if video_ids is None:
+                return Response({'error': 'videos must be video UUIDs'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                added = append_videos(playlist, video_ids, request.user)
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {'added': added, 'items_count': playlist.items_count + added}, status=status.HTTP_201_CREATED
+            )
+        
+        paginator = PlaylistItemPagination()
+        rows = playlist_item_plan.values(visible_items(playlist, request.user))
+        page = paginator.paginate_queryset(rows, request, view=self)
+        return paginator.get_paginated_response(playlist_item_plan.serialize(page, {'request': request}))
+    
+    @action(detail=True, methods=['post'], url_path=r'items/(?P<item_id>\d+)/move')
+    def move(self, request, pk=None, item_id=None):
+        """
+        Move an item right after the item ``after``, or to the top when
+        ``after`` is null. Only the moved item is rewritten.
+        """
+        playlist = self.get_object()
+        items = PlaylistItem.objects.filter(playlist=playlist).only('id', 'rank', 'playlist_id')
+        item = get_object_or_404(items, pk=item_id)
+        after = request.data.get('after')
+        if after is not None:
+            if not str(after).isdigit() or int(after) == item.pk:
+                return Response({'error': 'after must be the id of another item'}, status=status.HTTP_400_BAD_REQUEST)
+            after = get_object_or_404(items, pk=after)
+        item = move_item(item, after)
+        return Response({'id': item.pk, 'rank': item.rank})
+    
+    @action(detail=True, methods=['delete'], url_path=r'items/(?P<item_id>\d+)')
+    def remove(self, request, pk=None, item_id=None):
+        playlist = self.get_object()
+        item = get_object_or_404(PlaylistItem.objects.only('id', 'playlist_id'), playlist=playlist, pk=item_id)
+        remove_item(item)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 # Search Views
-class SearchView(generics.ListAPIView):
+class SuggestionsView(APIView):
+    """
+    Search-as-you-type suggestions for ``?q=`` (at most ``?limit=``, 10 by
+    default): video titles, tags, categories and channels, most popular
+    first, from the in-memory index in videos/suggestions.py.
+    """
+    permission_classes = [AllowAny]
+    # The same for everyone, no need to look at the token
+    authentication_classes = []
+    throttle_scope = 'suggestions'
+    throttle_classes = [ScopedRateThrottle]
+    
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', MAX_SUGGESTIONS)), 1), MAX_SUGGESTIONS)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = Response({'query': query, 'suggestions': get_suggestion_index().suggest(query, limit)})
+        patch_cache_control(response, public=True, max_age=60)
+        return response
+
+class CaptionSearchView(SparseFieldsViewMixin, generics.GenericAPIView):
+    """
+    Transcript search: the videos with caption cues containing every word
+    of ``?q=``, most matching cues first, each with its first matching
+    ``hits`` (start and end in seconds, text and language) to jump to. See
+    videos/captions.py.
+    """
+    serializer_class = VideoSerializer
+    permission_classes = [AllowAny]
+    
+    def get_queryset(self):
+        return video_listing(Video.objects.visible_to(self.request.user), self.get_selection())
+    
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        matches = search_captions(query, self.get_queryset()) if query else []
+        page = self.paginate_queryset(matches)
+        hits = caption_hits(page)
+        
+        context = self.get_serializer_context()
+        plan = video_plan.select(context.get('selection'))
+        rows = list(self.get_queryset().filter(id__in=[match.video for match in page]).values(
+            *dict.fromkeys(['id', *plan.columns])
+        ))
+        videos = dict(zip((str(row['id']) for row in rows), plan.serialize(rows, context)))
+        # Without hits all its matching cues were replaced since the index was built
+        return self.get_paginated_response([
+            {'video': videos[match.video], 'matches': match.cues, 'hits': hits[match.video]}
+            for match in page if match.video in videos and hits[match.video]
+        ])
+
+class ExportView(APIView):
+    """
+    Streams an export of the requesting user's channel (staff may pick any
+    with ``?channel=<username>``): its ``videos``, daily ``views`` or
+    ``comments``, as CSV or JSONL, gzip-compressed with a ``.gz`` suffix.
+    See api/exports.py.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def perform_content_negotiation(self, request, force=False):
+        # A file whatever the client accepts; errors are still JSON
+        return super().perform_content_negotiation(request, force=True)
+    
+    def get(self, request, kind, encoding, compressed=None):
+        channel = request.user
+        username = request.query_params.get('channel')
+        if username and username != request.user.username:
+            if not request.user.is_staff:
+                return Response(
+                    {'error': 'You can only export your own channel'}, status=status.HTTP_403_FORBIDDEN
+                )
+            channel = get_object_or_404(User, username=username)
+        
+        blocks = stream_export(kind, channel, encoding, compress=bool(compressed))
+        if isinstance(request._request, ASGIRequest):
+            blocks = aiter_blocks(blocks)
+        response = StreamingHttpResponse(
+            blocks, content_type='application/gzip' if compressed else ENCODINGS[encoding]
+        )
+        filename = f'{channel.username}-{kind}.{encoding}{compressed or ""}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+class QuerySearchFilter(filters.SearchFilter):
+    # SearchView takes its terms from ?q=, not ?search=
+    search_param = 'q'
+
+class SearchView(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = VideoSerializer
     permission_classes = [AllowAny]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [QuerySearchFilter]
     search_fields = ['title', 'description', 'tags', 'uploader__username']
     
+    def list(self, request, *args, **kwargs):
+        """
+        Videos matching ``?q=`` in their title, description, tags, channel
+        or captions, the latter with their first matching ``captions``
+        cues.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        query = request.query_params.get('q', '')
+        matches = {match.video: match for match in get_caption_index().search(query)} if query else {}
+        if matches:
+            queryset = queryset | self.get_queryset().filter(pk__in=list(matches))
+        
+        context = self.get_serializer_context()
+        selection = context.get('selection')
+        plan = video_plan.select(selection)
+        rows = queryset.values(*dict.fromkeys(['id', *plan.columns]))
+        page = self.paginate_queryset(rows)
+        rows = page if page is not None else list(rows)
+        videos = plan.serialize(rows, context)
+        if selection is None or selection.includes('captions'):
+            hits = caption_hits([matches[str(row['id'])] for row in rows if str(row['id']) in matches])
+            for row, video in zip(rows, videos):
+                video['captions'] = hits.get(str(row['id']), [])
+        return self.get_paginated_response(videos) if page is not None else Response(videos)
+    
     def get_queryset(self):
         query = self.request.query_params.get('q', '')
         if not query:
             return Video.objects.none()
             
         # Only public videos in search results for anonymous users
-        if self.request.user.is_authenticated:
-            return Video.objects.filter(
-                Q(privacy='public') | 
-                Q(privacy='unlisted') | 
-                Q(uploader=self.request.user)
-            )
-        return Video.objects.filter(privacy='public')
+        return video_listing(Video.objects.visible_to(self.request.user), self.get_selection())
@@ -0,0 +1,88 @@
+"""
+Load test for slow concurrent clients against a running server.
+
+Opens --clients concurrent keep-alive connections, each requesting --path in
+a loop and reading every response slowly (--read-delay seconds before
+reading the body), and reports how many clients were served, throughput
+and latency. Throttling applies as usual, so check the status codes. Run
+it against one process of each server to compare:
+
+    gunicorn mytube.wsgi -w 1 --threads 8 -b 127.0.0.1:8000
+    uvicorn mytube.asgi:application --workers 1 --port 8001
+
+    python bench_asgi.py --port 8000 --clients 500
+    python bench_asgi.py --port 8001 --clients 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+
+async def client(args, deadline, stats):
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(args.host, args.port), timeout=args.timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        stats['refused'] += 1
+        return
+
+    request = (
+        f'GET {args.path} HTTP/1.1\r\n'
+        f'Host: {args.host}\r\n'
+        'Connection: keep-alive\r\n\r\n'
+    ).encode()
+    served = False
+    try:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            writer.write(request)
+            await writer.drain()
+            headers = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=args.timeout)
+            status = headers.split(b' ', 2)[1].decode()
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            length = 0
+            for line in headers.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            # A slow consumer: wait before draining the body
+            await asyncio.sleep(args.read_delay)
+            await asyncio.wait_for(reader.readexactly(length), timeout=args.timeout)
+            stats['latencies'].append(time.monotonic() - started)
+            served = True
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        stats['errors'] += 1
+    finally:
+        stats['served'] += served
+        writer.close()
+
+
+async def run(args):
+    stats = {'latencies': [], 'statuses': {}, 'served': 0, 'errors': 0, 'refused': 0}
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*(client(args, deadline, stats) for _ in range(args.clients)))
+
+    latencies = sorted(stats['latencies']) or [0]
+    print(f"clients served:   {stats['served']}/{args.clients}")
+    print(f"errors/refused:   {stats['errors']}/{stats['refused']}")
+    print(f"status codes:     {stats['statuses']}")
+    print(f"requests/s:       {len(stats['latencies']) / args.duration:.1f}")
+    print(f"latency p50:      {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p99:      {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--path', default='/api/videos/featured/')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--read-delay', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
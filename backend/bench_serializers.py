@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for the fast serialization path.
+
+Fills a scratch SQLite database with videos, then compares the per-row cost
+of VideoSerializer against the compiled field plan in api/fast_serializers.py,
+and of JSONRenderer against ORJSONRenderer, checking the rendered bytes match.
+
+    python bench_serializers.py --rows 1000 --repeat 5
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp.name, 'bench.sqlite3')}"
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytube.settings')
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+    from accounts.models import User
+    from videos.models import Video, Category
+    from api.fast_serializers import video_plan
+    from api.renderers import ORJSONRenderer
+    from api.serializers import VideoSerializer
+
+    call_command('migrate', verbosity=0)
+    uploader = User.objects.create_user(username='bench', email='bench@example.com', password='bench')
+    category = Category.objects.create(name='Benchmark')
+    Video.objects.bulk_create([
+        Video(
+            title=f'Benchmark video {i}', slug=f'benchmark-video-{i}', description='A description',
+            file='videos/bench.mp4', thumbnail='thumbnails/bench.jpg',
+            uploader=uploader, category=category, tags='bench,video',
+        )
+        for i in range(args.rows)
+    ])
+    queryset = Video.objects.for_listing().order_by('created_at')
+
+    query_time, videos = timed(lambda: list(queryset.all()), args.repeat)
+    values_time, rows = timed(lambda: list(video_plan.values(queryset)), args.repeat)
+    drf_time, drf_data = timed(lambda: VideoSerializer(videos, many=True).data, args.repeat)
+    fast_time, fast_data = timed(lambda: video_plan.serialize(rows), args.repeat)
+
+    json_time, json_bytes = timed(lambda: JSONRenderer().render(drf_data), args.repeat)
+    orjson_time, orjson_bytes = timed(lambda: ORJSONRenderer().render(fast_data), args.repeat)
+
+    def per_row(seconds):
+        return f'{seconds / args.rows * 1e6:8.1f} us/row'
+
+    print(f'{args.rows} rows, best of {args.repeat}')
+    print(f'query (models):   {per_row(query_time)}')
+    print(f'query (values):   {per_row(values_time)}')
+    print(f'VideoSerializer:  {per_row(drf_time)}')
+    print(f'FieldPlan:        {per_row(fast_time)}')
+    print(f'JSONRenderer:     {per_row(json_time)}')
+    print(f'ORJSONRenderer:   {per_row(orjson_time)}')
+    print(f'identical output: {json_bytes == orjson_bytes}')
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
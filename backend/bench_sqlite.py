@@ -0,0 +1,120 @@
+"""
+Concurrency benchmark for SQLite production mode.
+
+Runs the same mixed workload (video list reads, view and like writes from
+many threads) against a scratch database twice: once with the default SQLite
+settings and once with SQLITE_PRODUCTION_MODE enabled, then prints read and
+write throughput and the number of "database is locked" errors.
+
+    python bench_sqlite.py --readers 8 --writers 8 --seconds 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def run_worker(args):
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    os.environ['SQLITE_PRODUCTION_MODE'] = str(args.mode == 'tuned')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytube.settings')
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import OperationalError, connection
+    from accounts.models import User
+    from videos.models import Video
+    from videos.writer import run_write
+    from api.views import _record_view, _apply_like
+
+    call_command('migrate', verbosity=0)
+    uploader = User.objects.create_user(username='bench', email='bench@example.com', password='bench')
+    users = [
+        User.objects.create_user(username=f'bench{i}', email=f'bench{i}@example.com', password='bench')
+        for i in range(args.writers)
+    ]
+    videos = [
+        Video.objects.create(title=f'Benchmark video {i}', file='videos/bench.mp4', uploader=uploader)
+        for i in range(50)
+    ]
+    connection.close()
+
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def reader():
+        while time.monotonic() < deadline:
+            try:
+                list(Video.objects.filter(privacy='public').order_by('-created_at')[:10])
+                count('reads')
+            except OperationalError:
+                count('locked')
+        connection.close()
+
+    def writer(user):
+        i = 0
+        while time.monotonic() < deadline:
+            video = videos[i % len(videos)]
+            i += 1
+            try:
+                if i % 2:
+                    run_write(_record_view, video.id, user.id, '127.0.0.1', 'bench')
+                else:
+                    run_write(_apply_like, video, user, 'like')
+                count('writes')
+            except OperationalError:
+                count('locked')
+        connection.close()
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(
+        f"{args.mode:>8}: {counts['reads'] / args.seconds:10.1f} reads/s "
+        f"{counts['writes'] / args.seconds:10.1f} writes/s "
+        f"{counts['locked']:6d} locked errors"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mode', choices=['default', 'tuned'], help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_worker(args)
+        return
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds}s per run')
+    for mode in ('default', 'tuned'):
+        with tempfile.TemporaryDirectory() as tmp:
+            subprocess.run([
+                sys.executable, __file__,
+                '--readers', str(args.readers),
+                '--writers', str(args.writers),
+                '--seconds', str(args.seconds),
+                '--mode', mode,
+                '--db', os.path.join(tmp, 'bench.sqlite3'),
+            ], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Admission control: load shedding by request priority.
+
+``AdmissionMiddleware`` (mytube/middleware.py) puts every request in one of
+three classes, by its path, its method and whether it carries credentials
+(an Authorization header or a session cookie):
+
+``low``
+    ADMISSION_LOW_PRIORITY_PATHS (view counts, likes, the featured and
+    related lists, search suggestions), and without credentials
+    ADMISSION_ANONYMOUS_LOW_PRIORITY_PATHS (video lists, search);
+``high``
+    other writes, and other requests with credentials;
+``normal``
+    everything else.
+
+Each process serves at most ADMISSION_MAX_IN_FLIGHT requests at once, the
+last ADMISSION_RESERVED of them high ones only. Low requests also have a
+limit of their own which adapts to the load: every ADMISSION_ADJUST_INTERVAL
+seconds it is halved while the process is overloaded, and grows by a quarter
+while it is not. The process is overloaded when all but the reserved slots
+are taken, when the recent latency of normal or low requests (an average
+that fades out when no request completes) is above ADMISSION_LATENCY_TARGET,
+or when requests recently waited longer than ADMISSION_QUEUE_TARGET in the
+front server, as told by an ``X-Request-Start: t=<seconds>`` header (nginx:
+``proxy_set_header X-Request-Start "t=${msec}";``). Threaded WSGI servers
+only pass a process as many requests as it has threads, so there the queue
+time is what shows the overload. Clients could send the header too, so it is
+only read with ADMISSION_TRUST_REQUEST_START, when the front server always
+sets it; values in the future or more than MAX_QUEUE_TIME seconds old are
+ignored, and no request counts for more than QUEUE_SAMPLE_CAP times
+ADMISSION_QUEUE_TARGET.
+
+A request that is not admitted gets a 503 with Retry-After, unless it is a
+low GET of which a stale copy is at hand: the last 200 JSON response of the
+URL is kept for ADMISSION_STALE_MAX_AGE seconds, for anonymous requests and
+for ADMISSION_SHARED_PATHS (the same for everybody), and is served with an
+``Age`` and an ``X-Load-Shed: stale`` header.
+
+Credentials are only looked at, not checked: invalid ones are turned down
+by the view, within the reserved capacity, which they hold very briefly.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIORITIES = ('high', 'normal', 'low')
+WEIGHT = 0.2  # Of each new sample in the latency averages
+HALF_LIFE = 2.0  # Seconds for an average to halve with no new samples
+MAX_STALE_SIZE = 512 * 1024  # Bytes of the largest response kept
+MAX_QUEUE_TIME = 5.0  # Seconds; older X-Request-Start values are wrong clocks or replays
+CLOCK_SKEW = 1.0  # Seconds an X-Request-Start may be ahead of this server's clock
+QUEUE_SAMPLE_CAP = 4  # Times ADMISSION_QUEUE_TARGET, the most a single request waited counts for
+
+
+def _pattern(paths):
+    return re.compile('|'.join(f'(?:{path})' for path in paths)) if paths else None
+
+
+def _matches(pattern, path):
+    return pattern is not None and pattern.match(path) is not None
+
+
+def queue_time(request, now):
+    """
+    Seconds ``request`` waited in the front server before reaching Django,
+    from its ``X-Request-Start`` header, or None when there is none or it
+    is not plausible.
+    """
+    header = request.META.get('HTTP_X_REQUEST_START', '')
+    try:
+        started = float(header.removeprefix('t='))
+    except ValueError:
+        return None
+    # Some servers send milli- or microseconds
+    while started > 1e11:
+        started /= 1000
+    waited = now - started
+    if not -CLOCK_SKEW <= waited <= MAX_QUEUE_TIME:
+        return None
+    return max(0.0, waited)
+
+
+class FadingAverage:
+    """
+    Exponentially weighted average of samples, which halves every
+    HALF_LIFE seconds without one.
+    """
+
+    __slots__ = ('value', 'updated')
+
+    def __init__(self):
+        self.value = 0.0
+        self.updated = None
+
+    def get(self, now):
+        if self.updated is None:
+            return 0.0
+        return self.value * 0.5 ** ((now - self.updated) / HALF_LIFE)
+
+    def add(self, sample, now):
+        current = self.get(now)
+        self.value = sample if self.updated is None else current + WEIGHT * (sample - current)
+        self.updated = now
+
+
+class Ticket:
+    __slots__ = ('priority', 'stale_key', 'started', 'admitted')
+
+    def __init__(self, priority, stale_key, started):
+        self.priority = priority
+        self.stale_key = stale_key
+        self.started = started
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    The in-flight requests, latencies and stale responses of one process.
+    """
+
+    def __init__(self):
+        self.max_in_flight = settings.ADMISSION_MAX_IN_FLIGHT
+        self.shared_limit = max(1, self.max_in_flight - settings.ADMISSION_RESERVED)
+        self.low_limit = self.shared_limit
+        self.low_paths = _pattern(settings.ADMISSION_LOW_PRIORITY_PATHS)
+        self.anonymous_low_paths = _pattern(settings.ADMISSION_ANONYMOUS_LOW_PRIORITY_PATHS)
+        self.shared_paths = _pattern(settings.ADMISSION_SHARED_PATHS)
+        self.in_flight = dict.fromkeys(PRIORITIES, 0)
+        self.total = 0
+        self.latency = {'normal': FadingAverage(), 'low': FadingAverage()}
+        self.queue_time = FadingAverage()
+        self.overloaded = False
+        self.adjusted = 0.0
+        self.stale = OrderedDict()  # Full path -> (stored at, content)
+        self.lock = threading.Lock()
+        self.in_flight_gauges = {priority: metrics.ADMISSION_IN_FLIGHT.labels(priority) for priority in PRIORITIES}
+        metrics.record_admission_state(self.low_limit, self.overloaded)
+
+    def classify(self, request):
+        """
+        The priority of ``request`` and the key of its stale copies, if it
+        may be answered with one.
+        """
+        path = request.path
+        credentials = 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+        if _matches(self.low_paths, path) or (not credentials and _matches(self.anonymous_low_paths, path)):
+            priority = 'low'
+        elif credentials or request.method not in SAFE_METHODS:
+            priority = 'high'
+        else:
+            priority = 'normal'
+        stale_key = None
+        if priority == 'low' and request.method == 'GET' and (not credentials or _matches(self.shared_paths, path)):
+            stale_key = request.get_full_path()
+        return priority, stale_key
+
+    def admit(self, request):
+        now = time.monotonic()
+        waited = queue_time(request, time.time()) if settings.ADMISSION_TRUST_REQUEST_START else None
+        ticket = Ticket(*self.classify(request), now)
+        with self.lock:
+            if waited is not None:
+                self.queue_time.add(min(waited, QUEUE_SAMPLE_CAP * settings.ADMISSION_QUEUE_TARGET), now)
+            self._adjust(now)
+            if ticket.priority == 'high':
+                ticket.admitted = self.total < self.max_in_flight
+            elif ticket.priority == 'normal':
+                ticket.admitted = self.total < self.shared_limit
+            else:
+                ticket.admitted = self.total < self.shared_limit and self.in_flight['low'] < self.low_limit
+            if ticket.admitted:
+                self.total += 1
+                self.in_flight[ticket.priority] += 1
+        if waited is not None:
+            metrics.ADMISSION_QUEUE_TIME.observe(waited)
+        if ticket.admitted:
+            self.in_flight_gauges[ticket.priority].inc()
+        return ticket
+
+    def _adjust(self, now):
+        """
+        Halve or grow the low priority limit, at most once an interval.
+        """
+        if now - self.adjusted < settings.ADMISSION_ADJUST_INTERVAL:
+            return
+        self.adjusted = now
+        target = settings.ADMISSION_LATENCY_TARGET
+        self.overloaded = (
+            self.total >= self.shared_limit
+            or any(average.get(now) > target for average in self.latency.values())
+            or self.queue_time.get(now) > settings.ADMISSION_QUEUE_TARGET
+        )
+        if self.overloaded:
+            self.low_limit = max(1, self.low_limit // 2)
+        else:
+            self.low_limit = min(self.shared_limit, self.low_limit + 1 + self.low_limit // 4)
+        metrics.record_admission_state(self.low_limit, self.overloaded)
+
+    def release(self, ticket):
+        now = time.monotonic()
+        with self.lock:
+            self.total -= 1
+            self.in_flight[ticket.priority] -= 1
+            if ticket.priority in self.latency:
+                self.latency[ticket.priority].add(now - ticket.started, now)
+        self.in_flight_gauges[ticket.priority].dec()
+
+    def keep(self, ticket, response):
+        """
+        Keep ``response`` as the stale copy of its URL, if it can be one.
+        """
+        if (
+            ticket.stale_key is None
+            or response.status_code != 200
+            or response.streaming
+            or not response.get('Content-Type', '').startswith('application/json')
+            or len(response.content) > MAX_STALE_SIZE
+        ):
+            return
+        with self.lock:
+            self.stale[ticket.stale_key] = (time.monotonic(), response.content)
+            self.stale.move_to_end(ticket.stale_key)
+            if len(self.stale) > settings.ADMISSION_STALE_ENTRIES:
+                self.stale.popitem(last=False)
+
+    def shed(self, ticket):
+        """
+        The response to a request that was not admitted: a stale copy, or
+        a 503.
+        """
+        with self.lock:
+            entry = self.stale.get(ticket.stale_key) if ticket.stale_key is not None else None
+        age = ticket.started - entry[0] if entry is not None else None
+        if age is not None and age <= settings.ADMISSION_STALE_MAX_AGE:
+            metrics.ADMISSION_SHED.labels(ticket.priority, 'stale').inc()
+            response = HttpResponse(entry[1], content_type='application/json')
+            response['Age'] = str(int(age))
+            response['X-Load-Shed'] = 'stale'
+            return response
+        metrics.ADMISSION_SHED.labels(ticket.priority, 'rejected').inc()
+        response = JsonResponse({'detail': 'The server is busy, please try again shortly.'}, status=503)
+        response['Retry-After'] = str(settings.ADMISSION_RETRY_AFTER)
+        response['X-Load-Shed'] = 'rejected'
+        return response
@@ -13,4 +13,30 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytube.settings')
 
-application = get_asgi_application()
+# Use the async read endpoints. Persistent connections are not reused across
+# the per-request threads the async ORM runs in, so close them after each
+# request unless configured otherwise.
+os.environ.setdefault('ASYNC_READ_VIEWS', 'True')
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+
+django_asgi_app = get_asgi_application()
+
+# Imported once the apps are loaded
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import OriginValidator  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from videos.routing import websocket_urlpatterns  # noqa: E402
+from videos.suggestions import warm_index  # noqa: E402
+
+warm_index()
+
+# WebSockets (live viewer counts, see videos/presence.py) from the same
+# origins the API accepts
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': OriginValidator(
+        URLRouter(websocket_urlpatterns),
+        ['*'] if settings.CORS_ALLOW_ALL_ORIGINS else settings.CORS_ALLOWED_ORIGINS,
+    ),
+})
@@ -0,0 +1,213 @@
+"""
+Prometheus metrics.
+
+``MetricsMiddleware`` (mytube/middleware.py) records, per route (the URL
+name, e.g. ``video-detail``) and method, the latency and response size
+histograms, the requests by status, throttled (429) requests, and the number
+and total duration of the database queries each request made. Queries are
+timed by an execute wrapper installed on every database connection, which
+only does work while a request is being recorded. ``record_cache()`` counts
+hits and misses of the caches worth watching: conditional GETs answered with
+a 304 and the precomputed search suggestions.
+
+``AdmissionMiddleware`` (mytube/admission.py) reports the requests in flight
+and the requests shed per priority, the time requests waited in the front
+server, and per process the low priority limit and whether it is overloaded.
+
+Everything is exported at ``/metrics`` in the Prometheus text format, to
+scrapers sending METRICS_TOKEN. Without a token only direct requests from
+loopback and private addresses are answered, not those a proxy forwarded
+(with an X-Forwarded-For header). With several worker processes,
+point PROMETHEUS_MULTIPROC_DIR at an empty directory: each process then
+writes its samples to memory-mapped files in there and ``/metrics`` sums
+them up, whichever worker serves the scrape. The directory has to be wiped
+before the server starts.
+
+Recording a request costs a few microseconds: the label children of a route
+are looked up once per process and every sample is a lock and an add.
+"""
+
+import hmac
+import ipaddress
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_safe
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+LATENCY_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+REQUEST_LATENCY = Histogram(
+    'mytube_http_request_duration_seconds', 'Time spent serving a request',
+    ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'mytube_http_response_size_bytes', 'Size of the response body',
+    ['route', 'method'], buckets=SIZE_BUCKETS,
+)
+REQUESTS = Counter(
+    'mytube_http_requests', 'Requests served, by status code',
+    ['route', 'method', 'status'],
+)
+THROTTLED = Counter(
+    'mytube_http_throttled_requests', 'Requests rejected by a rate limit',
+    ['route', 'method'],
+)
+DB_QUERIES = Histogram(
+    'mytube_db_queries_per_request', 'Database queries made by a request',
+    ['route', 'method'], buckets=QUERY_BUCKETS,
+)
+DB_TIME = Histogram(
+    'mytube_db_query_duration_seconds', 'Time a request spent in database queries',
+    ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    'mytube_cache_requests', 'Cache lookups, by result (hit or miss)',
+    ['cache', 'result'],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'mytube_admission_in_flight_requests', 'Requests being served, by priority',
+    ['priority'], multiprocess_mode='livesum',
+)
+ADMISSION_SHED = Counter(
+    'mytube_admission_shed_requests', 'Requests not admitted, by priority and outcome (stale or rejected)',
+    ['priority', 'outcome'],
+)
+ADMISSION_QUEUE_TIME = Histogram(
+    'mytube_admission_queue_duration_seconds', 'Time a request waited in the front server (X-Request-Start)',
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_LOW_LIMIT = Gauge(
+    'mytube_admission_low_priority_limit', 'Low priority requests a process serves at once',
+    multiprocess_mode='liveall',
+)
+ADMISSION_OVERLOADED = Gauge(
+    'mytube_admission_overloaded', 'Whether a process is shedding low priority requests',
+    multiprocess_mode='liveall',
+)
+
+# Requests whose URL did not resolve, so 404 scans do not create new series
+UNMATCHED = 'unmatched'
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+_stats = ContextVar('request_stats', default=None)
+
+
+def start_request():
+    return _stats.set(RequestStats())
+
+
+def finish_request(token, request, response, started):
+    """
+    Record the request started (``time.perf_counter()``) at ``started``.
+    """
+    elapsed = time.perf_counter() - started
+    stats = _stats.get()
+    _stats.reset(token)
+    match = request.resolver_match
+    route = match.view_name if match is not None else UNMATCHED
+    # Clients can send any method name: only standard ones become labels
+    method = request.method if request.method in HTTP_METHODS else 'other'
+    latency, size, db_queries, db_time = _children(route, method)
+    latency.observe(elapsed)
+    db_queries.observe(stats.queries)
+    db_time.observe(stats.query_time)
+    if not response.streaming:
+        size.observe(len(response.content))
+    elif response.has_header('Content-Length'):
+        size.observe(int(response['Content-Length']))
+    status = response.status_code
+    requests = _label_cache.get((route, method, status))
+    if requests is None:
+        requests = _label_cache[route, method, status] = REQUESTS.labels(route, method, str(status))
+    requests.inc()
+    if status == 429:
+        THROTTLED.labels(route, method).inc()
+
+
+# Label children by (route, method) and (route, method, status)
+_label_cache = {}
+
+
+def _children(route, method):
+    children = _label_cache.get((route, method))
+    if children is None:
+        children = _label_cache[route, method] = tuple(
+            metric.labels(route, method) for metric in (REQUEST_LATENCY, RESPONSE_SIZE, DB_QUERIES, DB_TIME)
+        )
+    return children
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def record_admission_state(low_limit, overloaded):
+    ADMISSION_LOW_LIMIT.set(low_limit)
+    ADMISSION_OVERLOADED.set(int(overloaded))
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # First in line, so that connection.execute_wrapper() blocks, which pop
+    # the last wrapper on exit, keep removing their own
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def _registry():
+    if not settings.PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def _is_internal(request):
+    if 'X-Forwarded-For' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+@require_safe
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = _is_internal(request)
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,223 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import admission, metrics, profiling
+from .routers import enable_replica_reads, replica_aliases, reset_routing
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_HEADER = 'X-Primary-Pin'
+PIN_META = 'HTTP_X_PRIMARY_PIN'
+
+
+class ReplicaPinningMiddleware:
+    """
+    Lets safe-method API reads use the read replicas and pins clients that
+    just wrote something to the primary for a short while.
+
+    The pin is a cookie for same-site clients and an ``X-Primary-Pin``
+    response header giving its length in seconds for the others: the SPA
+    calls the API cross-origin without credentials, so it keeps the pin
+    itself and sends ``X-Primary-Pin: 1`` back until it expires.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = None
+        if self.reads_from_replica(request):
+            token = enable_replica_reads()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                reset_routing(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = None
+        if self.reads_from_replica(request):
+            token = enable_replica_reads()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                reset_routing(token)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and replica_aliases()
+        ):
+            response.set_cookie(
+                settings.DATABASE_REPLICA_PIN_COOKIE,
+                '1',
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+            response[PIN_HEADER] = str(settings.DATABASE_REPLICA_PIN_SECONDS)
+        return response
+
+    def reads_from_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        if request.COOKIES.get(settings.DATABASE_REPLICA_PIN_COOKIE) or PIN_META in request.META:
+            return False
+        return request.path.startswith(tuple(settings.DATABASE_REPLICA_PATHS))
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, size, status and database time of every request,
+    see mytube/metrics.py. Goes first, so it times the other middleware too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        token = metrics.start_request()
+        response = self.get_response(request)
+        metrics.finish_request(token, request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = metrics.start_request()
+        response = await self.get_response(request)
+        metrics.finish_request(token, request, response, started)
+        return response
+
+
+class AdmissionMiddleware:
+    """
+    Sheds low priority requests when the process is overloaded and keeps
+    capacity for writes and signed-in users, see mytube/admission.py.
+    Comes right after CorsMiddleware, so that browsers can read shed
+    responses and stale copies, and inside MetricsMiddleware, which counts
+    them.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ADMISSION_CONTROL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.controller = admission.AdmissionController()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        ticket = self.controller.admit(request)
+        if not ticket.admitted:
+            return self.controller.shed(ticket)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.controller.release(ticket)
+        self.controller.keep(ticket, response)
+        return response
+
+    async def __acall__(self, request):
+        ticket = self.controller.admit(request)
+        if not ticket.admitted:
+            return self.controller.shed(ticket)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.controller.release(ticket)
+        self.controller.keep(ticket, response)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of requests, and those asking for it with a staff
+    token in ``X-Profile``, see mytube/profiling.py.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.mode = settings.PROFILING_MODE
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        on_demand = self.on_demand(request)
+        if not on_demand and not self.sampled():
+            return self.get_response(request)
+        profile = profiling.Profile(self.mode)
+        try:
+            response = self.get_response(request)
+        finally:
+            name = self.finish(profile, request)
+        if on_demand and name:
+            response['X-Profile-File'] = name
+        return response
+
+    async def __acall__(self, request):
+        # Checking the token queries the database
+        on_demand = request.META.get(profiling.HEADER) and await sync_to_async(self.on_demand)(request)
+        if not on_demand and not self.sampled():
+            return await self.get_response(request)
+        profile = profiling.Profile('sample')
+        try:
+            response = await self.get_response(request)
+        finally:
+            name = await sync_to_async(self.finish)(profile, request)
+        if on_demand and name:
+            response['X-Profile-File'] = name
+        return response
+
+    def finish(self, profile, request):
+        """
+        Write the profile; a failure (disk full, permissions) is logged and
+        never replaces the response or exception of the request.
+        """
+        try:
+            return profile.finish(request)
+        except Exception:
+            logger.exception('Writing the profile of %s failed', request.path)
+            return None
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def on_demand(self, request):
+        token = request.META.get(profiling.HEADER)
+        return bool(token) and profiling.token_is_valid(token)
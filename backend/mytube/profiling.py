@@ -0,0 +1,281 @@
+"""
+Sampled profiling of real requests.
+
+``ProfilingMiddleware`` (mytube/middleware.py) profiles a random
+PROFILING_SAMPLE_RATE fraction of requests, plus every request carrying an
+``X-Profile`` header with a token from ``manage.py profiling_token
+<email>`` (staff only, valid for PROFILING_TOKEN_MAX_AGE seconds). With
+sampling off and no header a request costs one ``random()`` call at most.
+
+PROFILING_MODE picks the profiler:
+
+``sample``
+    A single background thread snapshots the stack of every thread serving
+    a profiled request each PROFILING_INTERVAL seconds. The stacks are
+    written in the collapsed format flamegraph.pl and speedscope read
+    (``frame;frame;frame count``). The overhead on the profiled request is
+    small and independent of how many functions it calls.
+``cprofile``
+    Deterministic cProfile, written as a pstats file. Exact call counts, but
+    it slows the profiled request down noticeably.
+
+Profiles go to PROFILING_DIR, one file per request, named after the view
+and action they profile, e.g.
+``1760000000123456789_4242_video-related.related_48ms.collapsed``. Only the
+latest PROFILING_MAX_FILES are kept. ``manage.py merge_profiles`` merges and
+summarizes them.
+
+Under ASGI requests are always sampled rather than traced, and only in the
+thread running their coroutine (the event loop), which the other requests
+in flight share.
+"""
+
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+
+TOKEN_SALT = 'mytube.profiling'
+HEADER = 'HTTP_X_PROFILE'
+EXTENSIONS = {'sample': '.collapsed', 'cprofile': '.prof'}
+
+_unsafe = re.compile(r'[^\w.-]+')
+
+
+def make_token(user):
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(user.get_username())
+
+
+def token_is_valid(token):
+    try:
+        username = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILING_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return get_user_model().objects.filter(
+        **{get_user_model().USERNAME_FIELD: username}, is_staff=True, is_active=True
+    ).exists()
+
+
+# Statistical sampler
+
+def _frame_label(code, labels={}):
+    label = labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for prefix in sorted(sys.path, key=len, reverse=True):
+            if prefix and filename.startswith(prefix + os.sep):
+                filename = filename[len(prefix) + 1:]
+                break
+        label = labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return label
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Sampler:
+    """
+    Samples the stacks of the threads registered with ``start()`` until
+    their ``stop()``, from one background thread shared by all of them.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = {}  # id(stacks) -> (thread id, Counter of collapsed stacks)
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, thread_id):
+        """
+        Start sampling ``thread_id``. Returns the Counter the stacks are
+        added to, to be passed to ``stop()``.
+        """
+        stacks = Counter()
+        with self.lock:
+            self.active[id(stacks)] = (thread_id, stacks)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return stacks
+
+    def stop(self, stacks):
+        with self.lock:
+            del self.active[id(stacks)]
+        return stacks
+
+    def _run(self):
+        while True:
+            if not self.active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.active.values():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = Sampler(settings.PROFILING_INTERVAL)
+    return _sampler
+
+
+# Per request
+
+class Profile:
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.profiler = self.stacks = None
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.stacks = get_sampler().start(threading.get_ident())
+
+    def finish(self, request):
+        """
+        Stop profiling and write the profile. Returns its file name.
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+        else:
+            stacks = get_sampler().stop(self.stacks)
+        elapsed_ms = round((time.perf_counter() - self.started) * 1000)
+
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = f'{time.time_ns()}_{os.getpid()}_{request_tag(request)}_{elapsed_ms}ms{EXTENSIONS[self.mode]}'
+        path = os.path.join(directory, name)
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as output:
+                output.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+        _trim(directory, settings.PROFILING_MAX_FILES)
+        return name
+
+
+def request_tag(request):
+    """
+    ``<view name>.<action>`` of a resolved request, e.g. ``video-detail.retrieve``.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    action = getattr(match.func, 'actions', {}).get(request.method.lower()) or request.method
+    return _unsafe.sub('-', f'{match.view_name}.{action}')
+
+
+def _trim(directory, max_files):
+    names = sorted(name for name in os.listdir(directory) if name.endswith(tuple(EXTENSIONS.values())))
+    for name in names[:-max_files]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Trimmed by another process
+            pass
+
+
+# Reading profiles back
+
+@dataclass
+class ProfileFile:
+    path: str
+    timestamp: float
+    pid: int
+    tag: str
+    elapsed_ms: int
+    mode: str
+
+
+def list_profiles(directory=None, tag=None, since=None):
+    """
+    The profiles in ``directory`` (PROFILING_DIR by default), oldest first,
+    optionally only those whose tag contains ``tag`` or written after the
+    ``since`` timestamp.
+    """
+    directory = directory or settings.PROFILING_DIR
+    modes = {extension: mode for mode, extension in EXTENSIONS.items()}
+    profiles = []
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        stem, extension = os.path.splitext(name)
+        try:
+            stamp, pid, rest = stem.split('_', 2)
+            file_tag, elapsed = rest.rsplit('_', 1)
+            profile = ProfileFile(
+                os.path.join(directory, name), int(stamp) / 1e9, int(pid), file_tag,
+                int(elapsed.removesuffix('ms')), modes[extension],
+            )
+        except (KeyError, ValueError):
+            continue
+        if (tag is None or tag in profile.tag) and (since is None or profile.timestamp >= since):
+            profiles.append(profile)
+    return profiles
+
+
+def read_collapsed(path):
+    stacks = Counter()
+    with open(path, encoding='utf-8') as collapsed:
+        for line in collapsed:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def merge_collapsed(profiles):
+    """
+    The stacks of the sampled ``profiles`` summed up, each under a root
+    frame naming its view and action.
+    """
+    stacks = Counter()
+    for profile in profiles:
+        for stack, count in read_collapsed(profile.path).items():
+            stacks[f'{profile.tag};{stack}'] += count
+    return stacks
+
+
+def hot_functions(stacks):
+    """
+    ``(self, total)`` sample Counters per function: samples with the
+    function on top of the stack, and with the function anywhere in it.
+    """
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        # Without the root frame added by merge_collapsed()
+        frames = stack.split(';')[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return own, total
@@ -0,0 +1,68 @@
+"""
+Database routing for a primary database with optional read replicas.
+
+Reads issued while serving a safe-method request to one of the
+``DATABASE_REPLICA_PATHS`` prefixes are spread over the replica aliases;
+everything else (writes, management commands, background jobs) uses the
+primary. Once a client writes, it is pinned to the primary for
+``DATABASE_REPLICA_PIN_SECONDS`` so it always reads its own writes.
+"""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY_DB = 'default'
+
+# Per-request routing state, set by ``ReplicaPinningMiddleware``. A context
+# variable keeps the state correct for both threaded and async workers.
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY_DB]
+
+
+def enable_replica_reads():
+    return _use_replica.set(True)
+
+
+def pin_to_primary():
+    """
+    Send the remaining reads of the current request to the primary.
+    """
+    _use_replica.set(False)
+
+
+def reset_routing(token):
+    _use_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Routes eligible reads to a random replica and all writes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get():
+            return PRIMARY_DB
+        replicas = replica_aliases()
+        if not replicas:
+            return PRIMARY_DB
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # A write in the middle of a request must be visible to the reads
+        # that follow it.
+        pin_to_primary()
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set(settings.DATABASES)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
@@ -0,0 +1,122 @@
+"""
+OpenAPI schema, generated ahead of time.
+
+``python manage.py generate_schema`` writes the schema to API_SCHEMA_DIR as
+``schema.json`` and ``schema.yaml`` at build/deploy time. The views below
+serve those files as they are, with a long ``Cache-Control`` and an ETag.
+The Swagger UI and ReDoc pages are just drf_yasg's templates, which load
+them through ``SPEC_URL``: rendering a page never generates the schema.
+
+drf_yasg is only imported when a schema actually has to be generated or a
+documentation page is rendered, never at startup. Without a pre-generated
+file the schema is generated once per process on first request.
+"""
+
+import hashlib
+import logging
+import os
+from functools import cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+}
+
+
+def schema_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="MyTube API",
+        default_version='v1',
+        description="API documentation for MyTube video sharing platform",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@mytube.local"),
+        license=openapi.License(name="MIT License"),
+    )
+
+
+def generate_schema(url=''):
+    """
+    The public schema, encoded in each of SCHEMA_FORMATS, as seen by an
+    anonymous client. ``url`` sets the API host; without one the
+    documentation pages use the host they are served from.
+    """
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.views import APIView
+
+    # Views look at the request (user, query parameters) while they are
+    # being introspected
+    request = APIView().initialize_request(APIRequestFactory().get('/api/docs/.json'))
+    schema = OpenAPISchemaGenerator(schema_info(), url=url).get_schema(request=request, public=True)
+    return {
+        '.json': OpenAPICodecJson(validators=[]).encode(schema),
+        '.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+@cache
+def load_schema(format):
+    """
+    ``(content, etag)`` of the schema in ``format``, read once per process.
+    """
+    path = os.path.join(settings.API_SCHEMA_DIR, f'schema{format}')
+    try:
+        with open(path, 'rb') as schema_file:
+            content = schema_file.read()
+    except FileNotFoundError:
+        logger.warning('%s is missing, run "manage.py generate_schema" when deploying', path)
+        content = _generated_schema()[format]
+    return content, '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+
+
+@cache
+def _generated_schema():
+    return generate_schema()
+
+
+@require_safe
+def schema_file(request, format):
+    content, etag = load_schema(format)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type=SCHEMA_FORMATS[format])
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.API_SCHEMA_CACHE_SECONDS)
+    return response
+
+
+def _ui_page(request, renderer_class):
+    """
+    A documentation page: only the template of ``renderer_class`` with its
+    settings, pointing the browser at SPEC_URL. No view is introspected.
+    """
+    renderer = renderer_class()
+    context = {'request': request}
+    renderer.set_context(context)
+    context['title'] = schema_info().title
+    return HttpResponse(render_to_string(renderer.template, context, request))
+
+
+@require_safe
+def swagger_ui(request):
+    from drf_yasg.renderers import SwaggerUIRenderer
+
+    return _ui_page(request, SwaggerUIRenderer)
+
+
+@require_safe
+def redoc_ui(request):
+    from drf_yasg.renderers import ReDocRenderer
+
+    return _ui_page(request, ReDocRenderer)
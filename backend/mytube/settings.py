@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import dj_database_url
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -53,9 +58,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mytube.middleware.MetricsMiddleware',
+    'mytube.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'mytube.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'mytube.middleware.AdmissionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -86,13 +95,76 @@ WSGI_APPLICATION = 'mytube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_URL selects the primary database (SQLite by default). Connections
+# are kept open for DB_CONN_MAX_AGE seconds instead of one per request.
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': dj_database_url.config(
+        default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    ),
 }
 
+# Read replicas, as a comma separated list of database URLs. They are exposed
+# as the aliases replica1, replica2, ... and mirror the primary under tests.
+for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica{index}'] = dj_database_url.parse(
+        url,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+    DATABASES[f'replica{index}']['TEST'] = {'MIRROR': 'default'}
+
+# Behind a transaction-pooling PgBouncer server side cursors must be disabled
+if config('DB_PGBOUNCER', default=False, cast=bool):
+    for database in DATABASES.values():
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Opt-in tuning for small deployments serving production traffic from SQLite:
+# WAL lets readers run alongside the writer, BEGIN IMMEDIATE takes the write
+# lock up front instead of failing on lock upgrade, and busy_timeout waits
+# for the lock rather than raising "database is locked".
+SQLITE_PRODUCTION_MODE = config('SQLITE_PRODUCTION_MODE', default=False, cast=bool)
+
+if SQLITE_PRODUCTION_MODE and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA busy_timeout=5000;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA cache_size=-65536;'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 5,
+    }
+
+# Send writes from hot endpoints (views, likes) through a single writer
+# thread per process, see videos/writer.py
+SERIALIZED_WRITES = config('SERIALIZED_WRITES', default=SQLITE_PRODUCTION_MODE, cast=bool)
+
+# Serve the hot read endpoints from async views, see api/async_views.py.
+# mytube/asgi.py turns this on; under WSGI the regular viewsets are used.
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
+DATABASE_ROUTERS = ['mytube.routers.PrimaryReplicaRouter']
+
+# Safe-method requests under these prefixes may read from a replica
+DATABASE_REPLICA_PATHS = [
+    '/api/videos/',
+    '/api/categories/',
+    '/api/search/',
+    '/api/comments/',
+]
+
+# After a write the client reads from the primary for this many seconds, see
+# ReplicaPinningMiddleware in mytube/middleware.py
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=15, cast=int)
+DATABASE_REPLICA_PIN_COOKIE = 'primary_pin'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,6 +214,187 @@ AUTH_USER_MODEL = 'accounts.User'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Video files and thumbnails are stored once per distinct content, see
+# videos/storage.py. Any Storage class using ContentAddressedMixin works.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'media': {
+        'BACKEND': config('MEDIA_STORAGE_BACKEND', default='videos.storage.ContentAddressedStorage'),
+    },
+}
+
+# Video files, thumbnails and storyboards are only reachable through URLs
+# signed for MEDIA_URL_LIFETIME to 2 x MEDIA_URL_LIFETIME seconds, see
+# videos/signing.py. In production point MEDIA_ACCEL_REDIRECT at an internal
+# nginx location aliasing MEDIA_ROOT (e.g. "/protected-media/") so the files
+# are sent by nginx once Django checked the signature, and do not serve
+# videos/, thumbnails/, storyboards/ and captions/ under MEDIA_URL directly.
+MEDIA_SIGNED_URLS = config('MEDIA_SIGNED_URLS', default=True, cast=bool)
+MEDIA_URL_LIFETIME = config('MEDIA_URL_LIFETIME', default=3600, cast=int)
+MEDIA_ACCEL_REDIRECT = config('MEDIA_ACCEL_REDIRECT', default='')
+
+# Channel layer of the WebSocket consumers (mytube/asgi.py). The in-memory
+# layer works for a single process; several processes or nodes need a
+# shared one, e.g. CHANNEL_LAYER_BACKEND=channels_redis.core.RedisChannelLayer
+# with CHANNEL_LAYER_HOSTS=redis://localhost:6379/0 (pip install channels-redis).
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='channels.layers.InMemoryChannelLayer')
+CHANNEL_LAYERS = {'default': {'BACKEND': CHANNEL_LAYER_BACKEND}}
+if config('CHANNEL_LAYER_HOSTS', default=''):
+    CHANNEL_LAYERS['default']['CONFIG'] = {'hosts': config('CHANNEL_LAYER_HOSTS', cast=Csv())}
+
+# Live viewer counts, see videos/presence.py. Players send a heartbeat every
+# PRESENCE_HEARTBEAT seconds and are dropped after PRESENCE_TTL without one.
+PRESENCE_HEARTBEAT = config('PRESENCE_HEARTBEAT', default=15, cast=int)
+PRESENCE_TTL = config('PRESENCE_TTL', default=45, cast=int)
+PRESENCE_BROADCAST_INTERVAL = config('PRESENCE_BROADCAST_INTERVAL', default=2, cast=float)
+
+# Rows fetched per query by the channel exports, see api/exports.py
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Rows deleted per transaction by "manage.py process_deletions", see api/deletion.py
+DELETION_BATCH_SIZE = config('DELETION_BATCH_SIZE', default=500, cast=int)
+# A running deletion job not updated for this long is taken over by another
+# worker: its worker died
+DELETION_STALE_SECONDS = config('DELETION_STALE_SECONDS', default=600, cast=int)
+
+# Home feed recommendations built by "manage.py build_recommendations", see
+# videos/recommender.py
+RECOMMENDER_TOP_K = config('RECOMMENDER_TOP_K', default=20, cast=int)
+RECOMMENDER_TRENDING_DAYS = config('RECOMMENDER_TRENDING_DAYS', default=7, cast=int)
+RECOMMENDER_TRENDING_SIZE = config('RECOMMENDER_TRENDING_SIZE', default=200, cast=int)
+
+# Search suggestions, see videos/suggestions.py. The snapshot is written by
+# "manage.py build_suggestions".
+SUGGEST_MAX_TERMS = config('SUGGEST_MAX_TERMS', default=200000, cast=int)
+SUGGEST_REFRESH_SECONDS = config('SUGGEST_REFRESH_SECONDS', default=600, cast=int)
+SUGGEST_SNAPSHOT_PATH = config('SUGGEST_SNAPSHOT_PATH', default=str(BASE_DIR / 'suggestions.npz'))
+
+# Seek preview sprite sheets built by "manage.py build_storyboards", see
+# videos/storyboard.py
+STORYBOARD_INTERVAL = config('STORYBOARD_INTERVAL', default=10, cast=int)  # Seconds
+STORYBOARD_MAX_FRAMES = config('STORYBOARD_MAX_FRAMES', default=200, cast=int)
+STORYBOARD_TILE_WIDTH = config('STORYBOARD_TILE_WIDTH', default=160, cast=int)
+STORYBOARD_COLUMNS = 10
+STORYBOARD_ROWS = 10
+STORYBOARD_QUALITY = 70
+STORYBOARD_TIMEOUT = 600  # Seconds ffmpeg may take per video
+
+# Near-duplicate detection by "manage.py fingerprint_videos", see
+# videos/fingerprint.py
+FINGERPRINT_FRAMES = config('FINGERPRINT_FRAMES', default=8, cast=int)
+FINGERPRINT_MAX_DISTANCE = config('FINGERPRINT_MAX_DISTANCE', default=10, cast=int)  # Bits of 64
+FINGERPRINT_MATCH_RATIO = config('FINGERPRINT_MATCH_RATIO', default=0.5, cast=float)
+FINGERPRINT_MIN_MATCHES = config('FINGERPRINT_MIN_MATCHES', default=2, cast=int)
+FINGERPRINT_MIN_CONTRAST = 4  # Standard deviation of the 9x8 grayscale frame
+FINGERPRINT_TIMEOUT = 60  # Seconds ffmpeg may take per frame
+
+# Change lists of large tables, see api/admin.py: rows counted exactly at
+# most, and rows per batch of bulk actions
+ADMIN_COUNT_LIMIT = config('ADMIN_COUNT_LIMIT', default=10000, cast=int)
+ADMIN_ACTION_BATCH_SIZE = config('ADMIN_ACTION_BATCH_SIZE', default=1000, cast=int)
+
+# Playlists, see videos/playlists.py. Playlists with rank keys longer than
+# PLAYLIST_RANK_REBALANCE_LENGTH are rebalanced by "manage.py rebalance_playlists".
+PLAYLIST_MAX_ITEMS = config('PLAYLIST_MAX_ITEMS', default=5000, cast=int)
+PLAYLIST_APPEND_LIMIT = 500  # Videos per bulk append request
+PLAYLIST_RANK_REBALANCE_LENGTH = config('PLAYLIST_RANK_REBALANCE_LENGTH', default=16, cast=int)
+
+# Captions and transcript search, see videos/captions.py. The index is loaded
+# from the snapshot written by "manage.py build_caption_index" when it is
+# less than CAPTION_INDEX_REFRESH_SECONDS old.
+CAPTION_MAX_SIZE = config('CAPTION_MAX_SIZE', default=20 * 1024 * 1024, cast=int)  # Bytes per upload
+CAPTION_INDEX_PATH = config('CAPTION_INDEX_PATH', default=str(BASE_DIR / 'caption_index.pickle'))
+CAPTION_INDEX_REFRESH_SECONDS = config('CAPTION_INDEX_REFRESH_SECONDS', default=600, cast=int)
+CAPTION_HITS_PER_VIDEO = 3  # Matching cues returned per video
+CAPTION_SEARCH_MAX_VIDEOS = 1000  # Videos ranked per query
+CAPTION_SEARCH_MAX_CUES = 100000  # Matching cues ranked per query
+
+# Sizes, mtimes and hashes of verified files kept by "manage.py scan_media",
+# see videos/integrity.py
+MEDIA_MANIFEST_PATH = config('MEDIA_MANIFEST_PATH', default=str(BASE_DIR / 'media_manifest.jsonl'))
+# "manage.py scan_media --delete-orphans" leaves blobs younger than this
+# alone: their upload may not have committed yet
+MEDIA_ORPHAN_GRACE_SECONDS = config('MEDIA_ORPHAN_GRACE_SECONDS', default=86400, cast=int)
+
+# Prometheus metrics at /metrics, see mytube/metrics.py. Scrapers send
+# "Authorization: Bearer <METRICS_TOKEN>"; without a token only loopback and
+# private addresses not behind a proxy may read the metrics. With several
+# worker processes PROMETHEUS_MULTIPROC_DIR must name an empty directory
+# shared by all of them; prometheus_client reads it from the environment.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+PROMETHEUS_MULTIPROC_DIR = config('PROMETHEUS_MULTIPROC_DIR', default='')
+if PROMETHEUS_MULTIPROC_DIR:
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', PROMETHEUS_MULTIPROC_DIR)
+
+# Admission control, see mytube/admission.py. Per process: requests served
+# at once, how many of those only writes and signed-in users get, the latency
+# of normal and low priority requests and the wait in the front server
+# (X-Request-Start, read only when the front server always sets it) above
+# which low priority ones are shed, and how long a stale copy of a low
+# priority list may be served instead of a 503. Off unless enabled.
+ADMISSION_CONTROL = config('ADMISSION_CONTROL', default=False, cast=bool)
+ADMISSION_MAX_IN_FLIGHT = config('ADMISSION_MAX_IN_FLIGHT', default=64, cast=int)
+ADMISSION_RESERVED = config('ADMISSION_RESERVED', default=16, cast=int)
+ADMISSION_LATENCY_TARGET = config('ADMISSION_LATENCY_TARGET', default=0.5, cast=float)  # Seconds
+ADMISSION_QUEUE_TARGET = config('ADMISSION_QUEUE_TARGET', default=0.1, cast=float)  # Seconds
+ADMISSION_TRUST_REQUEST_START = config('ADMISSION_TRUST_REQUEST_START', default=False, cast=bool)
+ADMISSION_STALE_MAX_AGE = config('ADMISSION_STALE_MAX_AGE', default=600, cast=int)  # Seconds
+ADMISSION_STALE_ENTRIES = 1000
+ADMISSION_ADJUST_INTERVAL = 1.0  # Seconds between changes of the low priority limit
+ADMISSION_RETRY_AFTER = 5  # Seconds
+
+# Low priority whoever asks, and only without credentials
+ADMISSION_LOW_PRIORITY_PATHS = [
+    r'^/api/videos/[^/]+/view/$',
+    r'^/api/like/$',
+    r'^/api/videos/featured/$',
+    r'^/api/videos/[^/]+/related/$',
+    r'^/api/search/suggest/$',
+]
+ADMISSION_ANONYMOUS_LOW_PRIORITY_PATHS = [
+    r'^/api/videos/$',
+    r'^/api/videos/feed/$',
+    r'^/api/categories/[^/]+/videos/$',
+    r'^/api/search/$',
+    r'^/api/search/captions/$',
+]
+# Low priority lists that are the same for everybody, signed in or not
+ADMISSION_SHARED_PATHS = [
+    r'^/api/videos/featured/$',
+    r'^/api/videos/[^/]+/related/$',
+]
+
+# Request profiling, see mytube/profiling.py. A PROFILING_SAMPLE_RATE
+# fraction of requests (0 = only on demand, with a token from "manage.py
+# profiling_token") is profiled by PROFILING_MODE, "sample" (collapsed
+# stacks every PROFILING_INTERVAL seconds) or "cprofile" (pstats), into the
+# latest PROFILING_MAX_FILES files of PROFILING_DIR. "manage.py
+# merge_profiles" summarizes them.
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_MODE = config('PROFILING_MODE', default='sample')
+PROFILING_INTERVAL = config('PROFILING_INTERVAL', default=0.005, cast=float)
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_FILES = config('PROFILING_MAX_FILES', default=500, cast=int)
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=86400, cast=int)
+
+# OpenAPI schema pre-generated by "manage.py generate_schema", see mytube/schema.py
+API_SCHEMA_DIR = config('API_SCHEMA_DIR', default=str(BASE_DIR / 'schema'))
+API_SCHEMA_CACHE_SECONDS = config('API_SCHEMA_CACHE_SECONDS', default=3600, cast=int)
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
+# Hash uploads as they stream in, so deduplication needs no second pass
+FILE_UPLOAD_HANDLERS = [
+    'videos.storage.HashingMemoryFileUploadHandler',
+    'videos.storage.HashingTemporaryFileUploadHandler',
+]
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -150,6 +403,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': (
@@ -164,6 +421,8 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
         'user': '1000/day',
+        # Search suggestions are requested on every keystroke
+        'suggestions': '600/minute',
     },
 }
 
@@ -200,6 +459,11 @@ CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
     'http://127.0.0.1:3000',
 ]
+# The SPA reads the replica pin from responses and sends it back, see
+# ReplicaPinningMiddleware in mytube/middleware.py, and when to retry shed
+# requests (AdmissionMiddleware)
+CORS_EXPOSE_HEADERS = ['X-Primary-Pin', 'Retry-After', 'X-Load-Shed']
+CORS_ALLOW_HEADERS = (*default_headers, 'x-primary-pin')
 
 # Email settings (for password reset and account verification)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development
@@ -0,0 +1,307 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import profiling, schema
+from .admission import AdmissionController, Ticket, queue_time
+from .metrics import REQUESTS
+from .middleware import PIN_HEADER, ReplicaPinningMiddleware
+from .routers import PRIMARY_DB, PrimaryReplicaRouter
+
+
+@mock.patch('mytube.routers.replica_aliases', return_value=['replica1'])
+@mock.patch('mytube.middleware.replica_aliases', return_value=['replica1'])
+class ReplicaPinningTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+
+    def serve(self, request, status=200, write=False):
+        used = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(None)
+            used.append(self.router.db_for_read(None))
+            return HttpResponse(status=status)
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return used[0], response
+
+    def test_reads_under_replica_paths_use_a_replica(self, *mocks):
+        self.assertEqual(self.serve(self.factory.get('/api/videos/'))[0], 'replica1')
+        self.assertEqual(self.serve(self.factory.get('/api/notifications/'))[0], PRIMARY_DB)
+        # Outside a request
+        self.assertEqual(self.router.db_for_read(None), PRIMARY_DB)
+
+    def test_pinned_clients_read_from_the_primary(self, *mocks):
+        cookie = self.factory.get('/api/videos/')
+        cookie.COOKIES[settings.DATABASE_REPLICA_PIN_COOKIE] = '1'
+        self.assertEqual(self.serve(cookie)[0], PRIMARY_DB)
+        header = self.factory.get('/api/videos/', HTTP_X_PRIMARY_PIN='1')
+        self.assertEqual(self.serve(header)[0], PRIMARY_DB)
+
+    def test_writes_in_a_request_pin_its_reads(self, *mocks):
+        self.assertEqual(self.serve(self.factory.get('/api/videos/'), write=True)[0], PRIMARY_DB)
+
+    def test_successful_writes_pin_the_client(self, *mocks):
+        _, response = self.serve(self.factory.post('/api/videos/'), status=201)
+        self.assertEqual(response[PIN_HEADER], str(settings.DATABASE_REPLICA_PIN_SECONDS))
+        self.assertIn(settings.DATABASE_REPLICA_PIN_COOKIE, response.cookies)
+        _, response = self.serve(self.factory.post('/api/videos/'), status=400)
+        self.assertFalse(response.has_header(PIN_HEADER))
+        self.assertNotIn(settings.DATABASE_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_async_requests(self, *mocks):
+        used = []
+
+        async def view(request):
+            used.append(self.router.db_for_read(None))
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        async_to_sync(middleware)(self.factory.get('/api/videos/'))
+        async_to_sync(middleware)(self.factory.get('/api/videos/', HTTP_X_PRIMARY_PIN='1'))
+        self.assertEqual(used, ['replica1', PRIMARY_DB])
+
+
+class SchemaTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.enterContext(override_settings(API_SCHEMA_DIR=self.directory))
+        schema.load_schema.cache_clear()
+        self.addCleanup(schema.load_schema.cache_clear)
+
+    def test_generate_and_serve(self):
+        call_command('generate_schema', stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['schema.json', 'schema.yaml'])
+        response = self.client.get('/api/docs/.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('/videos/', json.loads(response.content)['paths'])
+        self.assertIn('public', response['Cache-Control'])
+        again = self.client.get('/api/docs/.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_files_are_served_as_they_are(self):
+        with open(os.path.join(self.directory, 'schema.yaml'), 'wb') as schema_file:
+            schema_file.write(b'openapi: stub\n')
+        with mock.patch.object(schema, 'generate_schema', side_effect=AssertionError('generated')):
+            response = self.client.get('/api/docs/.yaml')
+        self.assertEqual(response.content, b'openapi: stub\n')
+        self.assertEqual(self.client.post('/api/docs/.yaml').status_code, 405)
+
+    def test_pages_do_not_generate_the_schema(self):
+        with mock.patch.object(schema, 'generate_schema', side_effect=AssertionError('generated')):
+            for path in ('/api/docs/', '/api/redoc/'):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'MyTube API')
+
+
+@override_settings(METRICS_TOKEN='', PROMETHEUS_MULTIPROC_DIR='')
+class MetricsTests(TestCase):
+
+    def test_requests_are_recorded(self):
+        requests = REQUESTS.labels('video-list', 'GET', '200')
+        before = requests._value.get()
+        self.client.get('/api/videos/')
+        self.assertEqual(requests._value.get(), before + 1)
+        response = self.client.get('/metrics')
+        self.assertContains(response, 'mytube_http_requests_total{method="GET",route="video-list",status="200"}')
+        self.assertContains(response, 'mytube_db_queries_per_request_bucket')
+
+    def test_without_a_token_only_internal_scrapers(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.7').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='8.8.8.8').status_code, 403)
+        # Forwarded by a proxy on the same host
+        self.assertEqual(self.client.get('/metrics', HTTP_X_FORWARDED_FOR='8.8.8.8').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', REMOTE_ADDR='8.8.8.8', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 405)
+
+
+class ProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user(email='staff@example.com', username='staff', password='x', is_staff=True)
+        cls.user = User.objects.create_user(email='user@example.com', username='user', password='x')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.enterContext(override_settings(PROFILING_DIR=self.directory, PROFILING_SAMPLE_RATE=0.0))
+
+    def test_tokens(self):
+        self.assertTrue(profiling.token_is_valid(profiling.make_token(self.staff)))
+        self.assertFalse(profiling.token_is_valid(profiling.make_token(self.user)))
+        self.assertFalse(profiling.token_is_valid('staff:forged'))
+
+    def test_on_demand_profiles(self):
+        token = profiling.make_token(self.staff)
+        for mode in ('cprofile', 'sample'):
+            # The middleware reads the mode when it is created
+            with override_settings(PROFILING_MODE=mode):
+                response = Client().get('/api/categories/', HTTP_X_PROFILE=token)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(os.path.exists(os.path.join(self.directory, response['X-Profile-File'])))
+        profiles = profiling.list_profiles(self.directory)
+        self.assertEqual([profile.mode for profile in profiles], ['cprofile', 'sample'])
+        self.assertEqual({profile.tag for profile in profiles}, {'category-list.list'})
+        self.assertFalse(self.client.get('/api/categories/').has_header('X-Profile-File'))
+        response = self.client.get('/api/categories/', HTTP_X_PROFILE=profiling.make_token(self.user))
+        self.assertFalse(response.has_header('X-Profile-File'))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_MAX_FILES=2, PROFILING_MODE='cprofile')
+    def test_only_the_latest_files_are_kept(self):
+        for _ in range(3):
+            self.client.get('/api/categories/')
+        self.assertEqual(len(profiling.list_profiles(self.directory)), 2)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_failing_to_write_keeps_the_response(self):
+        with override_settings(PROFILING_DIR=os.path.join(self.directory, 'file')):
+            open(settings.PROFILING_DIR, 'w').close()
+            with self.assertLogs('mytube.middleware', 'ERROR'):
+                self.assertEqual(self.client.get('/api/categories/').status_code, 200)
+
+    def test_merge_and_summarize(self):
+        for name, lines in (
+            ('1760000000000000000_7_video-list.list_5ms.collapsed', ['main;view;query 3', 'main;view 1']),
+            ('1760000060000000000_7_video-detail.retrieve_9ms.collapsed', ['main;view;render 2']),
+        ):
+            with open(os.path.join(self.directory, name), 'w') as collapsed:
+                collapsed.write('\n'.join(lines) + '\n')
+        profiles = profiling.list_profiles(self.directory)
+        self.assertEqual([profile.tag for profile in profiles], ['video-list.list', 'video-detail.retrieve'])
+        self.assertEqual([profile.elapsed_ms for profile in profiles], [5, 9])
+        self.assertEqual(profiling.list_profiles(self.directory, tag='detail'), profiles[1:])
+        self.assertEqual(profiling.list_profiles(self.directory, since=1760000030), profiles[1:])
+        stacks = profiling.merge_collapsed(profiles)
+        self.assertEqual(stacks['video-list.list;main;view;query'], 3)
+        own, total = profiling.hot_functions(stacks)
+        self.assertEqual((own['view'], total['view']), (1, 6))
+        self.assertEqual((own['query'], own['render']), (3, 2))
+
+
+@override_settings(
+    ADMISSION_MAX_IN_FLIGHT=4,
+    ADMISSION_RESERVED=1,
+    ADMISSION_LATENCY_TARGET=0.5,
+    ADMISSION_QUEUE_TARGET=0.1,
+    ADMISSION_ADJUST_INTERVAL=0,
+    ADMISSION_STALE_MAX_AGE=600,
+    ADMISSION_TRUST_REQUEST_START=False,
+    ADMISSION_LOW_PRIORITY_PATHS=[r'^/api/like/$', r'^/api/videos/featured/$'],
+    ADMISSION_ANONYMOUS_LOW_PRIORITY_PATHS=[r'^/api/videos/$'],
+    ADMISSION_SHARED_PATHS=[r'^/api/videos/featured/$'],
+)
+class AdmissionControllerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.controller = AdmissionController()
+
+    def signed_in(self, path, method='get'):
+        return getattr(self.factory, method)(path, HTTP_AUTHORIZATION='Bearer token')
+
+    def test_classify(self):
+        classify = self.controller.classify
+        self.assertEqual(classify(self.factory.get('/api/videos/?page=2')), ('low', '/api/videos/?page=2'))
+        self.assertEqual(classify(self.signed_in('/api/videos/')), ('high', None))
+        self.assertEqual(classify(self.signed_in('/api/videos/featured/')), ('low', '/api/videos/featured/'))
+        self.assertEqual(classify(self.signed_in('/api/like/', 'post')), ('low', None))
+        self.assertEqual(classify(self.factory.post('/api/comments/')), ('high', None))
+        self.assertEqual(classify(self.factory.get('/api/categories/')), ('normal', None))
+
+    def test_reserved_slots_are_for_high_priority(self):
+        tickets = [self.controller.admit(self.factory.get('/api/categories/')) for _ in range(4)]
+        self.assertEqual([ticket.admitted for ticket in tickets], [True, True, True, False])
+        self.assertTrue(self.controller.admit(self.signed_in('/api/videos/')).admitted)
+        self.assertFalse(self.controller.admit(self.signed_in('/api/videos/')).admitted)
+        for ticket in tickets[:3]:
+            self.controller.release(ticket)
+        self.assertTrue(self.controller.admit(self.factory.get('/api/categories/')).admitted)
+
+    def test_low_limit_halves_under_load(self):
+        self.controller.latency['low'].add(2.0, time.monotonic())
+        self.controller.admit(self.factory.get('/api/videos/'))
+        self.assertTrue(self.controller.overloaded)
+        self.assertEqual(self.controller.low_limit, 1)
+
+    def test_stale_copy_served_when_shed(self):
+        request = self.factory.get('/api/videos/featured/')
+        ticket = self.controller.admit(request)
+        self.controller.keep(ticket, JsonResponse({'results': []}))
+        self.controller.release(ticket)
+        response = self.controller.shed(self.controller.admit(request))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Load-Shed'], 'stale')
+        self.assertEqual(response.content, b'{"results": []}')
+
+        response = self.controller.shed(self.controller.admit(self.factory.get('/api/videos/')))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['X-Load-Shed'], 'rejected')
+
+    def test_request_start_ignored_unless_trusted(self):
+        request = self.factory.get('/api/categories/', HTTP_X_REQUEST_START=f't={time.time() - 2:.3f}')
+        self.controller.admit(request)
+        self.assertEqual(self.controller.queue_time.get(time.monotonic()), 0.0)
+        self.assertFalse(self.controller.overloaded)
+
+    def test_request_start_samples_are_capped(self):
+        request = self.factory.get('/api/categories/', HTTP_X_REQUEST_START=f't={time.time() - 3:.3f}')
+        with self.settings(ADMISSION_TRUST_REQUEST_START=True):
+            self.controller.admit(request)
+        self.assertLessEqual(self.controller.queue_time.get(time.monotonic()), 0.4)
+        self.assertTrue(self.controller.overloaded)
+
+    def test_queue_time(self):
+        now = time.time()
+
+        def waited(header):
+            return queue_time(self.factory.get('/', HTTP_X_REQUEST_START=header), now)
+
+        self.assertAlmostEqual(waited(f't={now - 0.25:.3f}'), 0.25, places=2)
+        self.assertAlmostEqual(waited(f't={int((now - 0.25) * 1000)}'), 0.25, places=2)
+        self.assertAlmostEqual(waited(f't={int((now - 0.25) * 1e6)}'), 0.25, places=2)
+        self.assertEqual(waited(f't={now + 0.5:.3f}'), 0.0)
+        self.assertIsNone(waited('t=1'))
+        self.assertIsNone(waited(f't={now + 60:.3f}'))
+        self.assertIsNone(waited('soon'))
+
+
+@override_settings(ADMISSION_CONTROL=True)
+class AdmissionMiddlewareTests(SimpleTestCase):
+
+    def test_shed_responses_carry_cors_headers(self):
+        origin = settings.CORS_ALLOWED_ORIGINS[0]
+        busy = Ticket('normal', None, time.monotonic())
+        with mock.patch.object(AdmissionController, 'admit', return_value=busy):
+            response = Client().get('/api/categories/', HTTP_ORIGIN=origin)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(response['Access-Control-Allow-Origin'], (origin, '*'))
+        self.assertIn('Retry-After', response['Access-Control-Expose-Headers'])
@@ -2,23 +2,10 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-# Schema view for Swagger/OpenAPI
-schema_view = get_schema_view(
-    openapi.Info(
-        title="MyTube API",
-        default_version='v1',
-        description="API documentation for MyTube video sharing platform",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@mytube.local"),
-        license=openapi.License(name="MIT License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from videos.views import serve_media, serve_signed_media
+from . import schema
+from .metrics import metrics_view
 
 urlpatterns = [
     # Admin
@@ -27,12 +14,27 @@ urlpatterns = [
     # API
     path('api/', include('api.urls')),
     
-    # API Documentation
-    path('api/docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('api/redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-    re_path(r'^api/docs/(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+    # API Documentation, served from the schema built by "manage.py generate_schema"
+    path('api/docs/', schema.swagger_ui, name='schema-swagger-ui'),
+    path('api/redoc/', schema.redoc_ui, name='schema-redoc'),
+    re_path(r'^api/docs/(?P<format>\.json|\.yaml)$', schema.schema_file, name='schema-json'),
+    
+    # Prometheus metrics
+    path('metrics', metrics_view, name='metrics'),
 ]
 
+# Signed media URLs are checked by Django, which streams the file or hands
+# it to the web server (MEDIA_ACCEL_REDIRECT)
+if settings.MEDIA_SIGNED_URLS:
+    urlpatterns += [
+        re_path(
+            r'^%ssigned/(?P<expires>\d+)/(?P<signature>[0-9a-f]+)/(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'),
+            serve_signed_media,
+            {'document_root': settings.MEDIA_ROOT},
+            name='signed-media',
+        ),
+    ]
+
 # Serve media files during development
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
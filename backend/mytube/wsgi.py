@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mytube.settings')
 
 application = get_wsgi_application()
+
+# Imported once the apps are loaded
+from videos.suggestions import warm_index  # noqa: E402
+
+warm_index()
@@ -1,10 +1,14 @@
 from django.contrib import admin
+from api.admin import LargeTableAdminMixin
 from .models import Notification
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('recipient', 'sender', 'notification_type', 'is_read', 'created_at')
-    list_filter = ('notification_type', 'is_read', 'created_at')
-    search_fields = ('recipient__username', 'sender__username', 'text')
+    list_select_related = ('recipient', 'sender')
+    list_filter = ('notification_type', 'is_read')
+    indexed_search_fields = ('recipient__username', 'sender__username')
+    search_help_text = 'Exact recipient or sender username'
+    ordering = ('-id',)
+    raw_id_fields = ('recipient', 'sender', 'video', 'comment')
     readonly_fields = ('created_at',)
-    date_hierarchy = 'created_at'
@@ -1,6 +1,14 @@
 from django.db import models
 from django.conf import settings
 
+class NotificationManager(models.Manager):
+    def get_queryset(self):
+        # Hide notifications from users, or about videos, scheduled for deletion
+        return super().get_queryset().filter(
+            models.Q(video__isnull=True) | models.Q(video__deleted_at__isnull=True),
+            sender__deleted_at__isnull=True,
+        )
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = (
         ('like', 'Like'),
@@ -19,6 +27,8 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = NotificationManager()
+    
     def __str__(self):
         return f'{self.sender.username} {self.notification_type} notification to {self.recipient.username}'
     
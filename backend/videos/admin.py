@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Video, Category, Comment, Like, VideoView
+from django.db import transaction
+from api.admin import LargeTableAdminMixin, ScheduledDeletionAdminMixin, in_batches
+from .models import (
+    Video, Category, Comment, Like, VideoView, NearDuplicate, Playlist, Storyboard, Fingerprint, CaptionTrack,
+)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -9,31 +13,106 @@ class CategoryAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 @admin.register(Video)
-class VideoAdmin(admin.ModelAdmin):
+class VideoAdmin(LargeTableAdminMixin, ScheduledDeletionAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'uploader', 'category', 'privacy', 'views', 'created_at')
-    list_filter = ('privacy', 'category', 'created_at')
-    search_fields = ('title', 'description', 'tags', 'uploader__username')
+    list_select_related = ('uploader', 'category')
+    list_filter = ('privacy', 'category')
+    indexed_search_fields = ('id', 'slug', 'uploader__username', 'uploader__email')
+    search_help_text = 'Exact video id or slug, or uploader username or email'
+    ordering = ('-created_at', '-id')
     prepopulated_fields = {'slug': ('title',)}
+    raw_id_fields = ('uploader',)
     readonly_fields = ('views', 'created_at', 'updated_at')
-    date_hierarchy = 'created_at'
+    actions = ('recompute_counters', 'reprocess_media')
+    
+    @admin.action(description='Recompute like, dislike and comment counters')
+    def recompute_counters(self, request, queryset):
+        videos = batches = 0
+        for batch in in_batches(queryset):
+            with transaction.atomic():
+                videos += Video.objects.filter(pk__in=batch).refresh_counters()
+            batches += 1
+        self.message_user(request, f'Recomputed the counters of {videos} videos in {batches} batches.')
+    
+    @admin.action(description='Reprocess media: rebuild storyboards and fingerprints')
+    def reprocess_media(self, request, queryset):
+        videos = 0
+        for batch in in_batches(queryset):
+            with transaction.atomic():
+                # Rebuilt by "manage.py build_storyboards" and "manage.py fingerprint_videos"
+                Storyboard.objects.filter(video__in=batch).delete()
+                Fingerprint.objects.filter(video__in=batch).delete()
+                NearDuplicate.objects.filter(video__in=batch).delete()
+            videos += len(batch)
+        self.message_user(request, f'Queued {videos} videos for new storyboards and fingerprints.')
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'video', 'parent', 'text', 'created_at')
-    list_filter = ('created_at',)
-    search_fields = ('text', 'user__username', 'video__title')
+    list_select_related = ('user', 'video', 'parent__user', 'parent__video')
+    indexed_search_fields = ('video__slug', 'user__username')
+    search_help_text = 'Exact video slug or username'
+    ordering = ('-id',)
+    raw_id_fields = ('video', 'user', 'parent')
     readonly_fields = ('created_at', 'updated_at')
 
 @admin.register(Like)
-class LikeAdmin(admin.ModelAdmin):
+class LikeAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'video', 'like_type', 'created_at')
-    list_filter = ('like_type', 'created_at')
-    search_fields = ('user__username', 'video__title')
+    list_select_related = ('user', 'video')
+    list_filter = ('like_type',)
+    indexed_search_fields = ('video__slug', 'user__username')
+    search_help_text = 'Exact video slug or username'
+    ordering = ('-id',)
+    raw_id_fields = ('video', 'user')
     readonly_fields = ('created_at',)
 
 @admin.register(VideoView)
-class VideoViewAdmin(admin.ModelAdmin):
+class VideoViewAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('video', 'user', 'ip_address', 'viewed_at')
+    list_select_related = ('video', 'user')
     list_filter = ('viewed_at',)
-    search_fields = ('video__title', 'user__username', 'ip_address')
+    indexed_search_fields = ('video__slug', 'user__username')
+    search_help_text = 'Exact video slug or username'
+    ordering = ('-viewed_at', '-id')
+    raw_id_fields = ('video', 'user')
     readonly_fields = ('viewed_at',)
+
+@admin.register(Playlist)
+class PlaylistAdmin(admin.ModelAdmin):
+    list_display = ('title', 'owner', 'privacy', 'items_count', 'needs_rebalance', 'updated_at')
+    list_filter = ('privacy', 'needs_rebalance')
+    search_fields = ('title', 'owner__username')
+    raw_id_fields = ('owner',)
+    readonly_fields = ('items_count', 'needs_rebalance', 'created_at', 'updated_at')
+
+@admin.register(CaptionTrack)
+class CaptionTrackAdmin(admin.ModelAdmin):
+    list_display = ('video', 'language', 'label', 'cues_count', 'updated_at')
+    list_select_related = ('video',)
+    search_fields = ('video__slug', 'language')
+    raw_id_fields = ('video',)
+    readonly_fields = ('file', 'cues_count', 'created_at', 'updated_at')
+
+@admin.register(NearDuplicate)
+class NearDuplicateAdmin(admin.ModelAdmin):
+    """
+    Likely re-uploads found by "manage.py fingerprint_videos", newest first.
+    """
+    list_display = (
+        'video', 'video_uploader', 'original', 'original_uploader', 'matched', 'hashes', 'distance', 'created_at',
+    )
+    list_filter = ('created_at',)
+    list_select_related = ('video__uploader', 'original__uploader')
+    search_fields = ('video__title', 'video__slug', 'original__title', 'original__slug', 'video__uploader__username')
+    raw_id_fields = ('video', 'original')
+    readonly_fields = ('matched', 'hashes', 'distance', 'created_at')
+    date_hierarchy = 'created_at'
+    
+    @admin.display(description='Uploader', ordering='video__uploader__username')
+    def video_uploader(self, obj):
+        return obj.video.uploader
+    
+    @admin.display(description='Original uploader', ordering='original__uploader__username')
+    def original_uploader(self, obj):
+        return obj.original.uploader
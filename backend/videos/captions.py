@@ -0,0 +1,416 @@
+"""
+Captions, and search in what is said in videos.
+
+Caption tracks are uploaded as WebVTT or SRT (``import_track()``). The file
+is read line by line as it is parsed, the cues are inserted
+IMPORT_BATCH_SIZE at a time and written back out as WebVTT, which players
+read, so a large file is never held in memory whole.
+
+Transcript search uses an inverted index of the cues of public videos: for
+each term (words normalized like search suggestions), the numbers of the
+cues containing it, in ascending order, all in one array with the offsets
+where each term's cues start, and for each cue number the id of its row and
+its video. The cues of a track are numbered in time order. A query looks up
+the cues of each of its terms and intersects them, rarest first: by binary
+searches of the matches so far in a much longer list, so a rare term makes
+the whole query cheap, otherwise by marking the list's cues in a bitmap.
+Only the first CAPTION_SEARCH_MAX_CUES matching cues are ranked, so queries
+made of very common words stop early. Videos are ranked by the number of
+their cues containing every term. Only the cues shown, the first
+CAPTION_HITS_PER_VIDEO of each video on the page, are read from the
+database, for their text and timestamps.
+
+The index is built per process on first use, like the suggestion index
+(videos/suggestions.py): from the snapshot written by ``manage.py
+build_caption_index`` (CAPTION_INDEX_PATH) when there is a recent enough
+one, otherwise from the database, and again in the background every
+CAPTION_INDEX_REFRESH_SECONDS. Tracks uploaded in between are added to the
+index of the process receiving them. Videos that were deleted or made
+private since are filtered out at query time, and the cues of replaced
+tracks are dropped when their text is read.
+"""
+
+import html
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .models import CaptionCue, CaptionTrack, _release_file
+from .suggestions import normalize
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 2000
+MAX_CUE_LENGTH = 1000  # Characters of text kept per cue
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TERMS = 8
+INTERSECT_BLOCK = 65536  # Cues of the rarest term intersected at a time
+LANGUAGE = re.compile(r'^[A-Za-z]{2,3}(-[A-Za-z0-9]{1,8})*$')
+
+# "00:01:02.500 --> 00:01:04.000" (WebVTT, hours optional) or
+# "00:01:02,500 --> 00:01:04,000" (SRT)
+TIMING = re.compile(
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})\s*-->\s*(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{3})'
+)
+# Markup inside cue text: WebVTT tags and timestamps, SRT/ASS style overrides
+MARKUP = re.compile(r'<[^>]*>|\{\\[^}]*\}')
+
+
+def _milliseconds(match, group):
+    hours, minutes, seconds, milliseconds = match.group(group, group + 1, group + 2, group + 3)
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(milliseconds)
+
+
+def parse_cues(lines):
+    """
+    ``(start, end, text)`` of the cues in the WebVTT or SRT text ``lines``,
+    times in milliseconds. Headers, notes, styles and cue numbers are
+    skipped, markup is stripped and the lines of a cue are joined.
+    """
+    timing, text = None, []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if timing is not None and text:
+                yield (*timing, ' '.join(text)[:MAX_CUE_LENGTH])
+            timing, text = None, []
+        elif timing is None:
+            match = TIMING.search(line)
+            if match:
+                start, end = _milliseconds(match, 1), _milliseconds(match, 5)
+                timing = start, max(start, end)
+        else:
+            line = html.unescape(MARKUP.sub('', line)).strip()
+            if line:
+                text.append(line)
+    if timing is not None and text:
+        yield (*timing, ' '.join(text)[:MAX_CUE_LENGTH])
+
+
+def decoded_lines(file):
+    """
+    The lines of the binary ``file`` as text, read a chunk at a time.
+    Files not in UTF-8 are most likely in Latin-1 or Windows-1252.
+    """
+    first = True
+    for line in file:
+        if first:
+            line = line.removeprefix(b'\xef\xbb\xbf')
+            first = False
+        try:
+            yield line.decode()
+        except UnicodeDecodeError:
+            yield line.decode('cp1252', errors='replace')
+
+
+def _vtt_timestamp(milliseconds):
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
+
+
+def terms_of(text):
+    return [term for term in normalize(text).split() if len(term) <= MAX_TERM_LENGTH]
+
+
+def import_track(video, file, language, label=''):
+    """
+    Parse the WebVTT or SRT ``file`` into the ``language`` track of
+    ``video``, replacing the previous one. Raises ValueError when it has no
+    cues.
+    """
+    with transaction.atomic(), tempfile.TemporaryFile() as vtt:
+        track = CaptionTrack.objects.select_for_update().filter(video=video, language=language).first()
+        if track is None:
+            track = CaptionTrack.objects.create(video=video, language=language, label=label, file='')
+        else:
+            CaptionCue.objects.filter(track=track).delete()
+        previous = track.file.name
+
+        vtt.write(b'WEBVTT\n')
+        count = 0
+        batch = []
+        for start, end, text in parse_cues(decoded_lines(file)):
+            vtt.write(f'\n{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}\n{text}\n'.encode())
+            batch.append(CaptionCue(track=track, start=start, end=end, text=text))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                CaptionCue.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        CaptionCue.objects.bulk_create(batch)
+        count += len(batch)
+        if not count:
+            raise ValueError('No cues found, the file must be WebVTT or SRT')
+
+        vtt.seek(0)
+        track.file.save(f'{language}.vtt', File(vtt), save=False)
+        track.label = label
+        track.cues_count = count
+        track.save()
+        # Saving took a reference to the blob even when the content is the same
+        _release_file(track.file.storage, previous)
+        if video.privacy == 'public':
+            transaction.on_commit(lambda: _add_to_index(track))
+    return track
+
+
+def _add_to_index(track):
+    if _index is not None:
+        cues = CaptionCue.objects.filter(track=track).order_by('start', 'id').values_list('id', 'text')
+        _index.add(track.video_id, cues.iterator(chunk_size=10000))
+
+
+def _intersect(lists, limit):
+    """
+    The first ``limit`` cue numbers in all of the sorted ``lists``, the
+    shortest first. The shortest list is taken a block at a time, against
+    the range of cue numbers it spans in the others, so very common words
+    stop early.
+    """
+    rarest, others = lists[0], lists[1:]
+    found, total = [], 0
+    for begin in range(0, len(rarest), INTERSECT_BLOCK):
+        matched = rarest[begin:begin + INTERSECT_BLOCK]
+        low, high = matched[0], matched[-1]
+        for postings in others:
+            postings = postings[np.searchsorted(postings, low):np.searchsorted(postings, high, side='right')]
+            if not len(postings):
+                matched = matched[:0]
+                break
+            if len(matched) * 16 < len(postings):
+                positions = np.minimum(np.searchsorted(postings, matched), len(postings) - 1)
+                matched = matched[postings[positions] == matched]
+            else:
+                # Lists of similar length: cheaper to mark one and look the other up
+                present = np.zeros(high - low + 1, dtype=bool)
+                present[postings - low] = True
+                matched = matched[present[matched - low]]
+        found.append(matched)
+        total += len(matched)
+        if total >= limit:
+            break
+    return np.concatenate(found)[:limit] if found else rarest[:0]
+
+
+@dataclass
+class Match:
+    video: str  # Video id
+    cues: int  # Matching cues
+    hits: list  # Ids of the first few
+
+
+class CaptionIndex:
+    def __init__(self, videos=(), cue_ids=None, cue_videos=None, terms=(), bounds=None, postings=None, built_at=None):
+        self.built_at = built_at or time.time()
+        self.lock = threading.Lock()
+        self.videos = list(videos)  # Video number -> id
+        self.video_numbers = {video: number for number, video in enumerate(self.videos)}
+        self.cue_ids = cue_ids if cue_ids is not None else np.empty(0, dtype=np.int64)
+        self.cue_videos = cue_videos if cue_videos is not None else np.empty(0, dtype=np.int32)
+        self.terms = {term: number for number, term in enumerate(terms)}
+        # The cues of term t are postings[bounds[t]:bounds[t + 1]]
+        self.bounds = bounds if bounds is not None else np.zeros(1, dtype=np.int64)
+        self.postings = postings if postings is not None else np.empty(0, dtype=np.int32)
+        # Cues added since the build, numbered after the indexed ones
+        self.added_ids = []
+        self.added_videos = []
+        self.added_postings = defaultdict(list)
+        self._added = None
+
+    @classmethod
+    def build(cls, cues):
+        """
+        The index of ``cues``, ``(cue id, video id, text)`` in track and
+        time order.
+        """
+        videos = {}
+        terms = {}
+        cue_ids = array('q')
+        cue_videos = array('i')
+        term_numbers = array('i')
+        cue_numbers = array('i')
+        for cue_id, video_id, text in cues:
+            number = len(cue_ids)
+            cue_ids.append(cue_id)
+            cue_videos.append(videos.setdefault(str(video_id), len(videos)))
+            for term in set(terms_of(text)):
+                term_numbers.append(terms.setdefault(term, len(terms)))
+                cue_numbers.append(number)
+
+        term_numbers = np.frombuffer(term_numbers, dtype=np.int32)
+        order = np.argsort(term_numbers, kind='stable')
+        bounds = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_numbers, minlength=len(terms)), out=bounds[1:])
+        return cls(
+            videos, np.frombuffer(cue_ids, dtype=np.int64), np.frombuffer(cue_videos, dtype=np.int32),
+            terms, bounds, np.frombuffer(cue_numbers, dtype=np.int32)[order],
+        )
+
+    def __len__(self):
+        return len(self.cue_ids) + len(self.added_ids)
+
+    def add(self, video_id, cues):
+        """
+        Add the ``(cue id, text)`` of a track of ``video_id``.
+        """
+        with self.lock:
+            video = self.video_numbers.get(str(video_id))
+            if video is None:
+                video = self.video_numbers[str(video_id)] = len(self.videos)
+                self.videos.append(str(video_id))
+            for cue_id, text in cues:
+                number = len(self)
+                self.added_ids.append(cue_id)
+                self.added_videos.append(video)
+                for term in set(terms_of(text)):
+                    self.added_postings[term].append(number)
+            self._added = None
+
+    def _all_cues(self):
+        """
+        The cue ids and video numbers of the indexed and the added cues.
+        """
+        if not self.added_ids:
+            return self.cue_ids, self.cue_videos
+        if self._added is None:
+            self._added = (
+                np.concatenate([self.cue_ids, np.array(self.added_ids, dtype=np.int64)]),
+                np.concatenate([self.cue_videos, np.array(self.added_videos, dtype=np.int32)]),
+            )
+        return self._added
+
+    def _postings(self, term):
+        number = self.terms.get(term)
+        postings = self.postings[self.bounds[number]:self.bounds[number + 1]] if number is not None else self.postings[:0]
+        added = self.added_postings.get(term)
+        if added:
+            postings = np.concatenate([postings, np.array(added, dtype=np.int32)])
+        return postings
+
+    def search(self, query, max_videos=None):
+        """
+        The videos with cues containing every term of ``query``, most
+        matching cues first, at most ``max_videos``.
+        """
+        query_terms = list(dict.fromkeys(terms_of(query)))[:MAX_QUERY_TERMS]
+        if not query_terms:
+            return []
+        with self.lock:
+            lists = sorted((self._postings(term) for term in query_terms), key=len)
+            cue_ids, cue_videos = self._all_cues()
+        matched = _intersect(lists, settings.CAPTION_SEARCH_MAX_CUES)
+        if not len(matched):
+            return []
+
+        videos = cue_videos[matched]
+        order = np.argsort(videos, kind='stable')
+        numbers, starts, counts = np.unique(videos[order], return_index=True, return_counts=True)
+        ranked = np.lexsort((starts, -counts))[:max_videos or settings.CAPTION_SEARCH_MAX_VIDEOS]
+        hits = settings.CAPTION_HITS_PER_VIDEO
+        return [
+            Match(
+                self.videos[numbers[rank]], int(counts[rank]),
+                cue_ids[matched[order[starts[rank]:starts[rank] + min(hits, counts[rank])]]].tolist(),
+            )
+            for rank in ranked
+        ]
+
+
+def indexed_cues():
+    cues = CaptionCue.objects.filter(
+        track__video__privacy='public', track__video__deleted_at__isnull=True
+    ).order_by('track_id', 'start', 'id')
+    return cues.values_list('id', 'track__video_id', 'text').iterator(chunk_size=10000)
+
+
+def write_snapshot(path=None):
+    path = path or settings.CAPTION_INDEX_PATH
+    index = CaptionIndex.build(indexed_cues())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as snapshot:
+        pickle.dump({
+            'built_at': index.built_at,
+            'videos': index.videos,
+            'cue_ids': index.cue_ids,
+            'cue_videos': index.cue_videos,
+            'terms': list(index.terms),
+            'bounds': index.bounds,
+            'postings': index.postings,
+        }, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+    return len(index), len(index.terms)
+
+
+def _load():
+    path = settings.CAPTION_INDEX_PATH
+    try:
+        if time.time() - os.path.getmtime(path) < settings.CAPTION_INDEX_REFRESH_SECONDS:
+            with open(path, 'rb') as snapshot:
+                return CaptionIndex(**pickle.load(snapshot))
+    except FileNotFoundError:
+        pass
+    return CaptionIndex.build(indexed_cues())
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load()
+    elif time.time() - _index.built_at > settings.CAPTION_INDEX_REFRESH_SECONDS and not _refreshing.is_set():
+        _refreshing.set()
+        threading.Thread(target=_refresh, daemon=True).start()
+    return _index
+
+
+def _refresh():
+    global _index
+    try:
+        _index = _load()
+    except Exception:
+        logger.exception('Rebuilding the caption index failed')
+    finally:
+        _refreshing.clear()
+
+
+def search_captions(query, videos):
+    """
+    The matches of ``query`` among ``videos`` (a queryset), in rank order.
+    """
+    matches = get_index().search(query)
+    if not matches:
+        return []
+    visible = {str(pk) for pk in videos.filter(pk__in=[match.video for match in matches]).values_list('pk', flat=True)}
+    return [match for match in matches if match.video in visible]
+
+
+def caption_hits(matches):
+    """
+    ``{video id: [hit, ...]}`` of ``matches``, each hit the time and text
+    of a matching cue. Cues of tracks replaced since the index was built
+    are gone.
+    """
+    cue_ids = [cue_id for match in matches for cue_id in match.hits]
+    cues = CaptionCue.objects.filter(pk__in=cue_ids).values_list('pk', 'start', 'end', 'text', 'track__language')
+    cues = {pk: {'start': start / 1000, 'end': end / 1000, 'text': text, 'language': language}
+            for pk, start, end, text, language in cues}
+    return {match.video: [cues[cue_id] for cue_id in match.hits if cue_id in cues] for match in matches}
@@ -0,0 +1,32 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from .presence import get_hub
+
+
+class PresenceConsumer(AsyncJsonWebsocketConsumer):
+    """
+    A player's presence on a video page, see videos/presence.py.
+    """
+
+    # The hub talks to the channel layer; viewers need no channel of their own
+    channel_layer_alias = None
+
+    async def connect(self):
+        self.video = self.scope['url_route']['kwargs']['slug']
+        self.hub = await get_hub()
+        await self.accept()
+        await self.hub.join(self.video, self)
+        await self.send_json({
+            'type': 'watching',
+            'count': self.hub.total(self.video),
+            'heartbeat': settings.PRESENCE_HEARTBEAT,
+        })
+
+    async def receive_json(self, content, **kwargs):
+        if isinstance(content, dict) and content.get('type') == 'heartbeat':
+            self.hub.heartbeat(self.video, self)
+
+    async def disconnect(self, code):
+        if hasattr(self, 'hub'):
+            await self.hub.leave(self.video, self)
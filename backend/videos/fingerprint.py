@@ -0,0 +1,312 @@
+"""
+Near-duplicate detection: perceptual hashes of video frames.
+
+Re-uploads of the same content in another container, codec or resolution
+share no bytes with the original, so content digests (videos/storage.py)
+do not catch them. ``manage.py fingerprint_videos`` instead takes
+FINGERPRINT_FRAMES frames evenly spread over each video with ffmpeg, plus
+the thumbnail, and stores a 64-bit difference hash of each (``Fingerprint``):
+one bit per pair of neighbouring pixels of a 9x8 grayscale version, set
+where brightness increases. Scaling, re-encoding and small colour changes
+flip a few bits at most, while different images differ in about half.
+Nearly uniform frames (black, fades) say nothing about the content and are
+left out.
+
+A video is a near duplicate of an earlier one (``NearDuplicate``) when at
+least FINGERPRINT_MATCH_RATIO of its hashes, and FINGERPRINT_MIN_MATCHES,
+are within FINGERPRINT_MAX_DISTANCE bits of a hash of that video.
+
+The hashes of all videos are searched with multi-index hashing
+(``HashIndex``): each hash is split into ``m`` chunks, 4 of 16 bits in
+small indexes and 3 of 21 or 22 bits from about 300,000 hashes on, so that
+few hashes share a chunk value, with a table of the hashes sorted by each
+chunk and where each chunk value starts in it. Two hashes at most ``r``
+bits apart agree up to ``r // m`` bits on at least one chunk, so the
+candidates are the hashes whose chunk is one of the values that close to
+the query's (1794 for a 22-bit chunk and ``r`` = 10), read straight from
+the tables, and only those are compared in full. With tens of millions of
+hashes a lookup takes a few milliseconds, where a BK-tree would visit a
+large part of its nodes at this radius. The index takes about 30 bytes per
+hash and is built from the database when the command starts.
+"""
+
+import math
+import os
+import subprocess
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+from .importer import probe_duration
+from .models import Fingerprint, NearDuplicate, Video
+from .storyboard import local_copy
+
+HASH_BITS = 64
+MIN_CHUNKS = 3
+
+
+def dhash(image):
+    """
+    The 64-bit difference hash of ``image``, or None if it is too uniform.
+    """
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    if pixels.std() < settings.FINGERPRINT_MIN_CONTRAST:
+        return None
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def to_hex(value):
+    return f'{value:016x}'
+
+
+def sample_frames(path, duration, count, directory):
+    """
+    ``count`` frames evenly spread over the video at ``path``, as image
+    paths. Each is seeked to separately, so long videos are not decoded
+    in full.
+    """
+    positions = [duration * (index + 0.5) / count for index in range(count)] if duration else [0]
+    frames = []
+    for index, position in enumerate(positions):
+        frame = os.path.join(directory, f'frame{index:03d}.png')
+        subprocess.run(
+            ['ffmpeg', '-v', 'error', '-ss', f'{position:.3f}', '-i', path,
+             '-frames:v', '1', '-vf', 'scale=64:-2', frame],
+            check=True, capture_output=True, timeout=settings.FINGERPRINT_TIMEOUT,
+        )
+        # Nothing is written past the end of a video shorter than it claims
+        if os.path.exists(frame):
+            frames.append(frame)
+    return frames
+
+
+def video_hashes(video):
+    """
+    The hashes of the sampled frames and the thumbnail of ``video``.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = local_copy(video.file, directory)
+        duration = video.duration or probe_duration(path)
+        images = sample_frames(path, duration, settings.FINGERPRINT_FRAMES, directory)
+        hashes = []
+        for image_path in images:
+            with Image.open(image_path) as image:
+                hashes.append(dhash(image))
+    if video.thumbnail:
+        with video.thumbnail.open('rb') as file, Image.open(file) as image:
+            hashes.append(dhash(image))
+    # Identical frames (a still image, a slideshow) count once
+    return list(dict.fromkeys(value for value in hashes if value is not None))
+
+
+def chunk_widths(size):
+    """
+    The bit widths of the chunks of an index of ``size`` hashes: 4 chunks
+    of 16 bits up to about 300,000 hashes, then 3 of 21 or 22 bits. Never
+    fewer than 3, so that the per-chunk tables (``2 ** width`` entries) stay
+    within 22 bits whatever the size.
+    """
+    chunks = min(4, max(MIN_CHUNKS, round(HASH_BITS / math.log2(max(size, 2)))))
+    width, wider = divmod(HASH_BITS, chunks)
+    return [width + 1] * wider + [width] * (chunks - wider)
+
+
+def _chunk(hashes, shift, width):
+    return ((hashes >> np.uint64(shift)) & np.uint64(2 ** width - 1)).astype(np.uint32)
+
+
+@lru_cache
+def _flips(width, bits):
+    """
+    The ``width``-bit values with at most ``bits`` bits set.
+    """
+    values = np.arange(2 ** width, dtype=np.uint32)
+    return values[np.bitwise_count(values) <= bits]
+
+
+class HashIndex:
+    """
+    The hashes of every fingerprinted video, searchable by Hamming distance.
+
+    Hashes added after the tables were built are compared one by one until
+    there are more than 10000 of them and a 64th of the index, then the
+    tables are rebuilt. A video added again replaces its previous hashes.
+    """
+
+    def __init__(self):
+        self.videos = []  # owner -> video id
+        self.owners_by_video = {}  # video id -> current owner
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.owners = np.empty(0, dtype=np.int32)
+        self.tables = []
+        self.pending_hashes = []
+        self.pending_owners = []
+        self._pending = None
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        fingerprints = Fingerprint.objects.filter(video__deleted_at__isnull=True).exclude(hashes=[])
+        for video_id, hashes in fingerprints.values_list('video_id', 'hashes').iterator(chunk_size=10000):
+            index.add(video_id, [int(value, 16) for value in hashes], rebuild=False)
+        index.build()
+        return index
+
+    def __len__(self):
+        return len(self.hashes) + len(self.pending_hashes)
+
+    def add(self, video_id, hashes, rebuild=True):
+        owner = len(self.videos)
+        self.videos.append(video_id)
+        self.owners_by_video[video_id] = owner
+        self.pending_hashes += hashes
+        self.pending_owners += [owner] * len(hashes)
+        self._pending = None
+        if rebuild and len(self.pending_hashes) > max(len(self.hashes) // 64, 10000):
+            self.build()
+
+    def pending(self):
+        if self._pending is None:
+            self._pending = (
+                np.array(self.pending_hashes, dtype=np.uint64), np.array(self.pending_owners, dtype=np.int32),
+            )
+        return self._pending
+
+    def build(self):
+        live = np.zeros(len(self.videos), dtype=bool)
+        live[list(self.owners_by_video.values())] = True
+        pending_hashes, pending_owners = self.pending()
+        hashes = np.concatenate([self.hashes, pending_hashes])
+        owners = np.concatenate([self.owners, pending_owners])
+        keep = live[owners]
+        self.hashes, self.owners = hashes[keep], owners[keep]
+        self.pending_hashes, self.pending_owners, self._pending = [], [], None
+        self.tables = []
+        shift = 0
+        for width in chunk_widths(len(self.hashes)):
+            keys = _chunk(self.hashes, shift, width)
+            order = np.argsort(keys, kind='stable').astype(np.int32)
+            # Hashes with chunk value v are order[bounds[v]:bounds[v + 1]]
+            bounds = np.zeros(2 ** width + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=2 ** width), out=bounds[1:])
+            self.tables.append((shift, width, bounds, order))
+            shift += width
+
+    def _candidates(self, value, radius):
+        """
+        Positions of the indexed hashes agreeing with ``value`` up to
+        ``radius // m`` bits on one of the ``m`` chunks, some repeatedly.
+        """
+        query = np.array([value], dtype=np.uint64)
+        found = []
+        for shift, width, bounds, order in self.tables:
+            near = _chunk(query, shift, width)[0] ^ _flips(width, radius // len(self.tables))
+            starts, lengths = bounds[near], bounds[near + 1] - bounds[near]
+            total = lengths.sum()
+            if total:
+                # The ranges starts[i]:starts[i] + lengths[i], concatenated
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                found.append(order[offsets + np.arange(total)])
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int32)
+
+    def near(self, value, radius):
+        """
+        The owners of the hashes within ``radius`` bits of ``value``, and
+        their distances.
+        """
+        positions = self._candidates(value, radius)
+        pending_hashes, pending_owners = self.pending()
+        hashes = np.concatenate([self.hashes[positions], pending_hashes])
+        owners = np.concatenate([self.owners[positions], pending_owners])
+        distances = np.bitwise_count(hashes ^ np.uint64(value))
+        close = distances <= radius
+        return owners[close], distances[close]
+
+    def matches(self, hashes, exclude=None):
+        """
+        ``{video id: (matched hashes, mean distance)}`` of the videos
+        ``hashes`` make a near duplicate of.
+        """
+        radius = settings.FINGERPRINT_MAX_DISTANCE
+        best = {}  # owner -> {query hash: distance}
+        for value in hashes:
+            owners, distances = self.near(value, radius)
+            for owner, distance in zip(owners.tolist(), distances.tolist()):
+                closest = best.setdefault(owner, {})
+                closest[value] = min(distance, closest.get(value, distance))
+
+        needed = max(
+            min(settings.FINGERPRINT_MIN_MATCHES, len(hashes)),
+            math.ceil(len(hashes) * settings.FINGERPRINT_MATCH_RATIO),
+        )
+        found = {}
+        for owner, closest in best.items():
+            video_id = self.videos[owner]
+            # Hashes of videos added again since
+            if self.owners_by_video.get(video_id) != owner or video_id == exclude:
+                continue
+            if len(closest) >= needed:
+                found[video_id] = (len(closest), sum(closest.values()) / len(closest))
+        return found
+
+
+def fingerprint_video(video, index):
+    """
+    Hash ``video``, record the earlier videos it is a near duplicate of and
+    add it to ``index``.
+    """
+    hashes = video_hashes(video)
+    if not hashes:
+        raise ValueError('No frame with enough detail to hash')
+    matches = index.matches(hashes, exclude=video.pk)
+    originals = Video.objects.filter(pk__in=matches, created_at__lt=video.created_at).values_list('pk', flat=True)
+
+    with transaction.atomic():
+        Fingerprint.objects.update_or_create(video=video, defaults={'hashes': [to_hex(value) for value in hashes], 'error': ''})
+        NearDuplicate.objects.filter(video=video).delete()
+        NearDuplicate.objects.bulk_create([
+            NearDuplicate(
+                video=video, original_id=original, matched=matches[original][0], hashes=len(hashes),
+                distance=matches[original][1],
+            )
+            for original in originals
+        ])
+    index.add(video.pk, hashes)
+    return len(originals)
+
+
+def pending_videos(retry_failed=False):
+    videos = Video.objects.filter(fingerprint__isnull=True)
+    if retry_failed:
+        videos = videos | Video.objects.filter(fingerprint__hashes=[])
+    return videos.order_by('created_at')
+
+
+def fingerprint_pending(index, limit=None, retry_failed=False, log=None):
+    """
+    Fingerprint the videos that have no fingerprint yet, oldest first, so
+    the originals are indexed before their copies. Failures are recorded
+    on the fingerprint and skipped by later runs unless ``retry_failed``.
+    """
+    done = failed = duplicates = 0
+    for video in pending_videos(retry_failed)[:limit]:
+        try:
+            found = fingerprint_video(video, index)
+            done += 1
+        except (OSError, ValueError, subprocess.SubprocessError) as exc:
+            error = exc.stderr.decode(errors='replace') if getattr(exc, 'stderr', None) else str(exc)
+            Fingerprint.objects.update_or_create(video=video, defaults={'hashes': [], 'error': error or repr(exc)})
+            failed += 1
+            if log:
+                log(f'{video.slug}: {error}')
+            continue
+        if found:
+            duplicates += 1
+            if log:
+                log(f'{video.slug}: near duplicate of {found} earlier video(s)')
+    return done, failed, duplicates
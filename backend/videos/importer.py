@@ -0,0 +1,409 @@
+"""
+Bulk import of existing videos.
+
+``manage.py import_videos`` takes either a directory tree of video files, or
+a CSV/JSONL manifest with one video per row:
+
+    path,title,description,tags,category,privacy,uploader,thumbnail,duration,id
+
+Only ``path`` is required; relative paths are relative to the manifest. In
+a directory tree the metadata comes from an optional ``<name>.json`` next to
+each video, and ``<name>.jpg``/``.png`` is used as its thumbnail.
+
+A process pool does the per-file work: hashing, probing the duration and
+extracting a thumbnail with ffprobe/ffmpeg when they are installed, and
+writing the content-addressed blobs (videos/storage.py). The main process
+then creates the rows with ``bulk_create`` in batches, slugs included, one
+transaction per batch.
+
+Invalid rows, files that cannot be read and rows the database rejects are
+reported and skipped, the rest is imported. A batch that fails is retried
+one row at a time. Blobs stored for rows that end up not imported have no
+references; "manage.py scan_media --delete-orphans" removes them.
+
+Finished items are appended to a checkpoint file and skipped by later runs.
+Video ids are derived from the item's key (its ``id`` or absolute path), so
+a batch that was committed just before a crash is not imported twice.
+"""
+
+import csv
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field as dataclass_field
+from functools import partial
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from .models import Category, Video
+from .storage import ContentAddressedMixin, file_digest
+
+VIDEO_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.webm', '.mkv', '.avi'}
+THUMBNAIL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Namespace of the video ids of imported items
+IMPORT_NAMESPACE = uuid.UUID('8d3f9b52-6c1e-4f0a-9a7d-2b5e4c6f1a90')
+
+
+@dataclass
+class ImportItem:
+    key: str
+    path: str
+    title: str = ''
+    description: str = ''
+    tags: str = ''
+    category: str = ''
+    privacy: str = 'public'
+    uploader: str = ''
+    thumbnail: str = ''
+    duration: int = 0
+
+    @property
+    def video_id(self):
+        return uuid.uuid5(IMPORT_NAMESPACE, self.key)
+
+
+@dataclass
+class Probed:
+    item: ImportItem
+    sha256: str = ''
+    duration: int = 0
+    thumbnail: str = ''
+    thumbnail_sha256: str = ''
+    error: str = ''
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    skipped: int = 0
+    failed: list = dataclass_field(default_factory=list)
+
+
+def _item(row, base_dir):
+    """
+    The ImportItem of a manifest row, or ValueError if the row is invalid.
+    """
+    if not isinstance(row, dict) or not row.get('path'):
+        raise ValueError('Missing path')
+    path = os.path.abspath(os.path.join(base_dir, str(row['path'])))
+    thumbnail = row.get('thumbnail') or ''
+    try:
+        duration = int(row.get('duration') or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid duration "{row["duration"]}"') from None
+    if duration < 0:
+        raise ValueError(f'Invalid duration "{row["duration"]}"')
+    return ImportItem(
+        key=str(row.get('id') or path),
+        path=path,
+        title=str(row.get('title') or os.path.splitext(os.path.basename(path))[0].replace('_', ' ')),
+        description=str(row.get('description') or ''),
+        tags=str(row.get('tags') or ''),
+        category=str(row.get('category') or ''),
+        privacy=row.get('privacy') or 'public',
+        uploader=str(row.get('uploader') or ''),
+        thumbnail=os.path.abspath(os.path.join(base_dir, str(thumbnail))) if thumbnail else '',
+        duration=duration,
+    )
+
+
+def _rows(manifest, path):
+    """
+    ``(line number, row or None)`` of a manifest, None for lines that do
+    not parse.
+    """
+    if path.endswith('.csv'):
+        reader = csv.DictReader(manifest)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(manifest, start=1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+
+
+def items_from_manifest(path, failed=None):
+    """
+    The items of the manifest at ``path``. Invalid rows are skipped and
+    added to ``failed`` as ``(path:line, error)``.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, newline='', encoding='utf-8') as manifest:
+        for number, row in _rows(manifest, path):
+            try:
+                if row is None:
+                    raise ValueError('Invalid JSON')
+                items.append(_item(row, base_dir))
+            except ValueError as exc:
+                if failed is not None:
+                    failed.append((f'{path}:{number}', str(exc)))
+    return items
+
+
+def items_from_directory(root, failed=None):
+    """
+    The videos under ``root``. Videos with invalid metadata are skipped and
+    added to ``failed``.
+    """
+    items = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        names = set(filenames)
+        for filename in sorted(filenames):
+            stem, extension = os.path.splitext(filename)
+            if extension.lower() not in VIDEO_EXTENSIONS:
+                continue
+            row = {}
+            try:
+                if f'{stem}.json' in names:
+                    with open(os.path.join(directory, f'{stem}.json'), encoding='utf-8') as metadata:
+                        row = json.load(metadata)
+                    if not isinstance(row, dict):
+                        raise ValueError(f'{stem}.json is not an object')
+                row['path'] = filename
+                row.setdefault('thumbnail', next(
+                    (stem + ext for ext in THUMBNAIL_EXTENSIONS if stem + ext in names), ''
+                ))
+                items.append(_item(row, directory))
+            except ValueError as exc:
+                if failed is not None:
+                    failed.append((os.path.join(directory, filename), str(exc)))
+    return items
+
+
+class Checkpoint:
+    """
+    Keys of the items imported so far, one per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = set()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as checkpoint:
+                self.keys = {line.rstrip('\n') for line in checkpoint if line.strip()}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, keys):
+        self.keys.update(keys)
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as checkpoint:
+                checkpoint.writelines(f'{key}\n' for key in keys)
+
+
+# Worker processes
+
+def probe_duration(path):
+    if not shutil.which('ffprobe'):
+        return 0
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        capture_output=True, text=True, timeout=60,
+    ).stdout.strip()
+    try:
+        return int(float(output))
+    except ValueError:
+        return 0
+
+
+def _extract_thumbnail(path, duration, output_dir, sha256):
+    if not shutil.which('ffmpeg'):
+        return ''
+    output = os.path.join(output_dir, f'{sha256}.jpg')
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-ss', str(duration // 10), '-i', path,
+         '-frames:v', '1', '-vf', 'scale=640:-2', output],
+        capture_output=True, timeout=120,
+    )
+    return output if os.path.exists(output) else ''
+
+
+def _store_blob(field, path, sha256):
+    storage = field.storage
+    if not isinstance(storage, ContentAddressedMixin):
+        # Copied by the main process when the row is saved
+        return
+    with open(path, 'rb') as source:
+        content = File(source, os.path.basename(path))
+        content.sha256 = sha256
+        storage.store_blob(field.generate_filename(None, content.name), content)
+
+
+def probe(item, thumbnail_dir):
+    """
+    Hash, probe and store the files of ``item``. Runs in a worker process.
+    """
+    try:
+        with open(item.path, 'rb') as source:
+            sha256 = file_digest(File(source))
+        duration = item.duration or probe_duration(item.path)
+        thumbnail = item.thumbnail or _extract_thumbnail(item.path, duration, thumbnail_dir, sha256)
+        thumbnail_sha256 = ''
+        _store_blob(Video._meta.get_field('file'), item.path, sha256)
+        if thumbnail:
+            with open(thumbnail, 'rb') as source:
+                thumbnail_sha256 = file_digest(File(source))
+            _store_blob(Video._meta.get_field('thumbnail'), thumbnail, thumbnail_sha256)
+        return Probed(item, sha256, duration, thumbnail, thumbnail_sha256)
+    except Exception as exc:
+        return Probed(item, error=f'{type(exc).__name__}: {exc}')
+
+
+# Main process
+
+class Lookups:
+    """
+    Uploaders (by username or email, after ``uploader_map``) and categories
+    (by slug or name, created when missing), cached for the whole import.
+    """
+
+    def __init__(self, default_uploader='', uploader_map=None):
+        self.default_uploader = default_uploader
+        self.uploader_map = uploader_map or {}
+        self.uploaders = {}
+        self.categories = {}
+
+    def uploader_id(self, source):
+        name = self.uploader_map.get(source, source) or self.default_uploader
+        if name not in self.uploaders:
+            self.uploaders[name] = get_user_model().objects.filter(
+                Q(username=name) | Q(email__iexact=name)
+            ).values_list('pk', flat=True).first() if name else None
+        return self.uploaders[name]
+
+    def category_id(self, name):
+        if not name:
+            return None
+        if name not in self.categories:
+            category = Category.objects.filter(Q(slug=name) | Q(name__iexact=name)).first()
+            if category is None:
+                category, _ = Category.objects.get_or_create(slug=slugify(name), defaults={'name': name})
+            self.categories[name] = category.pk
+        return self.categories[name]
+
+
+def _open(path, sha256):
+    content = File(open(path, 'rb'), os.path.basename(path))
+    # Already hashed (and stored) by the worker
+    content.sha256 = sha256
+    return content
+
+
+def _attach(fieldfile, path, sha256, files, blobs):
+    """
+    Point ``fieldfile`` at the file at ``path``. Blobs the workers stored
+    are only counted in ``blobs``, referenced once per batch; other
+    storages copy the file.
+    """
+    storage = fieldfile.storage
+    if isinstance(storage, ContentAddressedMixin):
+        name = storage.blob_name(fieldfile.field.generate_filename(None, os.path.basename(path)), sha256)
+        digest, size, references = blobs.get(name, (sha256, os.path.getsize(path), 0))
+        blobs[name] = (digest, size, references + 1)
+        fieldfile.name = name
+        return
+    files.append(_open(path, sha256))
+    fieldfile.save(files[-1].name, files[-1], save=False)
+
+
+def _save_batch(batch, lookups, checkpoint, result):
+    existing = set(Video.all_objects.filter(pk__in=[entry.item.video_id for entry in batch]).values_list(
+        'pk', flat=True
+    ))
+    done, videos, files, blobs = [], [], [], {}
+    try:
+        with transaction.atomic():
+            for entry in batch:
+                item = entry.item
+                if item.video_id in existing:
+                    # Committed by a run that crashed before its checkpoint
+                    done.append(item.key)
+                    continue
+                video = Video(
+                    id=item.video_id,
+                    title=item.title[:255],
+                    slug=Video.slug_for(item.title, item.video_id),
+                    description=item.description,
+                    tags=item.tags[:500],
+                    category_id=lookups.category_id(item.category),
+                    privacy=item.privacy,
+                    uploader_id=lookups.uploader_id(item.uploader),
+                    duration=entry.duration,
+                )
+                _attach(video.file, item.path, entry.sha256, files, blobs)
+                if entry.thumbnail:
+                    _attach(video.thumbnail, entry.thumbnail, entry.thumbnail_sha256, files, blobs)
+                videos.append(video)
+                done.append(item.key)
+            if blobs:
+                Video._meta.get_field('file').storage.add_references(blobs)
+            Video.objects.bulk_create(videos)
+    except (DatabaseError, OSError) as exc:
+        # Categories created in the rolled back transaction are gone
+        lookups.categories.clear()
+        if len(batch) == 1:
+            result.failed.append((batch[0].item.key, f'{type(exc).__name__}: {exc}'))
+            return
+        # Find the culprit: save the rows of the batch one at a time
+        for entry in batch:
+            _save_batch([entry], lookups, checkpoint, result)
+        return
+    finally:
+        for content in files:
+            content.close()
+    checkpoint.add(done)
+    result.skipped += len(done) - len(videos)
+    result.imported += len(videos)
+
+
+def import_videos(items, checkpoint_path=None, workers=None, batch_size=200,
+                  default_uploader='', uploader_map=None, log=None):
+    checkpoint = Checkpoint(checkpoint_path)
+    lookups = Lookups(default_uploader, uploader_map)
+    result = ImportResult()
+    todo = []
+    # Rejected before any file is stored
+    for item in items:
+        if item.key in checkpoint:
+            result.skipped += 1
+        elif lookups.uploader_id(item.uploader) is None:
+            result.failed.append((item.key, f'Unknown uploader "{item.uploader}"'))
+        elif item.privacy not in dict(Video.PRIVACY_CHOICES):
+            result.failed.append((item.key, f'Invalid privacy "{item.privacy}"'))
+        else:
+            todo.append(item)
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with tempfile.TemporaryDirectory() as thumbnail_dir, \
+            ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        batch = []
+        for entry in pool.map(partial(probe, thumbnail_dir=thumbnail_dir), todo, chunksize=4):
+            if entry.error:
+                result.failed.append((entry.item.key, entry.error))
+                continue
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                _save_batch(batch, lookups, checkpoint, result)
+                batch = []
+                if log:
+                    log(f'{result.imported} imported, {len(result.failed)} failed')
+        if batch:
+            _save_batch(batch, lookups, checkpoint, result)
+    return result
@@ -0,0 +1,272 @@
+"""
+Integrity scan of the local media files.
+
+``manage.py scan_media`` compares the files the database references (every
+FileField of every model, soft-deleted rows included) with the files on
+disk, and reports the difference both ways:
+
+- missing: referenced but not on disk
+- orphaned: on disk but not referenced. With ``delete_orphans``, blobs
+  without a ``MediaBlob`` row, left by uploads whose transaction rolled
+  back, are deleted once older than MEDIA_ORPHAN_GRACE_SECONDS.
+- corrupt: a content-addressed blob whose SHA-256 no longer matches its
+  name, see videos/storage.py
+
+Directories are listed and files hashed on a thread pool. The size, mtime
+and SHA-256 of every verified file go to a manifest (MEDIA_MANIFEST_PATH,
+JSON lines), and later scans only hash files whose size or mtime changed.
+The manifest is appended to as files are verified, so an interrupted scan
+picks up where it stopped, and rewritten with the current files at the end
+of each complete scan.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field as dataclass_field
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+from .storage import ContentAddressedMixin
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ScanResult:
+    files: int = 0
+    hashed: int = 0
+    hashed_bytes: int = 0
+    missing: list = dataclass_field(default_factory=list)
+    orphaned: list = dataclass_field(default_factory=list)
+    deleted: list = dataclass_field(default_factory=list)
+    corrupt: list = dataclass_field(default_factory=list)
+    skipped_storages: list = dataclass_field(default_factory=list)
+
+
+class Manifest:
+    """
+    ``path -> (size, mtime_ns, sha256)`` of the files verified so far. Later
+    lines override earlier ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, encoding='utf-8') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['path']] = (entry['size'], entry['mtime_ns'], entry['sha256'])
+                    except (ValueError, KeyError):
+                        # A line cut short by a crash
+                        continue
+        except FileNotFoundError:
+            pass
+        self._file = None
+
+    def unchanged(self, path, size, mtime_ns):
+        entry = self.entries.get(path)
+        return entry is not None and entry[:2] == (size, mtime_ns)
+
+    def record(self, path, size, mtime_ns, sha256):
+        self.entries[path] = (size, mtime_ns, sha256)
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(self._line(path, self.entries[path]))
+        self._file.flush()
+
+    def compact(self, paths):
+        """
+        Rewrite the manifest with the entries of ``paths`` only.
+        """
+        self.close()
+        self.entries = {path: self.entries[path] for path in paths if path in self.entries}
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as manifest_file:
+            for path, entry in self.entries.items():
+                manifest_file.write(self._line(path, entry))
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _line(self, path, entry):
+        size, mtime_ns, sha256 = entry
+        return json.dumps({'path': path, 'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}) + '\n'
+
+
+def file_fields():
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field
+
+
+def referenced_files(chunk_size=2000, skipped=None):
+    """
+    ``{storage root: {name: expected sha256 or None}}`` of the files the
+    database references, streamed from each table. Storages that are not on
+    the local filesystem are added to ``skipped``.
+    """
+    referenced = defaultdict(dict)
+    for model, field in file_fields():
+        storage = field.storage
+        if not isinstance(storage, FileSystemStorage):
+            if skipped is not None:
+                skipped.append(f'{model._meta.label}.{field.name}')
+            continue
+        digest = getattr(storage, 'digest', lambda name: None)
+        names = referenced[os.path.abspath(storage.location)]
+        queryset = model._base_manager.exclude(**{field.attname: ''}).exclude(**{f'{field.attname}__isnull': True})
+        for name in queryset.values_list(field.attname, flat=True).iterator(chunk_size=chunk_size):
+            names[name] = digest(name)
+    return referenced
+
+
+def blob_roots():
+    """
+    The roots of the local content-addressed storages.
+    """
+    return {
+        os.path.abspath(field.storage.location) for _, field in file_fields()
+        if isinstance(field.storage, ContentAddressedMixin) and isinstance(field.storage, FileSystemStorage)
+    }
+
+
+def delete_orphaned_blobs(root, orphaned, on_disk, chunk_size=2000):
+    """
+    Delete the blobs among ``orphaned`` (names under ``root``) that have no
+    MediaBlob and were last written more than MEDIA_ORPHAN_GRACE_SECONDS
+    ago: uploads still in their transaction are younger. Returns their names.
+    """
+    MediaBlob = apps.get_model('videos', 'MediaBlob')
+    cutoff = (time.time() - settings.MEDIA_ORPHAN_GRACE_SECONDS) * 1e9
+    candidates = [
+        name for name in orphaned if ContentAddressedMixin.digest(name) and on_disk[name][1] < cutoff
+    ]
+    deleted = []
+    for start in range(0, len(candidates), chunk_size):
+        chunk = candidates[start:start + chunk_size]
+        known = set(MediaBlob.objects.filter(name__in=chunk).values_list('name', flat=True))
+        for name in chunk:
+            if name in known:
+                continue
+            try:
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            deleted.append(name)
+    return deleted
+
+
+def _list_directory(root, directory):
+    files, subdirectories = {}, []
+    with os.scandir(os.path.join(root, directory)) as entries:
+        for entry in entries:
+            name = posixpath.join(directory, entry.name) if directory else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(name)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files[name] = (stat.st_size, stat.st_mtime_ns)
+    return files, subdirectories
+
+
+def list_files(root, pool):
+    """
+    ``{name: (size, mtime_ns)}`` of the files under ``root``, listing
+    directories in parallel.
+    """
+    files = {}
+    if not os.path.isdir(root):
+        return files
+    pending = {pool.submit(_list_directory, root, '')}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            found, subdirectories = future.result()
+            files.update(found)
+            pending.update(pool.submit(_list_directory, root, directory) for directory in subdirectories)
+    return files
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as media_file:
+        while chunk := media_file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def scan_media(manifest_path, workers=None, full=False, chunk_size=2000, delete_orphans=False, log=None):
+    """
+    Scan every local media root, see the module docstring. ``full``
+    re-hashes files the manifest already has, which also catches corruption
+    that left the size and mtime as they were.
+    """
+    result = ScanResult()
+    manifest = Manifest(manifest_path)
+    manifest_file = os.path.abspath(manifest_path)
+    referenced = referenced_files(chunk_size, result.skipped_storages)
+    blobs = blob_roots() if delete_orphans else set()
+    seen = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for root, names in referenced.items():
+                on_disk = list_files(root, pool)
+                on_disk.pop(os.path.relpath(manifest_file, root).replace(os.sep, '/'), None)
+                result.files += len(on_disk)
+                if log:
+                    log(f'{root}: {len(names)} referenced, {len(on_disk)} on disk')
+
+                result.missing.extend(sorted(names.keys() - on_disk.keys()))
+                orphaned = sorted(on_disk.keys() - names.keys())
+                if root in blobs:
+                    deleted = delete_orphaned_blobs(root, orphaned, on_disk, chunk_size)
+                    result.deleted.extend(deleted)
+                    orphaned = sorted(set(orphaned) - set(deleted))
+                result.orphaned.extend(orphaned)
+
+                to_hash = {}
+                for name in names.keys() & on_disk.keys():
+                    path = os.path.join(root, name)
+                    seen.append(path)
+                    size, mtime_ns = on_disk[name]
+                    if full or not manifest.unchanged(path, size, mtime_ns):
+                        to_hash[pool.submit(_hash_file, path)] = (name, path, size, mtime_ns)
+
+                for future in as_completed(list(to_hash)):
+                    name, path, size, mtime_ns = to_hash.pop(future)
+                    try:
+                        sha256 = future.result()
+                    except FileNotFoundError:
+                        # Deleted since the listing
+                        result.missing.append(name)
+                        continue
+                    result.hashed += 1
+                    result.hashed_bytes += size
+                    expected = names[name]
+                    if expected is not None and sha256 != expected:
+                        result.corrupt.append(name)
+                        continue
+                    manifest.record(path, size, mtime_ns, sha256)
+                    if log and result.hashed % 1000 == 0:
+                        log(f'{result.hashed} files hashed ({result.hashed_bytes} bytes)')
+        finally:
+            manifest.close()
+
+    manifest.compact(seen)
+    return result
+
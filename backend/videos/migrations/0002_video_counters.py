@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-19 09:19
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Video = apps.get_model('videos', 'Video')
+    Like = apps.get_model('videos', 'Like')
+    Comment = apps.get_model('videos', 'Comment')
+
+    def count(queryset):
+        counts = queryset.filter(video=OuterRef('pk')).order_by().values('video').annotate(
+            total=Count('pk')
+        ).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Video.objects.update(
+        likes_count=count(Like.objects.filter(like_type='like')),
+        dislikes_count=count(Like.objects.filter(like_type='dislike')),
+        comments_count=count(Comment.objects.all()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.1 on 2026-10-19 09:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0004_soft_delete'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('interactions', models.PositiveBigIntegerField(default=0)),
+                ('videos_updated', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarVideo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingVideo',
+            fields=[
+                ('rank', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='videoview',
+            index=models.Index(fields=['user', '-viewed_at'], name='videoview_user_recent_idx'),
+        ),
+        migrations.AddField(
+            model_name='similarvideo',
+            name='similar',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='videos.video'),
+        ),
+        migrations.AddField(
+            model_name='similarvideo',
+            name='video',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_videos', to='videos.video'),
+        ),
+        migrations.AddField(
+            model_name='trendingvideo',
+            name='video',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='videos.video'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='similarvideo',
+            unique_together={('video', 'similar')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 09:46
+
+import django.db.models.deletion
+import videos.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0005_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Storyboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vtt', models.FileField(blank=True, storage=videos.storage.media_storage, upload_to='storyboards/')),
+                ('sprites', models.JSONField(blank=True, default=list)),
+                ('interval', models.PositiveIntegerField(default=0, help_text='Seconds between frames')),
+                ('tile_width', models.PositiveIntegerField(default=0)),
+                ('tile_height', models.PositiveIntegerField(default=0)),
+                ('columns', models.PositiveIntegerField(default=0)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('frames', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='storyboard', to='videos.video')),
+            ],
+        ),
+    ]
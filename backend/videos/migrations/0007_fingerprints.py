@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0006_storyboards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hashes', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='videos.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NearDuplicate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matched', models.PositiveIntegerField(help_text='Hashes of the video close to one of the original')),
+                ('hashes', models.PositiveIntegerField(help_text='Hashes of the video')),
+                ('distance', models.FloatField(help_text='Mean Hamming distance of the matched hashes, in bits')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('original', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='videos.video')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='near_duplicates', to='videos.video')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'unique_together': {('video', 'original')},
+            },
+        ),
+    ]
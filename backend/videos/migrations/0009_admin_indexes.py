@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0008_playlists'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['created_at', 'id'], name='video_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videoview',
+            index=models.Index(fields=['viewed_at', 'id'], name='videoview_viewed_at_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-19 10:21
+
+import django.db.models.deletion
+import videos.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0009_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaptionTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(help_text='BCP 47 tag, e.g. "en" or "pt-BR"', max_length=35)),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('file', models.FileField(storage=videos.storage.media_storage, upload_to='captions/')),
+                ('cues_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='caption_tracks', to='videos.video')),
+            ],
+            options={
+                'ordering': ['language'],
+                'unique_together': {('video', 'language')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CaptionCue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveIntegerField(help_text='Milliseconds')),
+                ('end', models.PositiveIntegerField(help_text='Milliseconds')),
+                ('text', models.TextField()),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cues', to='videos.captiontrack')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['track', 'start'], name='captioncue_track_start_idx')],
+            },
+        ),
+    ]
@@ -1,8 +1,15 @@
 from django.db import models
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
 from django.utils.text import slugify
+from contextvars import ContextVar
 import uuid
 
+from .storage import ContentAddressedMixin, media_storage
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True, blank=True)
@@ -20,6 +27,71 @@ class Category(models.Model):
     class Meta:
         verbose_name_plural = 'Categories'
 
+def _count_for_video(queryset):
+    """
+    Correlated subquery counting the rows of ``queryset`` per video.
+    """
+    counts = queryset.filter(video=OuterRef('pk')).order_by().values('video').annotate(
+        total=Count('pk')
+    ).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+# Set while api/deletion.py deletes rows in batches: it updates counters and
+# version stamps once per batch instead of once per row
+batch_deleting = ContextVar('batch_deleting', default=False)
+
+class VideoQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Public videos, plus unlisted and the user's own videos when logged in.
+        """
+        if user.is_authenticated:
+            return self.filter(
+                Q(privacy='public') | 
+                Q(privacy='unlisted') | 
+                Q(uploader=user)
+            )
+        return self.filter(privacy='public')
+    
+    def for_listing(self, related=('uploader', 'category')):
+        """
+        Everything VideoSerializer reads, fetched in a single query.
+        """
+        if related:
+            return self.select_related(*related)
+        return self
+    
+    def refresh_counters(self):
+        """
+        Recompute the denormalized like, dislike and comment counters from
+        scratch, which counts every like and comment of the videos: only to
+        repair them. Writes adjust them with ``add_to_counters()``.
+        """
+        return self.update(
+            likes_count=_count_for_video(Like.objects.filter(like_type='like')),
+            dislikes_count=_count_for_video(Like.objects.filter(like_type='dislike')),
+            comments_count=_count_for_video(Comment.objects.all()),
+        )
+    
+    def add_to_counters(self, **deltas):
+        """
+        Add ``deltas`` (counter field -> change) to the denormalized counters
+        in one UPDATE, never going below zero.
+        """
+        changes = {field: Greatest(F(field) + delta, 0) for field, delta in deltas.items() if delta}
+        return self.update(**changes) if changes else 0
+    
+    def featured(self):
+        """
+        The ten most viewed public videos, ties broken by like count.
+        """
+        return self.filter(privacy='public').for_listing().order_by('-views', '-likes_count')[:10]
+
+class VideoManager(models.Manager.from_queryset(VideoQuerySet)):
+    def get_queryset(self):
+        # Videos scheduled for deletion are gone as far as the site is concerned
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class Video(models.Model):
     PRIVACY_CHOICES = (
         ('public', 'Public'),
@@ -30,8 +102,8 @@ class Video(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
-    file = models.FileField(upload_to='videos/')
-    thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True)
+    file = models.FileField(upload_to='videos/', storage=media_storage)
+    thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True, storage=media_storage)
     uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='videos')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='videos')
     privacy = models.CharField(max_length=10, choices=PRIVACY_CHOICES, default='public')
@@ -42,13 +114,42 @@ class Video(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     tags = models.CharField(max_length=500, blank=True, help_text='Comma separated tags')
     
+    # Denormalized counters, kept up to date by the Like and Comment signals
+    likes_count = models.PositiveIntegerField(default=0)
+    dislikes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    
+    # Set when the video is scheduled for deletion, see api/deletion.py
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    objects = VideoManager()
+    all_objects = VideoQuerySet.as_manager()
+    
+    @staticmethod
+    def slug_for(title, id):
+        """
+        The slug ``save()`` gives a new video, also used by bulk imports.
+        """
+        return slugify(f"{title}-{str(id)[:8]}")
+    
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(f"{self.title}-{str(self.id)[:8]}")
+            self.slug = self.slug_for(self.title, self.id)
         super().save(*args, **kwargs)
     
     def __str__(self):
         return self.title
+    
+    class Meta:
+        indexes = [
+            # Newest first listings, including the admin's
+            models.Index(fields=['created_at', 'id'], name='video_created_idx'),
+        ]
+
+class CommentManager(models.Manager):
+    def get_queryset(self):
+        # Hide comments on videos, or by users, scheduled for deletion
+        return super().get_queryset().filter(video__deleted_at__isnull=True, user__deleted_at__isnull=True)
 
 class Comment(models.Model):
     video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='comments')
@@ -58,6 +159,8 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CommentManager()
+    
     def __str__(self):
         return f"{self.user.username}'s comment on {self.video.title}"
     
@@ -75,6 +178,9 @@ class Like(models.Model):
     like_type = models.CharField(max_length=7, choices=LIKE_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # The Video counter of each like type
+    COUNTERS = {'like': 'likes_count', 'dislike': 'dislikes_count'}
+    
     class Meta:
         unique_together = ('video', 'user')
         
@@ -88,7 +194,291 @@ class VideoView(models.Model):
     user_agent = models.CharField(max_length=500, blank=True)
     viewed_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Recent watch history of a user, read by the home feed
+            models.Index(fields=['user', '-viewed_at'], name='videoview_user_recent_idx'),
+            # Date ranges, e.g. the admin's date filter
+            models.Index(fields=['viewed_at', 'id'], name='videoview_viewed_at_idx'),
+        ]
+    
     def __str__(self):
         if self.user:
             return f"{self.video.title} viewed by {self.user.username}"
         return f"{self.video.title} viewed by {self.ip_address}"
+
+class MediaBlob(models.Model):
+    """
+    A stored media file and the number of references to it, see
+    videos/storage.py.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    digest = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    references = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.references} references)"
+
+class Storyboard(models.Model):
+    """
+    Seek preview sprite sheets of a video and their WebVTT index, see
+    videos/storyboard.py. Without a ``vtt`` the build failed with ``error``.
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='storyboard')
+    vtt = models.FileField(upload_to='storyboards/', blank=True, storage=media_storage)
+    sprites = models.JSONField(default=list, blank=True)  # Names in the media storage
+    interval = models.PositiveIntegerField(default=0, help_text='Seconds between frames')
+    tile_width = models.PositiveIntegerField(default=0)
+    tile_height = models.PositiveIntegerField(default=0)
+    columns = models.PositiveIntegerField(default=0)
+    rows = models.PositiveIntegerField(default=0)
+    frames = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Storyboard of {self.video_id}"
+
+class Fingerprint(models.Model):
+    """
+    Perceptual hashes of sampled frames and the thumbnail of a video, see
+    videos/fingerprint.py. Without ``hashes`` fingerprinting failed with
+    ``error``.
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='fingerprint')
+    hashes = models.JSONField(default=list, blank=True)  # 64-bit hashes as 16 hex digits
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Fingerprint of {self.video_id}"
+
+class NearDuplicate(models.Model):
+    """
+    An earlier video most frames of ``video`` are near-identical to: likely
+    a re-upload of ``original``.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='near_duplicates')
+    original = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    matched = models.PositiveIntegerField(help_text='Hashes of the video close to one of the original')
+    hashes = models.PositiveIntegerField(help_text='Hashes of the video')
+    distance = models.FloatField(help_text='Mean Hamming distance of the matched hashes, in bits')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('video', 'original')
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.video_id} ~ {self.original_id} ({self.matched}/{self.hashes})"
+
+class CaptionTrack(models.Model):
+    """
+    Captions or subtitles of a video in one language, stored as WebVTT
+    whatever they were uploaded as, and parsed into ``CaptionCue`` rows for
+    transcript search, see videos/captions.py.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='caption_tracks')
+    language = models.CharField(max_length=35, help_text='BCP 47 tag, e.g. "en" or "pt-BR"')
+    label = models.CharField(max_length=100, blank=True)
+    file = models.FileField(upload_to='captions/', storage=media_storage)
+    cues_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('video', 'language')
+        ordering = ['language']
+    
+    def __str__(self):
+        return f"{self.language} captions of {self.video_id}"
+
+class CaptionCue(models.Model):
+    track = models.ForeignKey(CaptionTrack, on_delete=models.CASCADE, related_name='cues')
+    start = models.PositiveIntegerField(help_text='Milliseconds')
+    end = models.PositiveIntegerField(help_text='Milliseconds')
+    text = models.TextField()
+    
+    class Meta:
+        indexes = [models.Index(fields=['track', 'start'], name='captioncue_track_start_idx')]
+    
+    def __str__(self):
+        return self.text
+
+class Playlist(models.Model):
+    """
+    An ordered list of videos. Items are ordered by fractional rank keys,
+    see videos/playlists.py.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='playlists')
+    title = models.CharField(max_length=150)
+    description = models.TextField(blank=True)
+    privacy = models.CharField(max_length=10, choices=Video.PRIVACY_CHOICES, default='private')
+    items_count = models.PositiveIntegerField(default=0)
+    # Set when rank keys got long, for "manage.py rebalance_playlists"
+    needs_rebalance = models.BooleanField(default=False, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-updated_at']
+    
+    def __str__(self):
+        return self.title
+
+class PlaylistItem(models.Model):
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='items')
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    # Compared as plain strings: digits and lowercase letters only
+    rank = models.CharField(max_length=255)
+    added_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('playlist', 'video')
+        indexes = [models.Index(fields=['playlist', 'rank', 'id'])]
+        ordering = ['rank', 'id']
+    
+    def __str__(self):
+        return f"{self.playlist_id}: {self.video_id} at {self.rank}"
+
+class SimilarVideo(models.Model):
+    """
+    One of the top-K neighbours of a video by co-engagement, see
+    videos/recommender.py.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='similar_videos')
+    similar = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    
+    class Meta:
+        unique_together = ('video', 'similar')
+    
+    def __str__(self):
+        return f"{self.video_id} ~ {self.similar_id} ({self.score:.3f})"
+
+class TrendingVideo(models.Model):
+    """
+    The precomputed home feed of anonymous users, by rank.
+    """
+    rank = models.PositiveIntegerField(primary_key=True)
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ['rank']
+    
+    def __str__(self):
+        return f"#{self.rank} {self.video_id}"
+
+class RecommendationBuild(models.Model):
+    """
+    A run of "manage.py build_recommendations". The next incremental run
+    picks up the interactions recorded since ``started_at`` of the last
+    finished one.
+    """
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    interactions = models.PositiveBigIntegerField(default=0)
+    videos_updated = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Recommendations built at {self.started_at}"
+
+def _counts(kwargs):
+    """
+    Whether a Like or Comment signal should adjust the video counters.
+    """
+    if batch_deleting.get() or kwargs.get('raw'):
+        return False
+    # Nothing to count when the video itself is being deleted
+    origin = kwargs.get('origin')
+    return not (isinstance(origin, Video) or getattr(origin, 'model', None) is Video)
+
+@receiver(pre_save, sender=Like)
+def remember_like_type(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._stored_like_type = Like.objects.filter(pk=instance.pk).values_list('like_type', flat=True).first()
+
+@receiver(post_save, sender=Like)
+def count_saved_like(sender, instance, created, **kwargs):
+    if not _counts(kwargs):
+        return
+    previous = None if created else getattr(instance, '_stored_like_type', None)
+    if previous == instance.like_type or (previous is None and not created):
+        return
+    deltas = {Like.COUNTERS[instance.like_type]: 1}
+    if previous is not None:
+        deltas[Like.COUNTERS[previous]] = -1
+    Video.all_objects.filter(pk=instance.video_id).add_to_counters(**deltas)
+
+@receiver(post_delete, sender=Like)
+def count_deleted_like(sender, instance, **kwargs):
+    if _counts(kwargs):
+        Video.all_objects.filter(pk=instance.video_id).add_to_counters(**{Like.COUNTERS[instance.like_type]: -1})
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created and _counts(kwargs):
+        Video.all_objects.filter(pk=instance.video_id).add_to_counters(comments_count=1)
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    if _counts(kwargs):
+        Video.all_objects.filter(pk=instance.video_id).add_to_counters(comments_count=-1)
+
+def _release_file(storage, name):
+    # Only deduplicated blobs: files stored before that may be shared
+    if name and isinstance(storage, ContentAddressedMixin) and storage.digest(name):
+        storage.delete(name)
+
+@receiver(pre_save, sender=Video)
+def remember_video_files(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._stored_files = Video.objects.filter(pk=instance.pk).values_list('file', 'thumbnail').first()
+
+@receiver(post_save, sender=Video)
+def release_replaced_files(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_files', None) or ()
+    current = (instance.file.name, instance.thumbnail.name)
+    for field, old, new in zip((instance.file, instance.thumbnail), stored, current):
+        if old != new:
+            _release_file(field.storage, old)
+    instance._file_replaced = bool(stored) and stored[0] != current[0]
+    instance._thumbnail_replaced = bool(stored) and stored[1] != current[1]
+    instance._stored_files = current
+
+@receiver(post_save, sender=Video)
+def discard_stale_storyboard(sender, instance, created, **kwargs):
+    # Runs after release_replaced_files, which records the current file
+    if not created and getattr(instance, '_file_replaced', False):
+        Storyboard.objects.filter(video=instance).delete()
+
+@receiver(post_save, sender=Video)
+def discard_stale_fingerprint(sender, instance, created, **kwargs):
+    # The next "manage.py fingerprint_videos" hashes the new file or thumbnail
+    if not created and (getattr(instance, '_file_replaced', False) or getattr(instance, '_thumbnail_replaced', False)):
+        Fingerprint.objects.filter(video=instance).delete()
+        NearDuplicate.objects.filter(video=instance).delete()
+
+@receiver(post_delete, sender=Storyboard)
+def release_storyboard_files(sender, instance, **kwargs):
+    storage = instance.vtt.storage
+    for name in [instance.vtt.name, *instance.sprites]:
+        _release_file(storage, name)
+
+@receiver(post_delete, sender=CaptionTrack)
+def release_caption_file(sender, instance, **kwargs):
+    _release_file(instance.file.storage, instance.file.name)
+
+@receiver(post_delete, sender=Video)
+def release_video_files(sender, instance, **kwargs):
+    # Blobs shared with other videos only lose a reference
+    for field in (instance.file, instance.thumbnail):
+        _release_file(field.storage, field.name)
@@ -0,0 +1,253 @@
+"""
+Playlist ordering with fractional rank keys.
+
+Each ``PlaylistItem`` has a ``rank`` string, and items are listed in rank
+order (ties, possible between concurrent moves, by id). Putting an item
+between two others only takes a key that sorts between theirs, so adding or
+moving an item writes that one row, whatever the length of the playlist.
+
+A key is a fixed-width base-36 integer part of HEAD_LENGTH digits followed
+by an optional fraction, also in base 36, that never ends with a zero::
+
+    i00000        the first item of a playlist, in the middle of the range
+    i00001        appended after it
+    i00000i       moved between the two: i00000 plus the fraction .i
+
+Appending increments the integer part, so keys of appended items never grow.
+Between two keys whose integer parts differ by more than one the midpoint
+integer is used, otherwise the midpoint of the fractions, which gains a
+digit about every five moves into the same gap. When a key grows longer
+than PLAYLIST_RANK_REBALANCE_LENGTH the playlist is flagged and ``manage.py
+rebalance_playlists`` rewrites its keys as evenly spaced integers, SPACING
+apart. Keys only use digits and lowercase letters, which every database
+collation orders like plain bytes.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Playlist, PlaylistItem, Video
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+HEAD_LENGTH = 6
+HEAD_RANGE = BASE ** HEAD_LENGTH
+SPACING = BASE ** 2  # Between the integer parts of rebalanced keys
+
+
+def _encode(number):
+    digits = []
+    for _ in range(HEAD_LENGTH):
+        number, digit = divmod(number, BASE)
+        digits.append(DIGITS[digit])
+    return ''.join(reversed(digits))
+
+
+def _head(key):
+    return int(key[:HEAD_LENGTH], BASE)
+
+
+def _midpoint(low, high):
+    """
+    A fraction strictly between the fractions ``low`` and ``high`` (None
+    for 1), as digits after the point.
+    """
+    if high is not None:
+        # Keep the common prefix, reading missing digits of low as zeros
+        common = 0
+        while common < len(high) and (low[common] if common < len(low) else '0') == high[common]:
+            common += 1
+        if common:
+            return high[:common] + _midpoint(low[common:], high[common:])
+    low_digit = DIGITS.index(low[0]) if low else 0
+    high_digit = DIGITS.index(high[0]) if high is not None else BASE
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        return high[0]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
+
+
+def key_between(before, after):
+    """
+    A rank key sorting after ``before`` and before ``after``, either of
+    which may be None for the start or the end of the playlist.
+    """
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f'No key between "{before}" and "{after}"')
+    if before is None and after is None:
+        return _encode(HEAD_RANGE // 2)
+    if after is None:
+        head = _head(before)
+        if head + 1 < HEAD_RANGE:
+            return _encode(head + 1)
+        return before[:HEAD_LENGTH] + _midpoint(before[HEAD_LENGTH:], None)
+    if before is None:
+        head = _head(after)
+        if head:
+            return _encode(head - 1)
+        if len(after) == HEAD_LENGTH:
+            raise ValueError(f'No key before "{after}"')
+        return after[:HEAD_LENGTH] + _midpoint('', after[HEAD_LENGTH:])
+
+    low, high = _head(before), _head(after)
+    if high - low > 1:
+        return _encode((low + high) // 2)
+    if high == low:
+        return before[:HEAD_LENGTH] + _midpoint(before[HEAD_LENGTH:], after[HEAD_LENGTH:])
+    return before[:HEAD_LENGTH] + _midpoint(before[HEAD_LENGTH:], None)
+
+
+def keys_after(before, count):
+    """
+    ``count`` consecutive keys after ``before`` (None for an empty playlist).
+    """
+    first = key_between(before, None)
+    head = _head(first)
+    if len(first) > HEAD_LENGTH or head + count > HEAD_RANGE:
+        keys = [first]
+        while len(keys) < count:
+            keys.append(key_between(keys[-1], None))
+        return keys
+    return [_encode(head + offset) for offset in range(count)]
+
+
+def spaced_keys(count):
+    """
+    ``count`` keys evenly spread around the middle of the key space.
+    """
+    spacing = max(1, min(SPACING, HEAD_RANGE // (count + 1)))
+    start = (HEAD_RANGE - spacing * (count - 1)) // 2
+    return [_encode(start + spacing * index) for index in range(count)]
+
+
+def visible_videos(user):
+    videos = Video.objects.filter(privacy__in=('public', 'unlisted'))
+    if user.is_authenticated:
+        videos = videos | Video.objects.filter(uploader=user)
+    return videos
+
+
+def visible_items(playlist, user):
+    """
+    The items of ``playlist`` whose video ``user`` can see.
+    """
+    visible = Q(video__privacy__in=('public', 'unlisted'))
+    if user.is_authenticated:
+        visible |= Q(video__uploader=user)
+    return PlaylistItem.objects.filter(visible, playlist=playlist, video__deleted_at__isnull=True)
+
+
+def _flag_long_key(playlist_id, rank):
+    if len(rank) > settings.PLAYLIST_RANK_REBALANCE_LENGTH:
+        Playlist.objects.filter(pk=playlist_id, needs_rebalance=False).update(needs_rebalance=True)
+
+
+def append_videos(playlist, video_ids, user):
+    """
+    Append the videos ``user`` can see among ``video_ids`` that are not in
+    ``playlist`` yet, in the order given. Returns the number added.
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    with transaction.atomic():
+        playlist = Playlist.objects.select_for_update().get(pk=playlist.pk)
+        present = set(PlaylistItem.objects.filter(playlist=playlist, video__in=video_ids).values_list('video_id', flat=True))
+        visible = set(visible_videos(user).filter(pk__in=video_ids).values_list('pk', flat=True))
+        new = [video_id for video_id in video_ids if video_id in visible and video_id not in present]
+        # Counted live: the items of deleted videos stay until the deletion job removes them
+        live = PlaylistItem.objects.filter(playlist=playlist, video__deleted_at__isnull=True).count()
+        if live + len(new) > settings.PLAYLIST_MAX_ITEMS:
+            raise ValueError(f'Playlists hold at most {settings.PLAYLIST_MAX_ITEMS} videos')
+        if not new:
+            return 0
+
+        last = PlaylistItem.objects.filter(playlist=playlist).order_by('-rank', '-id').values_list('rank', flat=True).first()
+        keys = keys_after(last, len(new))
+        PlaylistItem.objects.bulk_create(
+            [PlaylistItem(playlist=playlist, video_id=video_id, rank=rank) for video_id, rank in zip(new, keys)],
+            batch_size=1000,
+        )
+        Playlist.objects.filter(pk=playlist.pk).update(items_count=F('items_count') + len(new), updated_at=timezone.now())
+        _flag_long_key(playlist.pk, keys[-1])
+    return len(new)
+
+
+def _neighbour_ranks(item, after):
+    """
+    The ranks between which ``item`` goes to follow the item ``after`` (None
+    for the top of the playlist).
+    """
+    others = PlaylistItem.objects.filter(playlist_id=item.playlist_id).exclude(pk=item.pk)
+    if after is None:
+        following = others
+        before = None
+    else:
+        before = after.rank
+        following = others.filter(Q(rank__gt=after.rank) | Q(rank=after.rank, pk__gt=after.pk))
+    return before, following.order_by('rank', 'id').values_list('rank', flat=True).first()
+
+
+def move_item(item, after=None):
+    """
+    Move ``item`` right after the item ``after``, or to the top. Only the
+    item's row is written, unless its neighbours share a rank.
+    """
+    with transaction.atomic():
+        Playlist.objects.select_for_update().filter(pk=item.playlist_id).first()
+        before, following = _neighbour_ranks(item, after)
+        try:
+            rank = key_between(before, following)
+        except ValueError:
+            # Tied ranks: spread them out and try again
+            rebalance(item.playlist_id)
+            if after is not None:
+                after.refresh_from_db(fields=['rank'])
+            before, following = _neighbour_ranks(item, after)
+            rank = key_between(before, following)
+        PlaylistItem.objects.filter(pk=item.pk).update(rank=rank)
+        item.rank = rank
+        if len(rank) >= PlaylistItem._meta.get_field('rank').max_length:
+            rebalance(item.playlist_id)
+            item.refresh_from_db(fields=['rank'])
+        else:
+            _flag_long_key(item.playlist_id, rank)
+    return item
+
+
+def remove_item(item):
+    with transaction.atomic():
+        deleted, _ = PlaylistItem.objects.filter(pk=item.pk).delete()
+        if deleted:
+            Playlist.objects.filter(pk=item.playlist_id).update(items_count=F('items_count') - 1)
+    return bool(deleted)
+
+
+def rebalance(playlist_id):
+    """
+    Rewrite the rank keys of a playlist as evenly spaced integers, keeping
+    the order.
+    """
+    with transaction.atomic():
+        Playlist.objects.select_for_update().filter(pk=playlist_id).first()
+        ids = list(PlaylistItem.objects.filter(playlist_id=playlist_id).order_by('rank', 'id').values_list('id', flat=True))
+        items = [PlaylistItem(pk=item_id, rank=rank) for item_id, rank in zip(ids, spaced_keys(len(ids)))]
+        PlaylistItem.objects.bulk_update(items, ['rank'], batch_size=1000)
+        Playlist.objects.filter(pk=playlist_id).update(needs_rebalance=False)
+    return len(items)
+
+
+def rebalance_pending(limit=None, log=None):
+    """
+    Rebalance the playlists flagged for it. Returns the number of playlists
+    and of items rewritten.
+    """
+    playlists = items = 0
+    for playlist_id in Playlist.objects.filter(needs_rebalance=True).values_list('pk', flat=True)[:limit]:
+        rewritten = rebalance(playlist_id)
+        playlists += 1
+        items += rewritten
+        if log:
+            log(f'{playlist_id}: {rewritten} items')
+    return playlists, items
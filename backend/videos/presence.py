@@ -0,0 +1,191 @@
+"""
+Live "watching now" counts.
+
+Players open ``ws/videos/<slug>/presence/`` (videos/consumers.py) while a
+video page is open and send ``{"type": "heartbeat"}`` every
+PRESENCE_HEARTBEAT seconds. They receive ``{"type": "watching", "count":
+n}`` whenever the count changes, at most once per PRESENCE_BROADCAST_INTERVAL.
+
+Each process runs one ``PresenceHub`` on its event loop. It keeps its own
+viewers in a ``PresenceTracker``: per video, the viewers ordered by their
+last heartbeat, so expiring those silent for PRESENCE_TTL seconds (a closed
+laptop, a dropped connection the server never heard about) only looks at
+the oldest entries.
+
+With the in-memory channel layer that is all there is. With a shared layer
+(CHANNEL_LAYER_BACKEND, e.g. channels_redis) the hub of every process with
+viewers of a video joins the ``presence.<slug>`` group and publishes its
+local count there when it changes, and at least every PRESENCE_TTL / 2
+seconds. Counts of other processes not refreshed within PRESENCE_TTL are
+dropped, so a crashed node's viewers disappear on their own. The messages
+on the layer are per process and video, not per viewer.
+
+Nothing here touches the database: videos are only known by slug.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(slug):
+    return f'presence.{slug}'
+
+
+class PresenceTracker:
+    """
+    Viewers of each video by time of their last heartbeat, oldest first.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.videos = defaultdict(OrderedDict)
+
+    def beat(self, video, viewer, now):
+        viewers = self.videos[video]
+        viewers[viewer] = now
+        viewers.move_to_end(viewer)
+
+    def leave(self, video, viewer):
+        viewers = self.videos.get(video)
+        if viewers is not None:
+            viewers.pop(viewer, None)
+            if not viewers:
+                del self.videos[video]
+
+    def expire(self, now):
+        deadline = now - self.ttl
+        for video in list(self.videos):
+            viewers = self.videos[video]
+            while viewers and next(iter(viewers.values())) < deadline:
+                viewers.popitem(last=False)
+            if not viewers:
+                del self.videos[video]
+
+    def count(self, video):
+        viewers = self.videos.get(video)
+        return len(viewers) if viewers else 0
+
+
+class PresenceHub:
+    def __init__(self, layer):
+        self.node = uuid.uuid4().hex
+        self.layer = layer
+        # One process: nobody else to tell
+        self.shared = layer is not None and not isinstance(layer, InMemoryChannelLayer)
+        self.tracker = PresenceTracker(settings.PRESENCE_TTL)
+        self.subscribers = defaultdict(set)  # video -> consumers
+        self.remote = defaultdict(dict)  # video -> {node: (count, expires)}
+        self.published = {}  # video -> (count, time) last sent to the other nodes
+        self.sent = {}  # video -> count last sent to the local viewers
+        self.channel = None
+        self.tasks = []
+
+    async def start(self):
+        if self.shared:
+            self.channel = await self.layer.new_channel()
+            self.tasks.append(asyncio.create_task(self._receive()))
+        self.tasks.append(asyncio.create_task(self._tick()))
+
+    def total(self, video, now=None):
+        now = time.monotonic() if now is None else now
+        remote = sum(count for count, expires in self.remote.get(video, {}).values() if expires > now)
+        return self.tracker.count(video) + remote
+
+    async def join(self, video, consumer):
+        first = not self.subscribers[video]
+        self.subscribers[video].add(consumer)
+        self.tracker.beat(video, consumer, time.monotonic())
+        if self.shared and first:
+            await self.layer.group_add(group_name(video), self.channel)
+
+    async def leave(self, video, consumer):
+        self.tracker.leave(video, consumer)
+        subscribers = self.subscribers.get(video)
+        if subscribers is None:
+            return
+        subscribers.discard(consumer)
+        if not subscribers:
+            del self.subscribers[video]
+            self.sent.pop(video, None)
+            self.remote.pop(video, None)
+            if self.shared:
+                await self.layer.group_discard(group_name(video), self.channel)
+
+    def heartbeat(self, video, consumer):
+        if consumer in self.subscribers.get(video, ()):
+            self.tracker.beat(video, consumer, time.monotonic())
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_BROADCAST_INTERVAL)
+            try:
+                await self.broadcast(time.monotonic())
+            except Exception:
+                logger.exception('Broadcasting presence counts failed')
+
+    async def broadcast(self, now):
+        self.tracker.expire(now)
+        if self.shared:
+            for video in set(self.subscribers) | set(self.published):
+                await self._publish(video, now)
+        for video, subscribers in list(self.subscribers.items()):
+            total = self.total(video, now)
+            if self.sent.get(video) != total:
+                self.sent[video] = total
+                await asyncio.gather(
+                    *(consumer.send_json({'type': 'watching', 'count': total}) for consumer in subscribers),
+                    return_exceptions=True,
+                )
+
+    async def _publish(self, video, now):
+        count = self.tracker.count(video)
+        last_count, last_time = self.published.get(video, (None, 0))
+        if count == last_count and now - last_time < settings.PRESENCE_TTL / 2:
+            return
+        await self.layer.group_send(group_name(video), {
+            'type': 'presence.count', 'video': video, 'node': self.node, 'count': count,
+        })
+        if count:
+            self.published[video] = (count, now)
+        else:
+            self.published.pop(video, None)
+
+    async def _receive(self):
+        while True:
+            try:
+                message = await self.layer.receive(self.channel)
+            except Exception:
+                logger.exception('Receiving presence counts failed')
+                await asyncio.sleep(settings.PRESENCE_BROADCAST_INTERVAL)
+                continue
+            if message.get('type') != 'presence.count' or message['node'] == self.node:
+                continue
+            if message['video'] in self.subscribers:
+                nodes = self.remote[message['video']]
+                if message['count']:
+                    nodes[message['node']] = (message['count'], time.monotonic() + settings.PRESENCE_TTL)
+                else:
+                    nodes.pop(message['node'], None)
+
+
+_hubs = {}
+
+
+async def get_hub():
+    """
+    The hub of the running event loop, started on first use.
+    """
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = PresenceHub(get_channel_layer())
+        await hub.start()
+    return hub
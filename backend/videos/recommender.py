@@ -0,0 +1,251 @@
+"""
+Item-to-item recommendations for the home feed.
+
+``manage.py build_recommendations`` reads every view, like and comment into
+a sparse user x video engagement matrix (views from anonymous visitors are
+grouped by IP address), log-damped so a few heavy users do not dominate,
+and computes the cosine similarity between videos as a sparse matrix
+product. Similarities resting on only a handful of shared users are shrunk
+towards zero. The top RECOMMENDER_TOP_K neighbours of each public video are
+stored as ``SimilarVideo`` rows.
+
+Builds are incremental: the matrix is always read in full, but only videos
+with new interactions since the last build get their neighbours recomputed
+and rewritten, which is where the time goes. ``--full`` recomputes all.
+
+Each build also ranks the videos engaged with most over the last
+RECOMMENDER_TRENDING_DAYS (views as the tie-breaker) into ``TrendingVideo``,
+the feed of anonymous users and the top-up of personal feeds.
+
+``home_feed()`` only does indexed lookups: the user's latest views and
+likes, the stored neighbours of those videos and the trending ranks.
+"""
+
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Comment, Like, RecommendationBuild, SimilarVideo, TrendingVideo, Video, VideoView
+
+# Engagement per interaction, summed per user and video then log-damped
+VIEW_WEIGHT = 1.0
+LIKE_WEIGHT = 4.0
+COMMENT_WEIGHT = 2.0
+
+# Similarities between videos with n shared users are scaled by n / (n + SHRINKAGE)
+SHRINKAGE = 5.0
+
+# Videos whose neighbours are computed per matrix product
+CHUNK_SIZE = 2000
+
+# Recent videos and likes a personal feed is built from
+FEED_SEEDS = 20
+
+
+class Interactions:
+    """
+    The engagement of every user with every public video, as COO arrays.
+    """
+
+    def __init__(self, since=None, trending_since=None):
+        self.users = {}
+        self.video_ids = []
+        self.videos = {}
+        self.rows = array('q')
+        self.columns = array('q')
+        self.weights = array('d')
+        self.changed = set()
+        self.trending = defaultdict(float)
+        self.since = since
+        self.trending_since = trending_since
+
+    def load(self, chunk_size=10000):
+        public = Video.objects.filter(privacy='public').values_list('id', 'views')
+        self.views = array('d')
+        for video_id, views in public.iterator(chunk_size=chunk_size):
+            self.videos[video_id] = len(self.video_ids)
+            self.video_ids.append(video_id)
+            self.views.append(views)
+
+        sources = (
+            (VideoView.objects.values_list('user_id', 'ip_address', 'video_id', 'viewed_at'), VIEW_WEIGHT),
+            (Like.objects.filter(like_type='like').values_list('user_id', 'video_id', 'created_at'), LIKE_WEIGHT),
+            (Comment.objects.values_list('user_id', 'video_id', 'created_at'), COMMENT_WEIGHT),
+        )
+        for queryset, weight in sources:
+            for row in queryset.iterator(chunk_size=chunk_size):
+                if len(row) == 4:
+                    user_id, ip_address, video_id, timestamp = row
+                    user = user_id or (f'ip:{ip_address}' if ip_address else None)
+                else:
+                    user, video_id, timestamp = row
+                self._add(user, video_id, timestamp, weight)
+        return self
+
+    def _add(self, user, video_id, timestamp, weight):
+        column = self.videos.get(video_id)
+        if user is None or column is None:
+            return
+        row = self.users.setdefault(user, len(self.users))
+        self.rows.append(row)
+        self.columns.append(column)
+        self.weights.append(weight)
+        if self.since is not None and timestamp > self.since:
+            self.changed.add(column)
+        if timestamp >= self.trending_since:
+            self.trending[column] += weight
+
+    def __len__(self):
+        return len(self.weights)
+
+    def matrix(self):
+        """
+        The log-damped user x video engagement matrix, with duplicate
+        interactions summed.
+        """
+        rows = np.frombuffer(self.rows, dtype=np.int64)
+        columns = np.frombuffer(self.columns, dtype=np.int64)
+        engagement = sparse.csr_matrix(
+            (np.frombuffer(self.weights), (rows, columns)), shape=(len(self.users), len(self.video_ids))
+        )
+        engagement.sum_duplicates()
+        engagement.data = np.log1p(engagement.data)
+        return engagement
+
+
+def similar_videos(engagement, columns, top_k):
+    """
+    ``{column: [(neighbour column, score), ...]}`` of the ``top_k`` most
+    similar videos of each of ``columns``, best first.
+    """
+    norms = np.sqrt(np.asarray(engagement.multiply(engagement).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (engagement @ sparse.diags(inverse)).tocsc()
+    engaged = normalized.copy()
+    engaged.data = np.ones_like(engaged.data)
+
+    neighbours = {}
+    columns = np.asarray(sorted(columns), dtype=np.int64)
+    for start in range(0, len(columns), CHUNK_SIZE):
+        chunk = columns[start:start + CHUNK_SIZE]
+        scores = (normalized[:, chunk].T @ normalized).tocsr()
+        shared = (engaged[:, chunk].T @ engaged).tocsr()
+        scores.sort_indices()
+        shared.sort_indices()
+        # Same sparsity pattern: every product of positive entries is positive
+        scores.data *= shared.data / (shared.data + SHRINKAGE)
+
+        for row, column in enumerate(chunk):
+            begin, end = scores.indptr[row], scores.indptr[row + 1]
+            others = scores.indices[begin:end]
+            values = scores.data[begin:end]
+            keep = others != column
+            others, values = others[keep], values[keep]
+            if len(values) > top_k:
+                best = np.argpartition(-values, top_k)[:top_k]
+                others, values = others[best], values[best]
+            order = np.argsort(-values, kind='stable')
+            neighbours[int(column)] = list(zip(others[order].tolist(), values[order].tolist()))
+    return neighbours
+
+
+def build_recommendations(full=False, top_k=None, log=None):
+    top_k = top_k or settings.RECOMMENDER_TOP_K
+    now = timezone.now()
+    last = RecommendationBuild.objects.filter(finished_at__isnull=False).first()
+    since = None if full or last is None else last.started_at
+    build = RecommendationBuild.objects.create(started_at=now, full=since is None)
+
+    interactions = Interactions(
+        since=since, trending_since=now - timedelta(days=settings.RECOMMENDER_TRENDING_DAYS)
+    ).load()
+    if log:
+        log(f'{len(interactions)} interactions, {len(interactions.users)} users, '
+            f'{len(interactions.video_ids)} public videos')
+
+    # A full build also clears the neighbours of videos nobody engages with anymore
+    changed = range(len(interactions.video_ids)) if since is None else interactions.changed
+    neighbours = similar_videos(interactions.matrix(), changed, top_k)
+    video_ids = interactions.video_ids
+    updated = list(neighbours.items())
+    for start in range(0, len(updated), CHUNK_SIZE):
+        chunk = updated[start:start + CHUNK_SIZE]
+        with transaction.atomic():
+            SimilarVideo.objects.filter(video_id__in=[video_ids[column] for column, _ in chunk]).delete()
+            SimilarVideo.objects.bulk_create([
+                SimilarVideo(video_id=video_ids[column], similar_id=video_ids[other], score=score)
+                for column, similar in chunk
+                for other, score in similar
+            ], batch_size=1000)
+    # Videos that went private or are being deleted
+    SimilarVideo.objects.filter(
+        ~Q(video__privacy='public') | Q(video__deleted_at__isnull=False)
+    ).delete()
+
+    _rank_trending(interactions)
+
+    build.finished_at = timezone.now()
+    build.interactions = len(interactions)
+    build.videos_updated = len(neighbours)
+    build.save()
+    return build
+
+
+def _rank_trending(interactions):
+    recent = np.zeros(len(interactions.video_ids))
+    for column, weight in interactions.trending.items():
+        recent[column] = weight
+    ranked = np.lexsort((-np.frombuffer(interactions.views), -recent))[:settings.RECOMMENDER_TRENDING_SIZE]
+    with transaction.atomic():
+        TrendingVideo.objects.all().delete()
+        TrendingVideo.objects.bulk_create([
+            TrendingVideo(rank=rank, video_id=interactions.video_ids[column], score=recent[column])
+            for rank, column in enumerate(ranked.tolist(), start=1)
+        ])
+
+
+def trending_ids(limit):
+    return list(TrendingVideo.objects.values_list('video_id', flat=True)[:limit])
+
+
+def home_feed(user, limit):
+    """
+    Ids of up to ``limit`` videos for ``user``'s home feed, best first.
+    Videos similar to what the user watched and liked lately come first,
+    weighted by how recent the engagement is, then trending videos.
+    """
+    if not user.is_authenticated:
+        return trending_ids(limit)
+
+    watched = list(dict.fromkeys(
+        VideoView.objects.filter(user=user).order_by('-viewed_at').values_list('video_id', flat=True)[:FEED_SEEDS * 3]
+    ))[:FEED_SEEDS]
+    liked = list(
+        Like.objects.filter(user=user, like_type='like').order_by('-created_at').values_list('video_id', flat=True)[:FEED_SEEDS]
+    )
+    seeds = defaultdict(float)
+    for position, video_id in enumerate(watched):
+        seeds[video_id] += VIEW_WEIGHT / (1 + position)
+    for position, video_id in enumerate(liked):
+        seeds[video_id] += LIKE_WEIGHT / (1 + position)
+
+    scores = defaultdict(float)
+    for video_id, similar_id, score in SimilarVideo.objects.filter(video_id__in=seeds).values_list(
+        'video_id', 'similar_id', 'score'
+    ):
+        scores[similar_id] += seeds[video_id] * score
+    for video_id in seeds:
+        scores.pop(video_id, None)
+
+    feed = sorted(scores, key=scores.get, reverse=True)[:limit]
+    if len(feed) < limit:
+        seen = set(feed) | set(seeds)
+        feed += [video_id for video_id in trending_ids(limit * 2) if video_id not in seen][:limit - len(feed)]
+    return feed
@@ -0,0 +1,8 @@
+from django.urls import re_path
+
+from . import consumers
+
+# Group names are limited to ASCII letters, digits, hyphens and underscores
+websocket_urlpatterns = [
+    re_path(r'^ws/videos/(?P<slug>[-a-zA-Z0-9_]{1,90})/presence/$', consumers.PresenceConsumer.as_asgi()),
+]
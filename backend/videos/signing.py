@@ -0,0 +1,67 @@
+"""
+Expiring, HMAC-signed media URLs.
+
+With MEDIA_SIGNED_URLS the content-addressed media storage (videos,
+thumbnails, storyboards) hands out URLs of the form::
+
+    /media/signed/<expires>/<signature>/videos/3f/3f9a...e1.mp4
+
+The signature is an HMAC (keyed with SECRET_KEY) of the file name and the
+expiry timestamp, so a URL opens that one file only: a storyboard's VTT is
+served by the API with a signed URL of its own for each sheet (see
+``signed_vtt`` in videos/storyboard.py). Checking a URL takes one HMAC and no
+database query, so the media view can hand the file to the web server
+(MEDIA_ACCEL_REDIRECT) or stream it right away.
+
+Expiry times are rounded up to a multiple of MEDIA_URL_LIFETIME, at least
+one lifetime ahead. Everyone asking for a file within the same window gets
+the same URL, which browsers can keep in cache until it expires, and the
+signatures are computed once per window and process.
+"""
+
+import hashlib
+import hmac
+import time
+from functools import lru_cache
+
+from django.conf import settings
+
+SALT = 'mytube.media'
+PREFIX = 'signed/'
+
+
+def expires_at(now=None):
+    lifetime = settings.MEDIA_URL_LIFETIME
+    now = time.time() if now is None else now
+    return (int(now) // lifetime + 2) * lifetime
+
+
+@lru_cache(maxsize=1)
+def _key(secret):
+    return hashlib.sha256(f'{SALT}{secret}'.encode()).digest()
+
+
+def signature(name, expires):
+    message = f'{name}\n{expires}'.encode()
+    return hmac.new(_key(settings.SECRET_KEY), message, hashlib.sha256).hexdigest()[:32]
+
+
+def signed_path(name, expires):
+    """
+    The path, relative to MEDIA_URL, of ``name`` signed until ``expires``.
+    """
+    return f'{PREFIX}{expires}/{signature(name, expires)}/{name}'
+
+
+def verify(path, expires, given, now=None):
+    """
+    Whether ``given`` is a valid, unexpired signature of ``path``, which
+    must already be normalized (no ``..``).
+    """
+    try:
+        expires = int(expires)
+    except ValueError:
+        return False
+    if expires < (time.time() if now is None else now):
+        return False
+    return hmac.compare_digest(signature(path, expires), given)
@@ -0,0 +1,214 @@
+"""
+Content-addressed, deduplicating storage for video files and thumbnails.
+
+Every upload is stored once under its SHA-256 digest, e.g.
+``videos/3f/3f9a...e1.mp4``, whatever name it was uploaded with. A
+``MediaBlob`` row counts the references to each blob: saving identical
+content again only bumps the count (no second copy is written), and
+deleting drops a reference, removing the file with the last one.
+
+The digest is computed while the upload streams in by the upload handlers
+below, so a duplicate upload costs no extra pass over the file. Since a
+blob's content never changes for a given name, its URL can be served with
+``Cache-Control: public, max-age=31536000, immutable``, or, with
+MEDIA_SIGNED_URLS, cached privately until its signature expires.
+
+``ContentAddressedMixin`` works with any ``Storage`` implementing the
+standard API (``_save``, ``exists``, ``delete``), e.g. a django-storages
+backend::
+
+    class S3ContentAddressedStorage(ContentAddressedMixin, S3Storage):
+        pass
+
+and selected with the ``MEDIA_STORAGE_BACKEND`` setting.
+"""
+
+import hashlib
+import os
+import posixpath
+from collections import defaultdict
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+
+from . import signing
+
+
+def media_storage():
+    """
+    The storage of Video.file and Video.thumbnail, see ``STORAGES['media']``.
+    """
+    return storages['media']
+
+
+def file_digest(content):
+    """
+    Hex SHA-256 of ``content``, reusing the digest computed on upload.
+    """
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ContentAddressedMixin:
+    def blob_name(self, name, digest):
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = file_digest(content)
+        name = self.blob_name(name, digest)
+
+        # The file first: a failed write must not leave a reference to a
+        # blob that does not exist. A reference rolled back afterwards leaves
+        # a file without a MediaBlob, which "manage.py scan_media
+        # --delete-orphans" removes.
+        self._write_blob(name, content)
+
+        MediaBlob = apps.get_model('videos', 'MediaBlob')
+        with transaction.atomic():
+            _, created = MediaBlob.objects.get_or_create(
+                name=name, defaults={'digest': digest, 'size': content.size, 'references': 1}
+            )
+            if not created:
+                MediaBlob.objects.filter(name=name).update(references=F('references') + 1)
+        return name
+
+    def add_references(self, blobs):
+        """
+        Reference blobs already written with ``store_blob()``, in a few
+        queries: ``blobs`` maps each name to ``(digest, size, references)``.
+        """
+        MediaBlob = apps.get_model('videos', 'MediaBlob')
+        with transaction.atomic():
+            existing = set(MediaBlob.objects.filter(name__in=blobs).values_list('name', flat=True))
+            MediaBlob.objects.bulk_create([
+                MediaBlob(name=name, digest=digest, size=size, references=references)
+                for name, (digest, size, references) in blobs.items() if name not in existing
+            ])
+            by_count = defaultdict(list)
+            for name in existing:
+                by_count[blobs[name][2]].append(name)
+            for references, names in by_count.items():
+                MediaBlob.objects.filter(name__in=names).update(references=F('references') + references)
+
+    def store_blob(self, name, content):
+        """
+        Write the blob of ``content`` without adding a reference, so that a
+        later ``save()`` of the same content (e.g. in another process) has
+        nothing left to copy. Returns the blob name.
+        """
+        name = self.blob_name(name, file_digest(content))
+        self._write_blob(name, content)
+        return name
+
+    def _write_blob(self, name, content):
+        # Also restores a blob whose file went missing
+        if not self.exists(name):
+            saved = self._save(name, content)
+            if saved != name:
+                # An identical upload wrote the blob in the meantime
+                super().delete(saved)
+
+    def delete(self, name):
+        """
+        Drop one reference to ``name``, deleting the file once nothing
+        references it. Files stored before deduplication have no
+        ``MediaBlob`` and are deleted right away.
+        """
+        MediaBlob = apps.get_model('videos', 'MediaBlob')
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return super().delete(name)
+            if blob.references > 1:
+                MediaBlob.objects.filter(name=name).update(references=F('references') - 1)
+                return
+            blob.delete()
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        # Unless the same content was uploaded again since
+        if not apps.get_model('videos', 'MediaBlob').objects.filter(name=name).exists():
+            super().delete(name)
+
+    @staticmethod
+    def digest(name):
+        """
+        The content digest of blob ``name``, or None for other files.
+        """
+        digest = posixpath.splitext(posixpath.basename(name))[0]
+        if len(digest) == 64 and posixpath.basename(posixpath.dirname(name)) == digest[:2]:
+            return digest
+        return None
+
+
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    """
+    Content-addressed files under MEDIA_ROOT, served by ``serve_media`` with
+    expiring signed URLs when MEDIA_SIGNED_URLS is set (see videos/signing.py).
+    """
+
+    @property
+    def signs_urls(self):
+        return settings.MEDIA_SIGNED_URLS
+
+    def url(self, name):
+        """
+        The URL of ``name``, signed when enabled.
+        """
+        if not self.signs_urls:
+            return super().url(name)
+        name = name.replace('\\', '/')
+        return self._signed_url(name, signing.expires_at())
+
+    @lru_cache(maxsize=10000)
+    def _signed_url(self, name, expires):
+        return super().url(signing.signed_path(name, expires))
+
+
+class HashingUploadHandlerMixin:
+    """
+    Upload handler mixin computing the SHA-256 of the file it receives and
+    storing it as ``sha256`` on the uploaded file.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # This handler kept the chunk
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,190 @@
+"""
+Storyboards: sprite sheets of evenly spaced frames for seek previews.
+
+``manage.py build_storyboards`` extracts one frame every
+STORYBOARD_INTERVAL seconds (further apart for long videos, so there are at
+most STORYBOARD_MAX_FRAMES) from each video with ffmpeg, scales them down to
+STORYBOARD_TILE_WIDTH and packs them with Pillow into JPEG sheets of
+STORYBOARD_COLUMNS x STORYBOARD_ROWS tiles. A WebVTT file maps each time
+range to its tile, in the format players read thumbnail tracks in::
+
+    00:00:10.000 --> 00:00:20.000
+    ../3f/3f9a...e1.jpg#xywh=160,0,160,90
+
+The sheets and the VTT go to the media storage like the video itself, under
+their content digest, so their URLs never change content and are served
+with immutable caching. The VTT refers to the sheets relative to itself.
+A signed media URL opens one file only, so with MEDIA_SIGNED_URLS the API
+serves the VTT rewritten by ``signed_vtt()``, with a signed URL per sheet.
+
+A player downloads the VTT and one sheet per hundred frames once, then
+previews any position on the seek bar without asking the server for
+anything.
+"""
+
+import io
+import math
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+
+from .importer import probe_duration
+from .models import Storyboard, Video
+from .storage import media_storage
+
+
+def frame_interval(duration):
+    interval = settings.STORYBOARD_INTERVAL
+    return max(interval, math.ceil(duration / settings.STORYBOARD_MAX_FRAMES)) if duration else interval
+
+
+def _timestamp(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.000'
+
+
+def local_copy(field_file, directory):
+    """
+    A local path of ``field_file``, downloading it when the storage is remote.
+    """
+    try:
+        return field_file.path
+    except NotImplementedError:
+        path = os.path.join(directory, 'source' + os.path.splitext(field_file.name)[1])
+        with field_file.open('rb') as source, open(path, 'wb') as copy:
+            shutil.copyfileobj(source, copy, 1024 * 1024)
+        return path
+
+
+def extract_frames(path, interval, width, directory):
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-i', path, '-vf', f'fps=1/{interval},scale={width}:-2',
+         '-frames:v', str(settings.STORYBOARD_MAX_FRAMES), '-q:v', '3',
+         os.path.join(directory, 'frame%05d.jpg')],
+        check=True, capture_output=True, timeout=settings.STORYBOARD_TIMEOUT,
+    )
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.startswith('frame')
+    )
+
+
+def pack_sprites(frames, tile_width, columns, rows):
+    """
+    The sprite sheets of ``frames`` as JPEG bytes, and the tile height.
+    """
+    with Image.open(frames[0]) as first:
+        tile_height = round(first.height * tile_width / first.width)
+    per_sheet = columns * rows
+    sheets = []
+    for start in range(0, len(frames), per_sheet):
+        chunk = frames[start:start + per_sheet]
+        used_rows = math.ceil(len(chunk) / columns)
+        sheet = Image.new('RGB', (tile_width * min(len(chunk), columns), tile_height * used_rows))
+        for index, frame_path in enumerate(chunk):
+            with Image.open(frame_path) as frame:
+                tile = frame.convert('RGB').resize((tile_width, tile_height))
+            sheet.paste(tile, ((index % columns) * tile_width, (index // columns) * tile_height))
+        content = io.BytesIO()
+        sheet.save(content, 'JPEG', quality=settings.STORYBOARD_QUALITY, optimize=True)
+        sheets.append(content.getvalue())
+    return sheets, tile_height
+
+
+def build_vtt(sprite_urls, frames, interval, tile_width, tile_height, columns, rows, duration):
+    lines = ['WEBVTT', '']
+    per_sheet = columns * rows
+    for index in range(frames):
+        start = index * interval
+        end = min(start + interval, duration) if duration > start else start + interval
+        position = index % per_sheet
+        x, y = (position % columns) * tile_width, (position // columns) * tile_height
+        lines += [
+            f'{_timestamp(start)} --> {_timestamp(end)}',
+            f'{sprite_urls[index // per_sheet]}#xywh={x},{y},{tile_width},{tile_height}',
+            '',
+        ]
+    return '\n'.join(lines).encode()
+
+
+def signed_vtt(storyboard, absolute_uri):
+    """
+    The VTT of ``storyboard`` with each sheet at its own signed URL, made
+    absolute by ``absolute_uri``, instead of its URL relative to the VTT.
+    """
+    storage = storyboard.vtt.storage
+    with storyboard.vtt.open('rb') as vtt:
+        text = vtt.read().decode()
+    for name in storyboard.sprites:
+        relative = '../' + posixpath.relpath(name, 'storyboards')
+        text = text.replace(f'{relative}#', f'{absolute_uri(storage.url(name))}#')
+    return text.encode()
+
+
+def build_storyboard(video):
+    """
+    Extract, pack and store the storyboard of ``video``, replacing any
+    previous one.
+    """
+    storage = media_storage()
+    tile_width = settings.STORYBOARD_TILE_WIDTH
+    columns, rows = settings.STORYBOARD_COLUMNS, settings.STORYBOARD_ROWS
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = local_copy(video.file, directory)
+        duration = video.duration or probe_duration(path)
+        interval = frame_interval(duration)
+        frames = extract_frames(path, interval, tile_width, directory)
+        if not frames:
+            raise ValueError('ffmpeg extracted no frames')
+        sheets, tile_height = pack_sprites(frames, tile_width, columns, rows)
+
+    duration = duration or len(frames) * interval
+    with transaction.atomic():
+        sprites = [storage.save('storyboards/sheet.jpg', ContentFile(sheet)) for sheet in sheets]
+        # Relative to the VTT, which is stored next to the sheets
+        sprite_urls = ['../' + posixpath.relpath(name, 'storyboards') for name in sprites]
+        vtt = build_vtt(sprite_urls, len(frames), interval, tile_width, tile_height, columns, rows, duration)
+
+        Storyboard.objects.filter(video=video).delete()
+        storyboard = Storyboard(
+            video=video, sprites=sprites, interval=interval, tile_width=tile_width, tile_height=tile_height,
+            columns=columns, rows=rows, frames=len(frames),
+        )
+        storyboard.vtt.save('storyboard.vtt', ContentFile(vtt), save=False)
+        storyboard.save()
+    return storyboard
+
+
+def pending_videos(retry_failed=False):
+    videos = Video.objects.filter(storyboard__isnull=True)
+    if retry_failed:
+        videos = videos | Video.objects.filter(storyboard__vtt='')
+    return videos.order_by('created_at')
+
+
+def build_pending(limit=None, retry_failed=False, log=None):
+    """
+    Build the storyboards of videos that have none yet, oldest first.
+    Failures are recorded on the storyboard and skipped by later runs
+    unless ``retry_failed``.
+    """
+    built = failed = 0
+    for video in pending_videos(retry_failed)[:limit]:
+        try:
+            build_storyboard(video)
+            built += 1
+        except (OSError, ValueError, subprocess.SubprocessError) as exc:
+            error = exc.stderr.decode(errors='replace') if getattr(exc, 'stderr', None) else str(exc)
+            Storyboard.objects.update_or_create(video=video, defaults={'error': error or repr(exc)})
+            failed += 1
+            if log:
+                log(f'{video.slug}: {error}')
+    return built, failed
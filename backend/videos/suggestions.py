@@ -0,0 +1,330 @@
+"""
+Search-as-you-type suggestions from an in-memory prefix index.
+
+The index holds the titles of public videos, their tags, category names and
+the names of channels with public videos, each weighted by popularity
+(views). Every word of a title starts a key of its own, so "cat" suggests
+"Funny cat videos". Keys are normalized (case and accents folded) and kept
+in a sorted array: a query is a binary search for the first key starting
+with the prefix. The best matches of every one- and two-character prefix
+of a key, the only ranges too large to scan, are computed ahead of time;
+other short prefixes have no match, so queries never add to them.
+
+The index is built per process when the server starts (``warm_index()``,
+called from the WSGI and ASGI modules), from the snapshot written by
+``manage.py build_suggestions`` (SUGGEST_SNAPSHOT_PATH, a NumPy ``.npz``
+file of the weights and the entries as JSON) when there is a recent enough
+one, otherwise from the database. It is capped at
+SUGGEST_MAX_TERMS entries, the most popular ones. Video changes are applied
+to the index of the process making them right away (videos soft-deleted by
+an ``update()`` through ``remove_videos()``), and every index is
+rebuilt in the background every SUGGEST_REFRESH_SECONDS, which also picks up
+changes made by other processes and refreshes the weights.
+"""
+
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mytube.metrics import record_cache
+from .models import Category, Video
+
+logger = logging.getLogger(__name__)
+
+# Words of a title that start a key
+TITLE_KEYS = 8
+# Prefixes up to this length have their best matches computed ahead of time
+PRECOMPUTED_PREFIX = 2
+# Keys looked at for longer prefixes
+SCAN_LIMIT = 2000
+MAX_LIMIT = 10
+MAX_TEXT_LENGTH = 100
+
+
+def normalize(text):
+    """
+    Lower case, without accents or punctuation, with single spaces.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return ' '.join(re.findall(r'\w+', text))
+
+
+@dataclass
+class Entry:
+    text: str
+    type: str  # 'video', 'tag', 'category' or 'channel'
+    weight: float
+    slug: str = ''
+
+    def as_dict(self):
+        suggestion = {'text': self.text, 'type': self.type}
+        if self.slug:
+            suggestion['slug'] = self.slug
+        return suggestion
+
+
+def _keys(entry):
+    words = normalize(entry.text).split()
+    if entry.type != 'video':
+        return [' '.join(words)] if words else []
+    return list(dict.fromkeys(' '.join(words[start:]) for start in range(min(len(words), TITLE_KEYS))))
+
+
+class SuggestionIndex:
+    def __init__(self, entries=(), built_at=None):
+        self.built_at = built_at or time.time()
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.sources = {}  # (type, id) -> entry id
+        pairs = []
+        for number, (source, entry) in enumerate(entries):
+            self.entries[number] = entry
+            self.sources[source] = number
+            pairs.extend((key, number) for key in _keys(entry))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.ids = [number for _, number in pairs]
+        self.next_id = len(self.entries)
+        self.top = self._precompute()
+
+    def _precompute(self):
+        candidates = defaultdict(set)
+        for key, number in zip(self.keys, self.ids):
+            for length in range(1, PRECOMPUTED_PREFIX + 1):
+                if len(key) >= length:
+                    candidates[key[:length]].add(number)
+        return {prefix: self._best(numbers, MAX_LIMIT) for prefix, numbers in candidates.items()}
+
+    def _best(self, numbers, limit):
+        return heapq.nlargest(limit, numbers, key=lambda number: self.entries[number].weight)
+
+    def suggest(self, query, limit=MAX_LIMIT):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self.lock:
+            if len(prefix) <= PRECOMPUTED_PREFIX:
+                if prefix not in self.top:
+                    # Not the prefix of any key
+                    return []
+                top = self.top[prefix]
+                record_cache('suggestions', top is not None)
+                if top is None:
+                    top = self.top[prefix] = self._best(self._matches(prefix, len(self.keys)), MAX_LIMIT)
+                numbers = top[:limit]
+            else:
+                numbers = self._best(self._matches(prefix, SCAN_LIMIT), limit)
+            return [self.entries[number].as_dict() for number in numbers]
+
+    def _matches(self, prefix, scan_limit):
+        numbers = set()
+        position = bisect_left(self.keys, prefix)
+        end = min(position + scan_limit, len(self.keys))
+        while position < end and self.keys[position].startswith(prefix):
+            numbers.add(self.ids[position])
+            position += 1
+        return numbers
+
+    def update(self, source, entry):
+        """
+        Add, replace (same ``source``) or, with ``entry=None``, remove an entry.
+        """
+        with self.lock:
+            number = self.sources.pop(source, None)
+            if number is not None:
+                old = self.entries.pop(number)
+                for key in _keys(old):
+                    position = bisect_left(self.keys, key)
+                    while position < len(self.keys) and self.keys[position] == key:
+                        if self.ids[position] == number:
+                            del self.keys[position], self.ids[position]
+                            break
+                        position += 1
+                self._forget(old)
+            if entry is None:
+                return
+            number = self.next_id
+            self.next_id += 1
+            self.entries[number] = entry
+            self.sources[source] = number
+            for key in _keys(entry):
+                position = bisect_left(self.keys, key)
+                self.keys.insert(position, key)
+                self.ids.insert(position, number)
+            self._forget(entry)
+
+    def _forget(self, entry):
+        # Recomputed on the next query
+        for key in _keys(entry):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX) + 1):
+                self.top[key[:length]] = None
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def collect_entries(max_terms=None):
+    """
+    ``(source, Entry)`` pairs of everything worth suggesting, the
+    ``max_terms`` most popular.
+    """
+    max_terms = max_terms or settings.SUGGEST_MAX_TERMS
+    entries = []
+    tags = defaultdict(int)
+    channels = defaultdict(int)
+    categories = defaultdict(int)
+    public = Video.objects.filter(privacy='public').values_list(
+        'id', 'title', 'slug', 'tags', 'views', 'uploader__username', 'category_id'
+    )
+    for video_id, title, slug, video_tags, views, username, category_id in public.iterator(chunk_size=5000):
+        entries.append((('video', video_id), Entry(title[:MAX_TEXT_LENGTH], 'video', views, slug)))
+        for tag in video_tags.split(','):
+            tag = tag.strip()
+            if tag:
+                tags[tag[:MAX_TEXT_LENGTH].lower()] += views + 1
+        channels[username] += views + 1
+        if category_id is not None:
+            categories[category_id] += views + 1
+    entries.extend((('tag', tag), Entry(tag, 'tag', weight)) for tag, weight in tags.items())
+    entries.extend(
+        (('channel', username), Entry(username, 'channel', weight, username))
+        for username, weight in channels.items()
+    )
+    for category_id, name, slug in Category.objects.values_list('id', 'name', 'slug'):
+        entries.append((('category', category_id), Entry(name, 'category', categories[category_id], slug)))
+    return heapq.nlargest(max_terms, entries, key=lambda pair: pair[1].weight)
+
+
+def write_snapshot(path=None):
+    path = path or settings.SUGGEST_SNAPSHOT_PATH
+    entries = collect_entries()
+    meta = {
+        'built_at': time.time(),
+        'entries': [[source[0], str(source[1]), entry.text, entry.slug] for source, entry in entries],
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as snapshot:
+        np.savez(
+            snapshot,
+            weights=np.array([entry.weight for _, entry in entries], dtype=np.float64),
+            meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+        )
+    os.replace(f'{path}.tmp', path)
+    return len(entries)
+
+
+def _source(type, key):
+    if type == 'video':
+        return type, uuid.UUID(key)
+    if type == 'category':
+        return type, int(key)
+    return type, key
+
+
+def read_snapshot(path):
+    with np.load(path, allow_pickle=False) as snapshot:
+        weights = snapshot['weights'].tolist()
+        meta = json.loads(snapshot['meta'].tobytes())
+    entries = [
+        (_source(type, key), Entry(text, type, weight, slug))
+        for (type, key, text, slug), weight in zip(meta['entries'], weights)
+    ]
+    return SuggestionIndex(entries, meta['built_at'])
+
+
+def _load():
+    path = settings.SUGGEST_SNAPSHOT_PATH
+    try:
+        if time.time() - os.path.getmtime(path) < settings.SUGGEST_REFRESH_SECONDS:
+            return read_snapshot(path)
+    except FileNotFoundError:
+        pass
+    return SuggestionIndex(collect_entries())
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load()
+    elif time.time() - _index.built_at > settings.SUGGEST_REFRESH_SECONDS and not _refreshing.is_set():
+        _refreshing.set()
+        threading.Thread(target=_refresh, daemon=True).start()
+    return _index
+
+
+def warm_index():
+    """
+    Build the index before the first query needs it.
+    """
+    try:
+        get_index()
+    except Exception:
+        # Built on first use instead
+        logger.exception('Building the suggestion index failed')
+
+
+def _refresh():
+    global _index
+    try:
+        _index = _load()
+    except Exception:
+        logger.exception('Rebuilding the suggestion index failed')
+    finally:
+        _refreshing.clear()
+
+
+@receiver(post_save, sender=Video)
+def update_suggestions(sender, instance, **kwargs):
+    if _index is None:
+        return
+    if instance.privacy == 'public' and instance.deleted_at is None:
+        entry = Entry(instance.title[:MAX_TEXT_LENGTH], 'video', instance.views, instance.slug)
+    else:
+        entry = None
+    _index.update(('video', instance.pk), entry)
+    # New tags; their weights are refreshed by the next rebuild
+    for tag in instance.tags.split(','):
+        tag = tag.strip()[:MAX_TEXT_LENGTH].lower()
+        if entry is not None and tag and ('tag', tag) not in _index.sources:
+            _index.update(('tag', tag), Entry(tag, 'tag', instance.views + 1))
+
+
+@receiver(post_delete, sender=Video)
+def remove_suggestions(sender, instance, **kwargs):
+    if _index is not None:
+        _index.update(('video', instance.pk), None)
+
+
+def remove_videos(video_ids, channel=None):
+    """
+    Remove videos, and with ``channel`` that channel, hidden without a
+    signal, e.g. by an ``update()``.
+    """
+    if _index is None:
+        return
+    for video_id in video_ids:
+        _index.update(('video', video_id), None)
+    if channel is not None:
+        _index.update(('channel', channel), None)
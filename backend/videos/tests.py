@@ -1,3 +1,890 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from scipy import sparse
+
+from api.deletion import run_job, schedule_deletion
+from . import captions, playlists, signing, storyboard, suggestions
+from .fingerprint import HASH_BITS, HashIndex, chunk_widths
+from .importer import (
+    Checkpoint, ImportResult, Lookups, _save_batch, items_from_directory, items_from_manifest, probe,
+)
+from .integrity import delete_orphaned_blobs, list_files, scan_media
+from .models import (
+    Category, Like, MediaBlob, Playlist, PlaylistItem, SimilarVideo, Storyboard, Video, VideoView,
+)
+from .presence import PresenceHub, PresenceTracker
+from .recommender import SHRINKAGE, build_recommendations, home_feed, similar_videos
+from .routing import websocket_urlpatterns
+from .storage import media_storage
+from .views import _file_response, serve_media, serve_signed_media
+from .writer import SerializedWriter, run_write
+
+
+class TemporaryMediaMixin:
+    """
+    Runs each test with an empty MEDIA_ROOT of its own.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def media_path(self, name):
+        return os.path.join(self.media_root, name)
+
+
+class SerializedWriterTests(TestCase):
+
+    def test_failing_write_keeps_the_rest_of_its_batch(self):
+        batch = [
+            (Future(), Category.objects.create, (), {'name': 'Music', 'slug': 'music'}),
+            (Future(), Category.objects.create, (), {'name': 'Again', 'slug': 'music'}),
+            (Future(), Category.objects.create, (), {'name': 'News', 'slug': 'news'}),
+        ]
+        SerializedWriter()._commit(batch)
+        self.assertEqual(batch[0][0].result().slug, 'music')
+        self.assertIsInstance(batch[1][0].exception(), IntegrityError)
+        self.assertEqual(batch[2][0].result().slug, 'news')
+        self.assertEqual(set(Category.objects.values_list('slug', flat=True)), {'music', 'news'})
+
+
+@override_settings(SERIALIZED_WRITES=True)
+class RunWriteTests(TransactionTestCase):
+
+    def test_writes_run_on_the_writer_thread(self):
+        category = run_write(Category.objects.create, name='Sports')
+        self.assertTrue(Category.objects.filter(pk=category.pk).exists())
+        with self.assertRaises(IntegrityError):
+            run_write(Category.objects.create, name='Sports')
+
+    def test_fire_and_forget(self):
+        self.assertIsNone(run_write(Category.objects.create, name='Games', wait=False))
+        # Queued behind the first one
+        run_write(Category.objects.count)
+        self.assertTrue(Category.objects.filter(slug='games').exists())
+
+
+class BlobReferenceTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+
+    def references(self, name):
+        return MediaBlob.objects.filter(name=name).values_list('references', flat=True).first()
+
+    def test_identical_content_is_stored_once(self):
+        storage = media_storage()
+        first = storage.save('videos/a.mp4', ContentFile(b'same'))
+        second = storage.save('videos/b.MP4', ContentFile(b'same'))
+        self.assertEqual(first, second)
+        self.assertEqual(storage.digest(first), MediaBlob.objects.get(name=first).digest)
+        self.assertEqual(self.references(first), 2)
+        self.assertEqual(os.listdir(os.path.dirname(self.media_path(first))), [os.path.basename(first)])
+
+    def test_last_reference_deletes_the_file(self):
+        storage = media_storage()
+        name = storage.save('videos/a.mp4', ContentFile(b'content'))
+        storage.save('videos/a.mp4', ContentFile(b'content'))
+        with self.captureOnCommitCallbacks(execute=True):
+            storage.delete(name)
+        self.assertEqual(self.references(name), 1)
+        self.assertTrue(os.path.exists(self.media_path(name)))
+        with self.captureOnCommitCallbacks(execute=True):
+            storage.delete(name)
+        self.assertIsNone(self.references(name))
+        self.assertFalse(os.path.exists(self.media_path(name)))
+
+    def test_reuploaded_before_commit_is_kept(self):
+        storage = media_storage()
+        name = storage.save('videos/a.mp4', ContentFile(b'content'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            storage.delete(name)
+        storage.save('videos/a.mp4', ContentFile(b'content'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.references(name), 1)
+        self.assertTrue(os.path.exists(self.media_path(name)))
+
+    def test_videos_share_and_release_blobs(self):
+        videos = [
+            Video.objects.create(title=title, file=ContentFile(b'movie', name='movie.mp4'), uploader=self.user)
+            for title in ('One', 'Two')
+        ]
+        name = videos[0].file.name
+        self.assertEqual(videos[1].file.name, name)
+        self.assertEqual(self.references(name), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            videos[0].delete()
+        self.assertEqual(self.references(name), 1)
+        # Replacing the file releases the old one
+        videos[1].file = ContentFile(b'other', name='other.mp4')
+        with self.captureOnCommitCallbacks(execute=True):
+            videos[1].save()
+        self.assertIsNone(self.references(name))
+        self.assertFalse(os.path.exists(self.media_path(name)))
+        self.assertEqual(self.references(videos[1].file.name), 1)
+
+    def test_add_references(self):
+        storage = media_storage()
+        existing = storage.save('videos/a.mp4', ContentFile(b'a'))
+        new = storage.store_blob('videos/b.mp4', ContentFile(b'b'))
+        storage.add_references({existing: ('', 1, 2), new: (storage.digest(new), 1, 3)})
+        self.assertEqual((self.references(existing), self.references(new)), (3, 3))
+
+    @override_settings(MEDIA_ORPHAN_GRACE_SECONDS=60)
+    def test_orphaned_blobs_are_collected_after_the_grace_period(self):
+        storage = media_storage()
+        kept = storage.save('videos/a.mp4', ContentFile(b'kept'))
+        old = storage.store_blob('videos/b.mp4', ContentFile(b'rolled back'))
+        recent = storage.store_blob('videos/c.mp4', ContentFile(b'in flight'))
+        legacy = storage._save('videos/legacy.mp4', ContentFile(b'not a blob'))
+        for name in (kept, old, legacy):
+            os.utime(self.media_path(name), (time.time() - 120, time.time() - 120))
+        on_disk = self.files()
+        # A blob still referenced is never deleted, even if listed
+        self.assertEqual(delete_orphaned_blobs(self.media_root, sorted(on_disk), on_disk), [old])
+        self.assertEqual(sorted(self.files()), sorted([kept, recent, legacy]))
+
+    def files(self):
+        with ThreadPoolExecutor(1) as pool:
+            return list_files(self.media_root, pool)
+
+
+class ScanMediaTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+
+    def setUp(self):
+        super().setUp()
+        self.manifest = os.path.join(self.media_root, 'manifest.jsonl')
+
+    def scan(self, **options):
+        return scan_media(self.manifest, workers=2, **options)
+
+    def test_missing_orphaned_and_corrupt_files(self):
+        kept = Video.objects.create(title='Kept', file=ContentFile(b'kept', name='kept.mp4'), uploader=self.user)
+        broken = Video.objects.create(title='Broken', file=ContentFile(b'fine', name='fine.mp4'), uploader=self.user)
+        Video.objects.create(title='Gone', file='videos/gone.mp4', uploader=self.user)
+        with open(self.media_path(broken.file.name), 'wb') as media_file:
+            media_file.write(b'flipped')
+        media_storage()._save('videos/stray.mp4', ContentFile(b'stray'))
+
+        result = self.scan()
+        self.assertEqual(result.missing, ['videos/gone.mp4'])
+        self.assertEqual(result.orphaned, ['videos/stray.mp4'])
+        self.assertEqual(result.corrupt, [broken.file.name])
+        self.assertEqual(result.files, 3)
+        self.assertEqual(result.hashed, 2)
+        self.assertNotIn(kept.file.name, result.corrupt)
+
+    def test_manifest_skips_unchanged_files(self):
+        Video.objects.create(title='One', file=ContentFile(b'one', name='one.mp4'), uploader=self.user)
+        self.assertEqual(self.scan().hashed, 1)
+        self.assertEqual(self.scan().hashed, 0)
+        self.assertEqual(self.scan(full=True).hashed, 1)
+
+    @override_settings(MEDIA_ORPHAN_GRACE_SECONDS=0)
+    def test_delete_orphans(self):
+        blob = media_storage().store_blob('videos/a.mp4', ContentFile(b'rolled back'))
+        media_storage()._save('videos/legacy.mp4', ContentFile(b'not a blob'))
+        result = self.scan(delete_orphans=True)
+        self.assertEqual(result.deleted, [blob])
+        self.assertEqual(result.orphaned, ['videos/legacy.mp4'])
+        self.assertFalse(os.path.exists(self.media_path(blob)))
+
+
+class ImporterTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+
+    def write(self, name, content):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as source_file:
+            source_file.write(content)
+        return path
+
+    def test_invalid_manifest_rows_are_reported(self):
+        manifest = self.write('videos.jsonl', '\n'.join([
+            '{"path": "a.mp4", "title": "First", "duration": 12}',
+            '{"title": "No path"}',
+            'not json',
+            '{"path": "b.mp4", "duration": -1}',
+            '{"path": "my_clip.mp4", "id": "legacy-7"}',
+        ]))
+        failed = []
+        items = items_from_manifest(manifest, failed)
+        self.assertEqual([item.title for item in items], ['First', 'my clip'])
+        self.assertEqual(items[0].path, os.path.join(self.source, 'a.mp4'))
+        self.assertEqual(items[1].key, 'legacy-7')
+        self.assertEqual([line for line, _ in failed], [f'{manifest}:2', f'{manifest}:3', f'{manifest}:4'])
+
+    def test_directory_metadata_and_thumbnails(self):
+        self.write('a/clip.mp4', 'video')
+        self.write('a/clip.json', '{"title": "Clip", "tags": "x"}')
+        self.write('a/clip.png', 'image')
+        self.write('a/notes.txt', 'ignored')
+        self.write('b/bad.mov', 'video')
+        self.write('b/bad.json', '[]')
+        failed = []
+        items = items_from_directory(self.source, failed)
+        self.assertEqual([(item.title, item.tags) for item in items], [('Clip', 'x')])
+        self.assertEqual(items[0].thumbnail, os.path.join(self.source, 'a', 'clip.png'))
+        self.assertEqual([os.path.basename(path) for path, _ in failed], ['bad.mov'])
+
+    def test_imported_items_are_not_imported_twice(self):
+        self.write('a.mp4', 'same')
+        self.write('b.mp4', 'same')
+        manifest = self.write('videos.csv', 'path,title,category,duration,uploader\n'
+                              'a.mp4,One,Music,5,up\nb.mp4,Two,music,5,up@example.com\n')
+        items = items_from_manifest(manifest)
+        # The second row of the batch is a duplicate of the first
+        entries = [probe(item, self.source) for item in items + items[:1]]
+        self.assertEqual([entry.error for entry in entries], ['', '', ''])
+        result, checkpoint = ImportResult(), Checkpoint(os.path.join(self.source, 'checkpoint'))
+        _save_batch(entries, Lookups(), checkpoint, result)
+        self.assertEqual((result.imported, result.skipped, result.failed), (2, 1, []))
+
+        videos = Video.objects.order_by('title')
+        self.assertEqual([video.title for video in videos], ['One', 'Two'])
+        self.assertEqual(videos[0].file.name, videos[1].file.name)
+        self.assertEqual(MediaBlob.objects.get(name=videos[0].file.name).references, 2)
+        self.assertEqual(Category.objects.get().slug, 'music')
+        self.assertEqual(Checkpoint(checkpoint.path).keys, {item.key for item in items})
+
+        # A rerun that lost its checkpoint skips the rows already there
+        result = ImportResult()
+        _save_batch(entries[:2], Lookups(), Checkpoint(None), result)
+        self.assertEqual((result.imported, result.skipped), (0, 2))
+
+
+class SimilarVideosTests(SimpleTestCase):
+
+    def test_matches_shrunk_cosine_similarity(self):
+        engagement = np.random.default_rng(3).random((40, 6)) * (np.random.default_rng(4).random((40, 6)) < 0.4)
+        neighbours = similar_videos(sparse.csr_matrix(engagement), [0, 4], top_k=3)
+        for column in (0, 4):
+            expected = {}
+            for other in range(6):
+                shared = np.count_nonzero(engagement[:, column] * engagement[:, other])
+                if other == column or not shared:
+                    continue
+                cosine = engagement[:, column] @ engagement[:, other] / (
+                    np.linalg.norm(engagement[:, column]) * np.linalg.norm(engagement[:, other])
+                )
+                expected[other] = cosine * shared / (shared + SHRINKAGE)
+            best = sorted(expected, key=expected.get, reverse=True)[:3]
+            self.assertEqual([other for other, _ in neighbours[column]], best)
+            for other, score in neighbours[column]:
+                self.assertTrue(math.isclose(score, expected[other]))
+
+
+class RecommenderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [
+            User.objects.create_user(email=f'user{number}@example.com', username=f'user{number}', password='x')
+            for number in range(4)
+        ]
+        cls.videos = {
+            title: Video.objects.create(title=title, file=f'videos/{title}.mp4', uploader=cls.users[0], views=views)
+            for title, views in (('Guitar', 10), ('Piano', 5), ('Cooking', 50), ('Private', 0))
+        }
+        Video.objects.filter(pk=cls.videos['Private'].pk).update(privacy='private')
+
+    def watch(self, user, *titles):
+        for title in titles:
+            VideoView.objects.create(video=self.videos[title], user=user, ip_address='127.0.0.1')
+
+    def test_build_and_feed(self):
+        for user in self.users[1:]:
+            self.watch(user, 'Guitar', 'Piano', 'Private')
+        Like.objects.create(video=self.videos['Cooking'], user=self.users[3], like_type='like')
+        build = build_recommendations(top_k=5)
+        self.assertTrue(build.full)
+        self.assertFalse(SimilarVideo.objects.filter(similar=self.videos['Private']).exists())
+        similar = SimilarVideo.objects.filter(video=self.videos['Guitar']).order_by('-score')
+        self.assertEqual(similar[0].similar_id, self.videos['Piano'].pk)
+
+        # Trending by recent engagement (a like outweighs three views), then views
+        self.assertEqual(
+            home_feed(AnonymousUser(), 3),
+            [self.videos[title].pk for title in ('Cooking', 'Guitar', 'Piano')]
+        )
+        self.watch(self.users[0], 'Guitar')
+        self.assertEqual(home_feed(self.users[0], 2), [self.videos['Piano'].pk, self.videos['Cooking'].pk])
+
+    def test_incremental_build_only_updates_changed_videos(self):
+        self.watch(self.users[1], 'Guitar', 'Piano')
+        self.assertEqual(build_recommendations().videos_updated, 3)
+        build = build_recommendations()
+        self.assertFalse(build.full)
+        self.assertEqual(build.videos_updated, 0)
+        self.watch(self.users[2], 'Cooking')
+        self.assertEqual(build_recommendations().videos_updated, 1)
+
+
+class SuggestionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='chef', password='x')
+        cls.videos = [
+            Video.objects.create(
+                title=title, file=f'videos/{number}.mp4', uploader=cls.user, views=views, tags='Food, cooking'
+            )
+            for number, (title, views) in enumerate((('Crème brûlée', 10), ('Quick Crepes', 30), ('Cats', 5)))
+        ]
+
+    def setUp(self):
+        self.index = suggestions.SuggestionIndex(suggestions.collect_entries())
+        self.enterContext(mock.patch.object(suggestions, '_index', self.index))
+
+    def texts(self, query):
+        return [suggestion['text'] for suggestion in self.index.suggest(query)]
+
+    def test_prefixes_of_any_word_by_popularity(self):
+        self.assertEqual(self.texts('cr'), ['Quick Crepes', 'Crème brûlée'])
+        self.assertEqual(self.texts('CREME b'), ['Crème brûlée'])
+        self.assertEqual(self.texts('coo'), ['cooking'])
+        self.assertEqual(self.texts('che'), ['chef'])
+        self.assertEqual(self.texts('zz'), [])
+
+    def test_saved_videos_update_the_index(self):
+        video = self.videos[2]
+        video.title = 'Crazy cats'
+        video.save()
+        self.assertEqual(self.texts('cra'), ['Crazy cats'])
+        video.privacy = 'private'
+        video.save()
+        self.assertEqual(self.texts('cra'), [])
+        Video.objects.create(title='Crumble', file='videos/c.mp4', uploader=self.user)
+        self.assertIn('Crumble', self.texts('cr'))
+
+    def test_scheduled_deletions_leave_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_deletion(self.videos[1])
+        self.assertEqual(self.texts('cr'), ['Crème brûlée'])
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_deletion(self.user)
+        self.assertEqual(self.texts('cr'), [])
+        self.assertEqual(self.texts('che'), [])
+
+    def test_warm_index(self):
+        with mock.patch.object(suggestions, '_index', None), \
+                override_settings(SUGGEST_SNAPSHOT_PATH=os.path.join(tempfile.gettempdir(), 'missing.npz')):
+            suggestions.warm_index()
+            self.assertEqual(len(suggestions._index.entries), len(self.index.entries))
+
+
+@override_settings(STORYBOARD_INTERVAL=10, STORYBOARD_MAX_FRAMES=200, STORYBOARD_COLUMNS=2, STORYBOARD_ROWS=2)
+class StoryboardTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+
+    def setUp(self):
+        super().setUp()
+        self.video = Video.objects.create(
+            title='Clip', file=ContentFile(b'movie', name='clip.mp4'), uploader=self.user, duration=45
+        )
+
+    def extract_frames(self, path, interval, width, directory):
+        frames = []
+        for number in range(5):
+            frames.append(os.path.join(directory, f'frame{number:05d}.jpg'))
+            Image.new('RGB', (width * 2, width * 9 // 8), (number * 50, 0, 0)).save(frames[-1])
+        return frames
+
+    def sprite(self, board, number):
+        return '../' + os.path.relpath(board.sprites[number], 'storyboards')
+
+    def test_frame_interval(self):
+        self.assertEqual(storyboard.frame_interval(0), 10)
+        self.assertEqual(storyboard.frame_interval(600), 10)
+        self.assertEqual(storyboard.frame_interval(10000), 50)
+
+    def test_build(self):
+        with mock.patch.object(storyboard, 'extract_frames', self.extract_frames):
+            board = storyboard.build_storyboard(self.video)
+        self.assertEqual((board.frames, board.interval, board.tile_height), (5, 10, 90))
+        self.assertEqual(len(board.sprites), 2)
+        with Image.open(self.media_path(board.sprites[0])) as sheet:
+            self.assertEqual(sheet.size, (320, 180))
+        with Image.open(self.media_path(board.sprites[1])) as sheet:
+            self.assertEqual(sheet.size, (160, 90))
+
+        with board.vtt.open('rb') as vtt:
+            cues = vtt.read().decode().strip().split('\n\n')
+        self.assertEqual(cues[0], 'WEBVTT')
+        self.assertEqual(cues[4], f'00:00:30.000 --> 00:00:40.000\n{self.sprite(board, 0)}#xywh=160,90,160,90')
+        self.assertEqual(cues[5], f'00:00:40.000 --> 00:00:45.000\n{self.sprite(board, 1)}#xywh=0,0,160,90')
+
+        signed = storyboard.signed_vtt(board, lambda url: f'http://testserver{url}').decode()
+        self.assertNotIn('../', signed)
+        self.assertIn(f'http://testserver{board.vtt.storage.url(board.sprites[1])}#xywh=0,0,160,90', signed)
+
+    def test_failures_are_recorded_and_retried_on_request(self):
+        failure = subprocess.CalledProcessError(1, 'ffmpeg', stderr=b'Invalid data found')
+        with mock.patch.object(storyboard, 'extract_frames', side_effect=failure):
+            self.assertEqual(storyboard.build_pending(), (0, 1))
+        self.assertEqual(Storyboard.objects.get(video=self.video).error, 'Invalid data found')
+        with mock.patch.object(storyboard, 'extract_frames', self.extract_frames):
+            self.assertEqual(storyboard.build_pending(), (0, 0))
+            self.assertEqual(storyboard.build_pending(retry_failed=True), (1, 0))
+        self.assertEqual(Storyboard.objects.get(video=self.video).frames, 5)
+
+
+class SigningTests(SimpleTestCase):
+
+    def test_verify(self):
+        expires = signing.expires_at(now=1000)
+        given = signing.signature('videos/ab/ab.mp4', expires)
+        self.assertTrue(signing.verify('videos/ab/ab.mp4', str(expires), given, now=1000))
+        self.assertFalse(signing.verify('videos/ab/ac.mp4', str(expires), given, now=1000))
+        self.assertFalse(signing.verify('videos/ab/ab.mp4', str(expires + 1), given, now=1000))
+        self.assertFalse(signing.verify('videos/ab/ab.mp4', str(expires), given, now=expires + 1))
+        self.assertFalse(signing.verify('videos/ab/ab.mp4', 'soon', given, now=1000))
+
+    def test_signed_path(self):
+        path = signing.signed_path('thumbnails/cd/cd.jpg', 7200)
+        _, expires, given, name = path.split('/', 3)
+        self.assertEqual(name, 'thumbnails/cd/cd.jpg')
+        self.assertTrue(signing.verify(name, expires, given, now=0))
+
+
+class FileResponseTests(SimpleTestCase):
+
+    def setUp(self):
+        self.content = bytes(range(100))
+        file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        file.write(self.content)
+        file.close()
+        self.path = file.name
+        self.addCleanup(os.remove, self.path)
+
+    def get(self, range_header=None):
+        headers = {'HTTP_RANGE': range_header} if range_header is not None else {}
+        response = _file_response(RequestFactory().get('/', **headers), self.path)
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file(self):
+        for header in (None, '', 'bytes=-', 'bytes=a-b', 'items=0-1'):
+            response = self.get(header)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_ranges(self):
+        for header, start, end in [
+            ('bytes=10-19', 10, 19),
+            ('bytes=90-', 90, 99),
+            ('bytes=95-200', 95, 99),
+            ('bytes=-5', 95, 99),
+            ('bytes=-500', 0, 99),
+        ]:
+            response = self.get(header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/100')
+            self.assertEqual(b''.join(response.streaming_content), self.content[start:end + 1])
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=100-', 'bytes=20-10'):
+            response = self.get(header)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */100')
+
+
+class SignedMediaViewTests(TemporaryMediaMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.name = 'videos/ab/' + 'ab' * 32 + '.mp4'
+        os.makedirs(os.path.dirname(self.media_path(self.name)))
+        with open(self.media_path(self.name), 'wb') as media_file:
+            media_file.write(b'movie')
+
+    def get(self, expires, given, path):
+        request = RequestFactory().get('/')
+        return serve_signed_media(request, str(expires), given, path, document_root=self.media_root)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='')
+    def test_serve(self):
+        expires = signing.expires_at()
+        response = self.get(expires, signing.signature(self.name, expires), self.name)
+        self.addCleanup(response.close)
+        self.assertEqual(b''.join(response.streaming_content), b'movie')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get(expires, '0' * 32, self.name).status_code, 403)
+        expired = expires - 10 ** 6
+        self.assertEqual(self.get(expired, signing.signature(self.name, expired), self.name).status_code, 403)
+        with self.assertRaises(Http404):
+            self.get(expires, signing.signature('videos/../x', expires), 'videos/../x')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected/')
+    def test_accel_redirect(self):
+        expires = signing.expires_at()
+        response = self.get(expires, signing.signature(self.name, expires), self.name)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.name)
+        self.assertFalse(response.has_header('Content-Type'))
+
+    @override_settings(MEDIA_SIGNED_URLS=True)
+    def test_unsigned_urls_are_refused(self):
+        response = serve_media(RequestFactory().get('/'), self.name, document_root=self.media_root)
+        self.assertEqual(response.status_code, 403)
+
+
+class PresenceTrackerTests(SimpleTestCase):
+
+    def test_viewers_expire_without_heartbeats(self):
+        tracker = PresenceTracker(ttl=30)
+        tracker.beat('a', 'first', 0)
+        tracker.beat('a', 'second', 10)
+        tracker.beat('b', 'third', 10)
+        tracker.beat('a', 'first', 20)
+        tracker.expire(45)
+        self.assertEqual((tracker.count('a'), tracker.count('b')), (1, 0))
+        self.assertNotIn('b', tracker.videos)
+        tracker.leave('a', 'first')
+        self.assertEqual(tracker.count('a'), 0)
+
+
+@override_settings(PRESENCE_BROADCAST_INTERVAL=0.01, PRESENCE_TTL=45)
+class PresenceTests(SimpleTestCase):
+
+    async def connect(self, slug):
+        scope = {'type': 'websocket', 'path': f'/ws/videos/{slug}/presence/', 'headers': [], 'query_string': b''}
+        viewer = ApplicationCommunicator(URLRouter(websocket_urlpatterns), scope)
+        await viewer.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await viewer.receive_output())['type'], 'websocket.accept')
+        return viewer
+
+    async def receive(self, viewer):
+        return json.loads((await viewer.receive_output())['text'])
+
+    async def disconnect(self, viewer):
+        await viewer.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await viewer.wait()
+
+    def test_viewers_see_each_other(self):
+        async def scenario():
+            first = await self.connect('clip')
+            self.assertEqual((await self.receive(first))['count'], 1)
+            second = await self.connect('clip')
+            self.assertEqual((await self.receive(second))['count'], 2)
+            self.assertEqual(await self.receive(first), {'type': 'watching', 'count': 2})
+            await self.disconnect(second)
+            self.assertEqual(await self.receive(first), {'type': 'watching', 'count': 1})
+            await first.send_input({'type': 'websocket.receive', 'text': '{"type": "heartbeat"}'})
+            await self.disconnect(first)
+
+        async_to_sync(scenario)()
+
+    def test_counts_are_shared_between_nodes(self):
+        async def scenario():
+            layer = InMemoryChannelLayer()
+            hubs = [PresenceHub(layer), PresenceHub(layer)]
+            for hub in hubs:
+                # Stands in for a layer shared by several processes
+                hub.shared = True
+                await hub.start()
+            viewers = [mock.AsyncMock(), mock.AsyncMock(), mock.AsyncMock()]
+            await hubs[0].join('clip', viewers[0])
+            await hubs[1].join('clip', viewers[1])
+            await hubs[1].join('clip', viewers[2])
+            for _ in range(20):
+                await asyncio.sleep(0.01)
+            viewers[0].send_json.assert_called_with({'type': 'watching', 'count': 3})
+            await hubs[1].leave('clip', viewers[1])
+            await hubs[1].leave('clip', viewers[2])
+            for _ in range(20):
+                await asyncio.sleep(0.01)
+            viewers[0].send_json.assert_called_with({'type': 'watching', 'count': 1})
+            for hub in hubs:
+                for task in hub.tasks:
+                    task.cancel()
+
+        async_to_sync(scenario)()
+
+
+class ChunkWidthsTests(SimpleTestCase):
+
+    def test_widths_cover_the_hash(self):
+        for size in (0, 1, 1000, 10 ** 6, 10 ** 9):
+            self.assertEqual(sum(chunk_widths(size)), HASH_BITS)
+
+    def test_large_index_keeps_tables_small(self):
+        for size in (6 * 10 ** 7, 10 ** 9, 2 ** 63):
+            self.assertLessEqual(max(chunk_widths(size)), 22)
+
+    def test_small_index_uses_four_chunks(self):
+        self.assertEqual(chunk_widths(1000), [16, 16, 16, 16])
+        self.assertEqual(chunk_widths(10 ** 6), [22, 21, 21])
+
+
+@override_settings(FINGERPRINT_MAX_DISTANCE=10, FINGERPRINT_MATCH_RATIO=0.5, FINGERPRINT_MIN_MATCHES=2)
+class HashIndexTests(SimpleTestCase):
+
+    def brute_force(self, videos, hashes, radius=10):
+        needed = max(min(2, len(hashes)), -(-len(hashes) // 2))
+        found = {}
+        for video_id, indexed in videos.items():
+            closest = {}
+            for value in hashes:
+                distance = min(bin(value ^ other).count('1') for other in indexed)
+                if distance <= radius:
+                    closest[value] = distance
+            if len(closest) >= needed:
+                found[video_id] = (len(closest), sum(closest.values()) / len(closest))
+        return found
+
+    def near_copy(self, rng, value, bits):
+        for bit in rng.sample(range(HASH_BITS), bits):
+            value ^= 1 << bit
+        return value
+
+    def test_matches_agree_with_brute_force(self):
+        rng = random.Random(1)
+        videos = {f'v{number}': [rng.getrandbits(HASH_BITS) for _ in range(8)] for number in range(300)}
+        index = HashIndex()
+        for video_id, hashes in videos.items():
+            index.add(video_id, hashes, rebuild=False)
+        index.build()
+        matched = 0
+        for number in range(20):
+            source = videos[f'v{number * 7}']
+            query = [self.near_copy(rng, value, rng.randrange(0, 14)) for value in source[:6]]
+            query += [rng.getrandbits(HASH_BITS) for _ in range(2)]
+            expected = self.brute_force(videos, query)
+            self.assertEqual(index.matches(query), expected)
+            matched += bool(expected)
+        self.assertGreater(matched, 0)
+
+    def test_pending_and_replaced_hashes(self):
+        rng = random.Random(2)
+        first = [rng.getrandbits(HASH_BITS) for _ in range(4)]
+        index = HashIndex()
+        index.add('a', first, rebuild=False)
+        index.build()
+        # Added again with other hashes, not rebuilt yet
+        second = [rng.getrandbits(HASH_BITS) for _ in range(4)]
+        index.add('a', second)
+        self.assertEqual(index.matches(first), {})
+        self.assertEqual(index.matches(second), {'a': (4, 0.0)})
+        self.assertEqual(index.matches(second, exclude='a'), {})
+
+
+class KeyBetweenTests(SimpleTestCase):
+
+    def test_keys_sort_between_their_neighbours(self):
+        rng = random.Random(3)
+        keys = [playlists.key_between(None, None)]
+        for _ in range(2000):
+            position = rng.randrange(len(keys) + 1)
+            before = keys[position - 1] if position else None
+            after = keys[position] if position < len(keys) else None
+            key = playlists.key_between(before, after)
+            self.assertTrue(before is None or before < key)
+            self.assertTrue(after is None or key < after)
+            keys.insert(position, key)
+        self.assertEqual(keys, sorted(set(keys)))
+
+    def test_repeated_insertions_at_one_place(self):
+        low = playlists.key_between(None, None)
+        high = playlists.key_between(low, None)
+        for _ in range(200):
+            key = playlists.key_between(low, high)
+            self.assertTrue(low < key < high)
+            high = key
+
+    def test_no_key_between_equal_or_reversed_keys(self):
+        key = playlists.key_between(None, None)
+        with self.assertRaises(ValueError):
+            playlists.key_between(key, key)
+        with self.assertRaises(ValueError):
+            playlists.key_between(playlists.key_between(key, None), key)
+
+    def test_keys_after(self):
+        for before in (None, playlists.key_between(None, None), 'zzzzzz'):
+            keys = playlists.keys_after(before, 50)
+            self.assertEqual(len(keys), 50)
+            self.assertEqual(keys, sorted(set(keys)))
+            self.assertTrue(before is None or before < keys[0])
+
+
+class PlaylistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='x')
+        cls.videos = [
+            Video.objects.create(title=f'Video {number}', file=f'videos/{number}.mp4', uploader=cls.user)
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        self.playlist = Playlist.objects.create(owner=self.user, title='Mix')
+        playlists.append_videos(self.playlist, [video.pk for video in self.videos], self.user)
+
+    def order(self):
+        items = PlaylistItem.objects.filter(playlist=self.playlist).order_by('rank', 'id')
+        return [self.videos.index(item.video) for item in items.select_related('video')]
+
+    def item(self, number):
+        return PlaylistItem.objects.get(playlist=self.playlist, video=self.videos[number])
+
+    def test_move_item(self):
+        playlists.move_item(self.item(4))
+        self.assertEqual(self.order(), [4, 0, 1, 2, 3])
+        playlists.move_item(self.item(0), after=self.item(2))
+        self.assertEqual(self.order(), [4, 1, 2, 0, 3])
+        playlists.move_item(self.item(4), after=self.item(3))
+        self.assertEqual(self.order(), [1, 2, 0, 3, 4])
+
+    def test_move_item_between_tied_ranks(self):
+        PlaylistItem.objects.filter(playlist=self.playlist).update(rank='i00000')
+        first, second = PlaylistItem.objects.filter(playlist=self.playlist).order_by('rank', 'id')[:2]
+        playlists.move_item(self.item(4), after=first)
+        items = PlaylistItem.objects.filter(playlist=self.playlist).order_by('rank', 'id')
+        self.assertEqual(list(items.values_list('pk', flat=True))[:3], [first.pk, self.item(4).pk, second.pk])
+
+    @override_settings(PLAYLIST_MAX_ITEMS=6)
+    def test_deleted_videos_do_not_count_towards_the_cap(self):
+        extra = [
+            Video.objects.create(title=f'Extra {number}', file=f'videos/e{number}.mp4', uploader=self.user)
+            for number in range(2)
+        ]
+        with self.assertRaises(ValueError):
+            playlists.append_videos(self.playlist, [video.pk for video in extra], self.user)
+        Video.objects.filter(pk=self.videos[0].pk).update(deleted_at=timezone.now())
+        self.assertEqual(playlists.append_videos(self.playlist, [video.pk for video in extra], self.user), 2)
+
+    def test_deleting_the_owner_deletes_the_playlists(self):
+        other = get_user_model().objects.create_user(email='other@example.com', username='other', password='x')
+        video = Video.objects.create(title='Elsewhere', file='videos/other.mp4', uploader=other)
+        favourites = Playlist.objects.create(owner=self.user, title='Favourites')
+        playlists.append_videos(favourites, [video.pk], self.user)
+        job = schedule_deletion(self.user)
+        run_job(job, log=lambda message: None)
+        job.refresh_from_db()
+        self.assertEqual(job.progress['video playlist items'], 5)
+        self.assertEqual((job.progress['playlist items'], job.progress['playlists']), (1, 2))
+        self.assertFalse(Playlist.objects.exists())
+        self.assertTrue(Video.objects.filter(pk=video.pk).exists())
+
+
+class CaptionTests(SimpleTestCase):
+
+    def test_parse_webvtt(self):
+        lines = [
+            'WEBVTT', '', 'NOTE a comment', '',
+            'intro', '00:00:01.000 --> 00:00:02.500 align:start', '<v Anna>Hello</v> &amp; welcome', 'back', '',
+            '01:02:03.004 --> 01:02:02.000', '<i>Ends before it starts</i>',
+        ]
+        self.assertEqual(list(captions.parse_cues(lines)), [
+            (1000, 2500, 'Hello & welcome back'),
+            (3723004, 3723004, 'Ends before it starts'),
+        ])
+
+    def test_parse_srt(self):
+        lines = ['1', '00:00:01,000 --> 00:00:02,000', '{\\an8}Top', '', '2', '00:00:03,000 --> 00:00:04,000', '', '']
+        self.assertEqual(list(captions.parse_cues(lines)), [(1000, 2000, 'Top')])
+
+    def test_intersect(self):
+        rng = np.random.default_rng(4)
+        lists = [np.unique(rng.integers(0, 5000, size)) for size in (300, 3000, 1500)]
+        lists.sort(key=len)
+        expected = sorted(set(lists[0].tolist()).intersection(*(set(postings.tolist()) for postings in lists[1:])))
+        with mock.patch.object(captions, 'INTERSECT_BLOCK', 16):
+            for limit in (1, 5, len(expected), 10 ** 6):
+                self.assertEqual(captions._intersect(lists, limit).tolist(), expected[:limit])
+        empty = np.array([], dtype=np.int64)
+        self.assertEqual(captions._intersect([empty, lists[0]], 10).tolist(), [])
+
+
+class CaptionSearchTests(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='up@example.com', username='up', password='x')
+        cls.cooking = Video.objects.create(title='Cooking', file='videos/a.mp4', uploader=cls.user)
+        cls.baking = Video.objects.create(title='Baking', file='videos/b.mp4', uploader=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(captions, '_index', None))
+        self.enterContext(override_settings(CAPTION_INDEX_PATH=self.media_path('missing.pickle')))
+
+    def upload(self, video, text, language='en'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return captions.import_track(video, io.BytesIO(text.encode()), language)
+
+    def search(self, query):
+        return APIClient().get('/api/search/captions/', {'q': query}).json()['results']
+
+    def test_import_writes_webvtt(self):
+        track = self.upload(self.cooking, '1\n00:00:01,000 --> 00:00:02,000\nHeat the <b>pan</b>\n')
+        self.assertEqual(track.cues_count, 1)
+        with track.file.open('rb') as vtt:
+            self.assertEqual(vtt.read(), b'WEBVTT\n\n00:00:01.000 --> 00:00:02.000\nHeat the pan\n')
+        with self.assertRaises(ValueError):
+            self.upload(self.cooking, 'no cues here')
+
+    def test_search(self):
+        self.upload(self.cooking, 'WEBVTT\n\n00:00:01.000 --> 00:00:02.000\nHeat the pan\n\n'
+                                  '00:00:05.000 --> 00:00:06.000\nthe pan is hot\n')
+        self.upload(self.baking, 'WEBVTT\n\n00:00:03.000 --> 00:00:04.000\nGrease the pan\n')
+        captions.get_index()
+        results = self.search('the PAN')
+        self.assertEqual([result['video']['slug'] for result in results], [self.cooking.slug, self.baking.slug])
+        self.assertEqual(results[0]['matches'], 2)
+        self.assertEqual(results[0]['hits'][0], {'start': 1.0, 'end': 2.0, 'text': 'Heat the pan', 'language': 'en'})
+        self.assertEqual(self.search('pan oven'), [])
+
+        # Tracks uploaded after the build are added; replaced cues are gone
+        self.upload(self.baking, 'WEBVTT\n\n00:00:03.000 --> 00:00:04.000\nPreheat the oven\n')
+        self.assertEqual([result['video']['slug'] for result in self.search('oven')], [self.baking.slug])
+        self.assertEqual([result['video']['slug'] for result in self.search('pan')], [self.cooking.slug])
+        Video.objects.filter(pk=self.cooking.pk).update(privacy='private')
+        self.assertEqual(self.search('pan'), [])
 
-# Create your tests here.
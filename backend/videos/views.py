@@ -1,3 +1,116 @@
-from django.shortcuts import render
+import mimetypes
+import os
+import posixpath
+import re
+import time
 
-# Create your views here.
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+
+from . import signing
+from .storage import media_storage
+
+# A year, the longest lifetime caches honour
+IMMUTABLE_MAX_AGE = 31536000
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def serve_media(request, path, document_root=None):
+    """
+    ``django.views.static.serve`` for MEDIA_ROOT, marking content-addressed
+    files (videos, thumbnails, storyboards) as immutable. A web server
+    serving MEDIA_URL in production should send the same header for paths
+    of the form ``<dir>/<ab>/<ab...64 hex digits>.<ext>``.
+
+    With MEDIA_SIGNED_URLS those files are only served through signed URLs
+    (``serve_signed_media``), and the web server must not serve them
+    directly either.
+    """
+    digest = getattr(media_storage(), 'digest', None)
+    if settings.MEDIA_SIGNED_URLS and digest and digest(path):
+        return HttpResponseForbidden()
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and digest and digest(path):
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+
+@require_safe
+def serve_signed_media(request, expires, signature, path, document_root=None):
+    """
+    A media file behind a signed URL (see videos/signing.py). The signature
+    is checked without touching the database, then the file is handed to
+    the web server with MEDIA_ACCEL_REDIRECT or streamed, byte ranges
+    included. Browsers may keep it until the URL expires.
+    """
+    normalized = posixpath.normpath(path)
+    if normalized != path or normalized.startswith(('.', '/')):
+        raise Http404
+    if not signing.verify(path, expires, signature):
+        return HttpResponseForbidden()
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse()
+        # nginx sets the type of the file it sends
+        del response['Content-Type']
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + path
+    else:
+        try:
+            full_path = safe_join(document_root, path)
+        except ValueError:
+            raise Http404
+        if not os.path.isfile(full_path):
+            raise Http404
+        response = _file_response(request, full_path)
+    max_age = max(int(expires) - int(time.time()), 0)
+    response['Cache-Control'] = f'private, max-age={max_age}, immutable'
+    return response
+
+
+def _file_response(request, full_path):
+    """
+    The file at ``full_path``, or the single byte range asked for with a
+    ``Range`` header, which video players seek with.
+    """
+    size = os.path.getsize(full_path)
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if not match or match.groups() == ('', ''):
+        response = FileResponse(open(full_path, 'rb'))
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    response = StreamingHttpResponse(
+        _read_range(full_path, start, end - start + 1), status=206,
+        content_type=content_type or 'application/octet-stream',
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _read_range(full_path, start, length):
+    with open(full_path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
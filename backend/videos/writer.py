@@ -0,0 +1,107 @@
+"""
+Single serialized writer for write-heavy endpoints.
+
+SQLite allows one writer at a time, so concurrent request threads that all
+try to write mostly wait on each other's locks and fail with "database is
+locked". Instead, those writes are handed to one background thread per
+process which drains the queue and commits a batch of them in a single
+transaction. Enabled with the ``SERIALIZED_WRITES`` setting; when it is off
+``run_write`` simply calls the function in the caller's thread.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of queued writes committed in one transaction
+MAX_BATCH_SIZE = 100
+
+
+class SerializedWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='serialized-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with transaction.atomic():
+                for future, func, args, kwargs in batch:
+                    # Each write gets a savepoint so that one failing write
+                    # does not roll back the rest of the batch.
+                    try:
+                        with transaction.atomic():
+                            results.append((future, func(*args, **kwargs), None))
+                    except Exception as exc:
+                        results.append((future, None, exc))
+        except Exception as exc:
+            logger.exception('Serialized write batch failed')
+            for future, _, _, _ in batch:
+                future.set_exception(exc)
+            return
+
+        for future, result, exc in results:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+
+writer = SerializedWriter()
+
+
+def run_write(func, *args, wait=True, **kwargs):
+    """
+    Run ``func`` through the serialized writer when it is enabled.
+
+    With ``wait=False`` the write is fire-and-forget and ``None`` is returned.
+    """
+    if not settings.SERIALIZED_WRITES:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+
+    future = writer.submit(func, *args, **kwargs)
+    if wait:
+        return future.result()
+    future.add_done_callback(_log_failure)
+    return None
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error('Serialized write failed', exc_info=exc)
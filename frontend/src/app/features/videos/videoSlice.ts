@@ -38,6 +38,15 @@ export interface Video {
   };
   tags: string;
   is_liked?: boolean;
+  // Matching caption cues, on search results found by their transcript
+  captions?: CaptionHit[];
+}
+
+export interface CaptionHit {
+  start: number;
+  end: number;
+  text: string;
+  language: string;
 }
 
 export interface Category {
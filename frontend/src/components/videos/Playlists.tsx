@@ -0,0 +1,112 @@
+import React, { useEffect, useState } from 'react';
+import api from '../../utils/api';
+import { Video } from '../../types/video';
+import VideoGrid from './VideoGrid';
+
+export interface Playlist {
+  id: string;
+  title: string;
+  description: string;
+  privacy: 'public' | 'private' | 'unlisted';
+  items_count: number;
+  updated_at: string;
+}
+
+interface PlaylistItem {
+  id: number;
+  rank: string;
+  video: Video;
+  added_at: string;
+}
+
+// One page of a playlist's videos at a time; `next` is the cursor URL of the
+// following page
+const PlaylistVideos: React.FC<{ playlist: Playlist }> = ({ playlist }) => {
+  const [items, setItems] = useState<PlaylistItem[]>([]);
+  const [next, setNext] = useState<string | null>(null);
+  const [isLoading, setIsLoading] = useState(true);
+
+  const load = (url: string, append: boolean) => {
+    setIsLoading(true);
+    api.get(url)
+      .then((response) => {
+        setItems((current) => (append ? [...current, ...response.data.results] : response.data.results));
+        setNext(response.data.next);
+      })
+      .finally(() => setIsLoading(false));
+  };
+
+  useEffect(() => {
+    load(`/api/playlists/${playlist.id}/items/`, false);
+  }, [playlist.id]);
+
+  return (
+    <div>
+      <VideoGrid
+        videos={items.map((item) => item.video)}
+        isLoading={isLoading && items.length === 0}
+        emptyMessage="This playlist is empty."
+      />
+      {next && (
+        <button
+          className="mt-4 px-4 py-2 rounded bg-gray-200 dark:bg-gray-700"
+          disabled={isLoading}
+          onClick={() => load(next, true)}
+        >
+          {isLoading ? 'Loading...' : 'Load more'}
+        </button>
+      )}
+    </div>
+  );
+};
+
+const Playlists: React.FC = () => {
+  const [playlists, setPlaylists] = useState<Playlist[]>([]);
+  const [selected, setSelected] = useState<Playlist | null>(null);
+  const [title, setTitle] = useState('');
+
+  useEffect(() => {
+    api.get('/api/playlists/')
+      .then((response) => setPlaylists(response.data.results))
+      .catch(() => setPlaylists([]));
+  }, []);
+
+  const create = (event: React.FormEvent) => {
+    event.preventDefault();
+    if (!title.trim()) return;
+    api.post('/api/playlists/', { title: title.trim() }).then((response) => {
+      setPlaylists((current) => [response.data, ...current]);
+      setTitle('');
+    });
+  };
+
+  return (
+    <div>
+      <form onSubmit={create} className="flex gap-2 mb-4">
+        <input
+          value={title}
+          onChange={(event) => setTitle(event.target.value)}
+          placeholder="New playlist"
+          className="px-3 py-2 rounded border dark:bg-gray-800 dark:border-gray-600"
+        />
+        <button type="submit" className="px-4 py-2 rounded bg-red-600 text-white">Create</button>
+      </form>
+      <div className="flex flex-wrap gap-2 mb-4">
+        {playlists.map((playlist) => (
+          <button
+            key={playlist.id}
+            onClick={() => setSelected(selected?.id === playlist.id ? null : playlist)}
+            className={`px-3 py-1 rounded-full ${
+              selected?.id === playlist.id ? 'bg-red-600 text-white' : 'bg-gray-200 dark:bg-gray-700'
+            }`}
+          >
+            {playlist.title} ({playlist.items_count})
+          </button>
+        ))}
+      </div>
+      {selected && <PlaylistVideos playlist={selected} />}
+    </div>
+  );
+};
+
+export default Playlists;
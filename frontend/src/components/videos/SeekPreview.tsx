@@ -0,0 +1,78 @@
+import React, { useEffect, useState } from 'react';
+import api from '../../utils/api';
+
+export interface Storyboard {
+  vtt: string;
+  sprites: string[];
+  interval: number;
+  frames: number;
+  tile_width: number;
+  tile_height: number;
+  columns: number;
+  rows: number;
+}
+
+// Fetches the storyboard of a video once; null while loading or when the
+// video has none (yet)
+export const useStoryboard = (slug?: string): Storyboard | null => {
+  const [storyboard, setStoryboard] = useState<Storyboard | null>(null);
+
+  useEffect(() => {
+    let cancelled = false;
+    setStoryboard(null);
+    if (slug) {
+      api.get(`/api/videos/${slug}/storyboard/`)
+        .then((response) => {
+          if (!cancelled) setStoryboard(response.data);
+        })
+        .catch(() => {
+          // No preview, the seek bar works as before
+        });
+    }
+    return () => {
+      cancelled = true;
+    };
+  }, [slug]);
+
+  return storyboard;
+};
+
+interface SeekPreviewProps {
+  storyboard: Storyboard | null;
+  duration: number;
+  // Horizontal position of the pointer on the seek bar, 0 to 1
+  position: number | null;
+  formatTime: (seconds: number) => string;
+}
+
+// Frame preview above the seek bar, cut out of the storyboard sprite sheets:
+// hovering only swaps background positions on images the browser already has
+const SeekPreview: React.FC<SeekPreviewProps> = ({ storyboard, duration, position, formatTime }) => {
+  if (!storyboard || position === null || !duration) return null;
+
+  const time = position * duration;
+  const frame = Math.min(Math.floor(time / storyboard.interval), storyboard.frames - 1);
+  const perSheet = storyboard.columns * storyboard.rows;
+  const tile = frame % perSheet;
+  const x = (tile % storyboard.columns) * storyboard.tile_width;
+  const y = Math.floor(tile / storyboard.columns) * storyboard.tile_height;
+
+  return (
+    <div
+      className="absolute bottom-full mb-2 -translate-x-1/2 pointer-events-none rounded overflow-hidden shadow-lg border border-gray-700 bg-black"
+      style={{ left: `${position * 100}%` }}
+    >
+      <div
+        style={{
+          width: storyboard.tile_width,
+          height: storyboard.tile_height,
+          backgroundImage: `url(${storyboard.sprites[Math.floor(frame / perSheet)]})`,
+          backgroundPosition: `-${x}px -${y}px`,
+        }}
+      />
+      <div className="text-center text-xs text-white py-0.5">{formatTime(time)}</div>
+    </div>
+  );
+};
+
+export default SeekPreview;
@@ -0,0 +1,40 @@
+import { useEffect, useState } from 'react';
+
+const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:8000';
+const WS_BASE_URL = API_BASE_URL.replace(/^http/, 'ws');
+
+// Number of people with the video open right now, kept up to date over a
+// WebSocket; null until known or when live counts are unavailable
+export const useWatchingNow = (slug?: string): number | null => {
+  const [count, setCount] = useState<number | null>(null);
+
+  useEffect(() => {
+    setCount(null);
+    if (!slug || typeof WebSocket === 'undefined') return;
+
+    const socket = new WebSocket(`${WS_BASE_URL}/ws/videos/${slug}/presence/`);
+    let heartbeat: ReturnType<typeof setInterval> | undefined;
+
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type !== 'watching') return;
+      setCount(message.count);
+      if (message.heartbeat && heartbeat === undefined) {
+        heartbeat = setInterval(() => {
+          if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'heartbeat' }));
+          }
+        }, message.heartbeat * 1000);
+      }
+    };
+    socket.onclose = () => setCount(null);
+
+    return () => {
+      if (heartbeat !== undefined) clearInterval(heartbeat);
+      socket.onclose = null;
+      socket.close();
+    };
+  }, [slug]);
+
+  return count;
+};
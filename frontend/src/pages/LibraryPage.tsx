@@ -2,6 +2,7 @@ import React, { useEffect } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { RootState } from '../app/store';
 import VideoGrid from '../components/videos/VideoGrid';
+import Playlists from '../components/videos/Playlists';
 import { fetchUserVideos } from '../app/features/videos/videoSlice';
 
 const LibraryPage: React.FC = () => {
@@ -23,6 +24,8 @@ const LibraryPage: React.FC = () => {
         isLoading={isLoading}
         emptyMessage="You haven't uploaded any videos yet."
       />
+      <h2 className="text-xl font-bold mt-8 mb-4">Playlists</h2>
+      <Playlists />
     </div>
   );
 };
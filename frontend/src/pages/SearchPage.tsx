@@ -1,11 +1,12 @@
 import React, { useEffect, useState } from 'react';
-import { Link, useLocation } from 'react-router-dom';
+import { Link, useLocation, useNavigate } from 'react-router-dom';
 import { useDispatch, useSelector } from 'react-redux';
 import { RootState } from '../app/store';
 import { searchVideos, fetchCategories, Video } from '../app/features/videos/videoSlice';
 
 const SearchPage: React.FC = () => {
   const location = useLocation();
+  const navigate = useNavigate();
   const dispatch = useDispatch();
   const { searchResults, isLoading, categories } = useSelector((state: RootState) => state.videos);
   
@@ -56,6 +57,14 @@ const SearchPage: React.FC = () => {
     return views.toString();
   };
   
+  // Format a caption start time as M:SS or H:MM:SS
+  const formatTime = (seconds: number) => {
+    const h = Math.floor(seconds / 3600);
+    const m = Math.floor((seconds % 3600) / 60);
+    const s = Math.floor(seconds % 60).toString().padStart(2, '0');
+    return h > 0 ? `${h}:${m.toString().padStart(2, '0')}:${s}` : `${m}:${s}`;
+  };
+  
   // Format date
   const formatDate = (dateString: string) => {
     const date = new Date(dateString);
@@ -230,6 +239,20 @@ const SearchPage: React.FC = () => {
                       <p className="text-sm text-gray-600 dark:text-gray-400 mt-2 line-clamp-2">
                         {video.description}
                       </p>
+                      {video.captions?.map((hit) => (
+                        <p key={`${hit.language}-${hit.start}`} className="text-sm text-gray-600 dark:text-gray-400 mt-1">
+                          <span
+                            className="text-blue-600 dark:text-blue-400 hover:underline mr-2"
+                            onClick={(e) => {
+                              e.preventDefault();
+                              navigate(`/video/${video.slug}?t=${Math.floor(hit.start)}`);
+                            }}
+                          >
+                            {formatTime(hit.start)}
+                          </span>
+                          {hit.text}
+                        </p>
+                      ))}
                     </div>
                   </div>
                 </Link>
@@ -1,5 +1,5 @@
 import React, { useEffect, useState, useRef } from 'react';
-import { useParams, Link, useNavigate } from 'react-router-dom';
+import { useParams, Link, useNavigate, useLocation } from 'react-router-dom';
 import { useDispatch, useSelector } from 'react-redux';
 import ReactPlayer from 'react-player';
 import { RootState } from '../app/store';
@@ -12,10 +12,13 @@ import {
   Video,
   Comment 
 } from '../app/features/videos/videoSlice';
+import SeekPreview, { useStoryboard } from '../components/videos/SeekPreview';
+import { useWatchingNow } from '../components/videos/WatchingNow';
 
 const VideoPage: React.FC = () => {
   const { slug } = useParams<{ slug: string }>();
   const navigate = useNavigate();
+  const location = useLocation();
   const dispatch = useDispatch();
   const playerRef = useRef<ReactPlayer>(null);
   const [isPlaying, setIsPlaying] = useState(false);
@@ -24,6 +27,9 @@ const VideoPage: React.FC = () => {
   const [seeking, setSeeking] = useState(false);
   const [volume, setVolume] = useState(0.8);
   const [muted, setMuted] = useState(false);
+  const [hoverPosition, setHoverPosition] = useState<number | null>(null);
+  const storyboard = useStoryboard(slug);
+  const watchingNow = useWatchingNow(slug);
   
   const { 
     currentVideo, 
@@ -83,6 +89,14 @@ const VideoPage: React.FC = () => {
     }
   };
   
+  // Start at ?t=<seconds>, as linked from caption search results
+  const handleReady = () => {
+    const start = parseFloat(new URLSearchParams(location.search).get('t') || '');
+    if (start > 0 && playerRef.current) {
+      playerRef.current.seekTo(start, 'seconds');
+    }
+  };
+  
   const handleSeekChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     setPlayed(parseFloat(e.target.value));
   };
@@ -98,6 +112,11 @@ const VideoPage: React.FC = () => {
     }
   };
   
+  const handleSeekHover = (e: React.MouseEvent<HTMLInputElement>) => {
+    const rect = e.currentTarget.getBoundingClientRect();
+    setHoverPosition(Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1));
+  };
+  
   const handleVolumeChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     const newVolume = parseFloat(e.target.value);
     setVolume(newVolume);
@@ -293,6 +312,7 @@ const VideoPage: React.FC = () => {
                 volume={muted ? 0 : volume}
                 onProgress={handleProgress}
                 onDuration={setDuration}
+                onReady={handleReady}
                 onPlay={() => setIsPlaying(true)}
                 onPause={() => setIsPlaying(false)}
                 onError={(e) => {
@@ -310,7 +330,13 @@ const VideoPage: React.FC = () => {
               {/* Custom Controls */}
               <div className="absolute bottom-0 left-0 right-0 bg-gradient-to-t from-black/80 to-transparent p-4">
                 {/* Progress Bar */}
-                <div className="flex items-center mb-2">
+                <div className="relative flex items-center mb-2">
+                  <SeekPreview
+                    storyboard={storyboard}
+                    duration={duration}
+                    position={hoverPosition}
+                    formatTime={formatTime}
+                  />
                   <input
                     type="range"
                     min={0}
@@ -320,6 +346,8 @@ const VideoPage: React.FC = () => {
                     onChange={handleSeekChange}
                     onMouseDown={handleSeekMouseDown}
                     onMouseUp={handleSeekMouseUp}
+                    onMouseMove={handleSeekHover}
+                    onMouseLeave={() => setHoverPosition(null)}
                     className="w-full h-1.5 bg-gray-700 rounded-full appearance-none cursor-pointer"
                     style={{
                       background: `linear-gradient(to right, #3b82f6 0%, #3b82f6 ${played * 100}%, #4b5563 ${played * 100}%, #4b5563 100%)`
@@ -415,6 +443,12 @@ const VideoPage: React.FC = () => {
               <span>{formatViews(currentVideo.views)} views</span>
               <span className="mx-2">•</span>
               <span>{formatDate(currentVideo.created_at)}</span>
+              {watchingNow !== null && watchingNow > 0 && (
+                <>
+                  <span className="mx-2">•</span>
+                  <span className="text-red-600 dark:text-red-400">{formatViews(watchingNow)} watching now</span>
+                </>
+              )}
             </div>
             
             <div className="flex items-center space-x-4 mt-2 sm:mt-0">
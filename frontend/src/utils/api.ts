@@ -9,6 +9,10 @@ const api = axios.create({
   },
 });
 
+// After a write the server asks, in X-Primary-Pin, to read from the primary
+// database for that many seconds, so we see our own writes
+let primaryPinUntil = 0;
+
 // Request interceptor to add auth token and handle FormData
 api.interceptors.request.use(
   (config) => {
@@ -17,6 +21,10 @@ api.interceptors.request.use(
       config.headers['Authorization'] = `Bearer ${token}`;
     }
     
+    if (Date.now() < primaryPinUntil) {
+      config.headers['X-Primary-Pin'] = '1';
+    }
+    
     // Remove Content-Type header for FormData to let the browser set it with the correct boundary
     if (config.data instanceof FormData) {
       delete config.headers['Content-Type'];
@@ -32,6 +40,10 @@ api.interceptors.request.use(
 // Response interceptor to handle errors globally
 api.interceptors.response.use(
   (response) => {
+    const pin = parseInt(response.headers['x-primary-pin'] || '', 10);
+    if (pin > 0) {
+      primaryPinUntil = Date.now() + pin * 1000;
+    }
     return response;
   },
   (error) => {